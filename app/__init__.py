@@ -13,9 +13,13 @@ from flask_bcrypt import \
 from flask_cors import \
       CORS # Permite que o front-end acesse o back-end em todos os navegadores
 
+from app.services.database import \
+    RoutingSession, configure_database  # PostgreSQL com pool e réplica de leitura
+
 
 # Step 1: cria as instancias
-db = SQLAlchemy()  # para banco de dados
+# Explicação: a sessão escolhe o banco (primário ou réplica de leitura) de cada consulta
+db = SQLAlchemy(session_options={"class_": RoutingSession})  # para banco de dados
 migrate = Migrate()  # para migrations do banco de dados
 login_manager = LoginManager()  # para gerenciar logins
 bcrypt = Bcrypt()   # para criptografia
@@ -36,6 +40,9 @@ def create_app():
             "Voce precisa criar um arquivo .env com uma chave segura para o SECRET_KEY"
         )
 
+    # Step 2.3.1: URL do banco, pool de conexões e réplica de leitura (PostgreSQL)
+    configure_database(app)
+
     # Step 2.4: tribui as variaveis das instancias
     db.init_app(app)
     migrate.init_app(app, db)
@@ -44,6 +51,26 @@ def create_app():
     )  # Explicação: diz ao login_manager qual app ele vai gerenciar
     bcrypt.init_app(app) 
 
+    # Step 2.4.0: WAL, busy_timeout e PRAGMAs nas conexões SQLite
+    from app.services.sqlite_profile import sqlite_profile
+    sqlite_profile.init_app(app)
+
+    # Step 2.4.1: fila de tarefas em segundo plano (respostas do Gemini)
+    from app.services.job_queue import job_queue
+    job_queue.init_app(app)
+
+    # Step 2.4.2: comando `flask archive-conversations` (arquivo frio das conversas antigas)
+    from app.services.archive import archive_command
+    app.cli.add_command(archive_command)
+
+    # Step 2.4.3: comando `flask render-messages` (HTML salvo das mensagens antigas)
+    from app.services.rendering import render_command
+    app.cli.add_command(render_command)
+
+    # Step 2.4.4: arquivos estáticos com hash no nome (`asset_url()` e `flask build-assets`)
+    from app.services import assets
+    assets.init_app(app)
+
     # Step 2.5: configurações do LoginManager
     login_manager.login_view = (
         "auth.login"  # explicação: Onde mandar usuários não logados
@@ -53,12 +80,14 @@ def create_app():
     # Step 2.6: Importar e registrar os blueprints (rotas)
     # explicação: importante essas importações estarem dentro da Função
     # para evitar erros de circulação de importe
-    from app.routes import home_bp, auth_bp, minha_conta_bp, sobre_bp
+    from app.routes import home_bp, auth_bp, minha_conta_bp, sobre_bp, api_bp
 
     # Step 2.7: registra os blueprints
     app.register_blueprint(home_bp)  # Pagina inicial deve ser direta e sem prefixo
     app.register_blueprint(auth_bp, url_prefix="/auth")  # Prefixo para todas as rota
     app.register_blueprint(minha_conta_bp, url_prefix='/minha-conta') 
     app.register_blueprint(sobre_bp)
+    app.register_blueprint(api_bp, url_prefix="/api/v1")  # Explicação: API JSON versionada
+    login_manager.blueprint_login_views["api"] = None  # Explicação: sem login a API responde 401, sem redirect
 
     return app
@@ -10,11 +10,19 @@ from flask_login import (
 )  # é uma classe do Flask-Login que fornece implementações padrão,
 
 from app import db, login_manager, bcrypt
+from app.services.rendering import message_html
+from app.services.user_cache import user_cache
 
 # Step 1: função necessária para o Flask-Login
+# Explicação: roda em toda requisição autenticada, então passa antes pelo cache do processo
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    user = user_cache.get(int(user_id))
+    if user is None:
+        user = User.query.filter_by(id=int(user_id), deleted_at=None).first()
+        if user is not None:
+            user_cache.set(user)
+    return user
 
 # Step 2:  Herda de UserMixin (login) e db.Model (banco de dados)
 class User(UserMixin, db.Model):
@@ -37,6 +45,10 @@ class User(UserMixin, db.Model):
     # Step 2.6: # Data de criacao coluna
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
+    # Step 2.6.1: marcada quando a conta é apagada e a limpeza dos dados ainda roda em segundo plano
+    # Explicação: a conta some na hora (login e sessão deixam de valer) mesmo antes da remoção das linhas
+    deleted_at = db.Column(db.DateTime)
+
     # Step 2.7: Relacionamento com as conversas do usuário
     conversations = db.relationship('Conversation', 
                                   backref='user', 
@@ -83,6 +95,20 @@ class Conversation(db.Model):
     # Step 3.6: chave estrangeira para o usuário dono da conversa
     user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
 
+    # Step 3.6.1: total de tokens usados na conversa (atualizado a cada turno)
+    # Explicação: orçamento, cotas e estatísticas viram uma leitura O(1)
+    total_tokens = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    # Step 3.6.2: resumo da conversa, atualizado junto com cada mensagem salva
+    # Explicação: a lista de conversas mostra contagem e prévia sem consultar `messages`
+    PREVIEW_CHARS = 120
+    message_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    last_message_at = db.Column(db.DateTime)
+    last_message_preview = db.Column(db.String(PREVIEW_CHARS))
+
+    # Step 3.6.3: quando as mensagens foram comprimidas para o arquivo frio (None = mensagens em `messages`)
+    archived_at = db.Column(db.DateTime)
+
     # Step 3.7: relacionamento com as mensagens da conversa
     messages = db.relationship('Message', 
                               backref='conversation', 
@@ -94,6 +120,12 @@ class Conversation(db.Model):
     def __repr__(self):
         return f"<Conversation {self.title}>"
 
+    # Step 3.9: índice da lista de conversas do usuário (mais recentes primeiro)
+    # Explicação: filtra por user_id e já devolve em ordem de updated_at, sem sort
+    __table_args__ = (
+        db.Index('ix_conversations_user_id_updated_at', 'user_id', 'updated_at'),
+    )
+
 
 # Step 4:  Herda de db.Model
 class Message(db.Model):
@@ -107,6 +139,9 @@ class Message(db.Model):
     # Step 4.3: Conteúdo da mensagem - texto longo
     content = db.Column(db.Text, nullable=False)
 
+    # Step 4.3.1: HTML do conteúdo (Markdown limpo), gerado uma vez ao salvar a mensagem
+    content_html = db.Column(db.Text)
+
     # Step 4.4: Data e hora quando a mensagem foi enviada
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
@@ -116,6 +151,133 @@ class Message(db.Model):
     # Step 4.6: chave estrangeira para a conversa
     conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id', ondelete='CASCADE'), nullable=False)
 
-    # Step 4.7: Metodos para representação em texto (debug)
+    # Step 4.7: estado do turno - 'pending' (aguardando o Gemini), 'complete' ou 'failed'
+    # Explicação: cada etapa do envio é salva em uma transação curta, então um
+    # crash no meio deixa o turno como 'pending' em vez de um estado inconsistente
+    STATUS_PENDING = 'pending'
+    STATUS_COMPLETE = 'complete'
+    STATUS_FAILED = 'failed'
+    status = db.Column(db.String(20), nullable=False, default=STATUS_COMPLETE, server_default=STATUS_COMPLETE)
+
+    # Step 4.8: tokens do turno
+    # Explicação: na mensagem do usuário, prompt_tokens = tokens do próprio texto.
+    # Na resposta do Gemini, prompt_tokens = prompt enviado (com histórico) e
+    # response_tokens = tokens da resposta, vindos do usage_metadata da API
+    # (ou do estimador local quando a API não informa). Resposta que veio do
+    # cache de respostas não foi cobrada: prompt_tokens fica None
+    prompt_tokens = db.Column(db.Integer)
+    response_tokens = db.Column(db.Integer)
+
+    # Step 4.9: tokens do texto desta mensagem (usado na janela de contexto)
+    @property
+    def content_tokens(self):
+        return self.prompt_tokens if self.role == 'user' else self.response_tokens
+
+    # Step 4.9.1: HTML seguro para o template (ver app/services/rendering.py)
+    @property
+    def html(self):
+        return message_html(self)
+
+    # Step 4.10: Metodos para representação em texto (debug)
     def __repr__(self):
         return f"<Message {self.id} ({self.role})>"
+
+    # Step 4.11: índice das mensagens de uma conversa em ordem cronológica
+    # Explicação: o id desempata mensagens com o mesmo timestamp
+    __table_args__ = (
+        db.Index('ix_messages_conversation_id_timestamp_id', 'conversation_id', 'timestamp', 'id'),
+    )
+
+
+
+# Step 5: Herda de db.Model - fila de tarefas em segundo plano (ex.: respostas do Gemini)
+class Job(db.Model):
+
+    # Step 5.1: passar o nome da tabela no banco
+    __tablename__ = "jobs"
+
+    # Step 5.2: estados possíveis da tarefa
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    # Step 5.3: ID coluna
+    id = db.Column(db.Integer, primary_key=True)
+
+    # Step 5.4: tipo da tarefa (qual handler executa) e seus parâmetros em JSON
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')
+
+    # Step 5.5: estado, número de tentativas, resultado e erro
+    status = db.Column(db.String(20), nullable=False, default=STATUS_QUEUED, index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    result = db.Column(db.Text)
+    error = db.Column(db.Text)
+
+    # Step 5.5.1: texto gerado até agora (a resposta em streaming, lida pela rota SSE)
+    output = db.Column(db.Text)
+
+    # Step 5.6: dono da tarefa, para que só ele possa consultar o resultado
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'))
+
+    # Step 5.7: datas de criação, início e fim
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    # Step 5.8: Metodos para representação em texto (debug)
+    def __repr__(self):
+        return f"<Job {self.id} {self.kind} ({self.status})>"
+
+
+# Step 6: Herda de db.Model - arquivo frio das conversas antigas (mensagens comprimidas)
+class ConversationArchive(db.Model):
+
+    # Step 6.1: passar o nome da tabela no banco
+    __tablename__ = "conversation_archives"
+
+    # Step 6.2: uma linha por conversa arquivada
+    conversation_id = db.Column(
+        db.Integer, db.ForeignKey('conversations.id', ondelete='CASCADE'), primary_key=True
+    )
+
+    # Step 6.3: compressão usada ('zlib' ou 'zstd') e dicionário compartilhado, se houver
+    codec = db.Column(db.String(20), nullable=False)
+    dictionary_id = db.Column(db.Integer, db.ForeignKey('archive_dictionaries.id'))
+
+    # Step 6.4: mensagens em NDJSON comprimido (uma mensagem por linha, todas as colunas)
+    payload = db.Column(db.LargeBinary, nullable=False)
+
+    # Step 6.5: tamanhos e contagem, para o relatório de espaço
+    message_count = db.Column(db.Integer, nullable=False)
+    raw_bytes = db.Column(db.Integer, nullable=False)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    # Step 6.6: tamanho comprimido
+    @property
+    def compressed_bytes(self):
+        return len(self.payload)
+
+    # Step 6.7: Metodos para representação em texto (debug)
+    def __repr__(self):
+        return f"<ConversationArchive {self.conversation_id} ({self.codec})>"
+
+
+# Step 7: Herda de db.Model - dicionário de compressão treinado com mensagens reais
+# Explicação: conversas pequenas comprimem mal sozinhas; com um dicionário das
+# palavras e trechos mais comuns, cada conversa aproveita o que as outras têm em comum
+class ArchiveDictionary(db.Model):
+
+    # Step 7.1: passar o nome da tabela no banco
+    __tablename__ = "archive_dictionaries"
+
+    # Step 7.2: colunas
+    id = db.Column(db.Integer, primary_key=True)
+    codec = db.Column(db.String(20), nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    # Step 7.3: Metodos para representação em texto (debug)
+    def __repr__(self):
+        return f"<ArchiveDictionary {self.id} ({self.codec}, {len(self.data)} bytes)>"
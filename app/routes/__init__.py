@@ -5,5 +5,6 @@ from app.routes.home import home_bp
 from app.routes.auth.login import auth_bp
 from app.routes.auth.minha_conta import minha_conta_bp
 from app.routes.sobre import sobre_bp
+from app.routes.api import api_bp
 
-__all__ = ['home_bp', 'auth_bp', 'minha_conta_bp', 'sobre_bp']
\ No newline at end of file
+__all__ = ['home_bp', 'auth_bp', 'minha_conta_bp', 'sobre_bp', 'api_bp']
@@ -0,0 +1,198 @@
+# Parte 31: API JSON versionada (/api/v1) das conversas e mensagens
+#
+# Explicação: as páginas do minha_conta devolvem HTML ou redirects, então cada
+# ação da interface custava uma página inteira. Aqui as mesmas operações
+# respondem JSON compacto, para o main.js atualizar só o que mudou. A API usa
+# a mesma sessão (cookie) do site; sem login a resposta é 401 em JSON, não um
+# redirect para a tela de login.
+#
+# Escritas só aceitam Content-Type: application/json - um formulário de outro
+# site não consegue enviar JSON sem passar pelo CORS (proteção contra CSRF).
+
+import json
+
+from flask import Blueprint, abort, current_app, jsonify, request, url_for
+from flask_login import current_user, login_required
+from werkzeug.exceptions import HTTPException
+
+from app import db
+from app.models import Conversation, Job, Message
+from app.services import archive, bulk_delete, chat_service
+from app.services.database import use_replica
+from app.services.pagination import InvalidCursor, keyset_page, page_size
+
+# Step 1: cria o blueprint (registrado com o prefixo /api/v1)
+api_bp = Blueprint("api", __name__)
+
+TITLE_MAX_LENGTH = 200  # Explicação: mesmo limite do ConversationForm
+
+
+# Step 2: erros em JSON ({"error": ...}) em vez das páginas de erro HTML
+@api_bp.errorhandler(HTTPException)
+def erro_json(erro):
+    return jsonify({"error": erro.description}), erro.code
+
+
+# Step 3: conversas do usuário, da mais recente para a mais antiga (cursor)
+@api_bp.route("/conversas")
+@login_required
+@use_replica
+def listar_conversas():
+    pagina = _pagina(
+        Conversation.query.filter_by(user_id=current_user.id),
+        Conversation.updated_at, Conversation.id,
+        request.args.get("cursor"), current_app.config["CONVERSATIONS_PER_PAGE"],
+    )
+    return jsonify({"conversas": [_conversa_json(c) for c in pagina.items], "next_cursor": pagina.next_cursor})
+
+
+# Step 3.1: cria uma conversa
+@api_bp.route("/conversas", methods=["POST"])
+@login_required
+def criar_conversa():
+    titulo = str(_dados_json().get("title") or "").strip()
+    if not titulo or len(titulo) > TITLE_MAX_LENGTH:
+        abort(400, f"title é obrigatório (até {TITLE_MAX_LENGTH} caracteres)")
+
+    conversa = Conversation(title=titulo, user_id=current_user.id)
+    db.session.add(conversa)
+    db.session.commit()
+    resposta = jsonify(_conversa_json(conversa))
+    resposta.headers["Location"] = url_for("api.ver_conversa", conversa_id=conversa.id)
+    return resposta, 201
+
+
+# Step 3.2: uma conversa (só os dados, sem as mensagens)
+@api_bp.route("/conversas/<int:conversa_id>")
+@login_required
+@use_replica
+def ver_conversa(conversa_id):
+    return jsonify(_conversa_json(_conversa(conversa_id)))
+
+
+# Step 3.3: apaga uma conversa e as mensagens (DELETE em conjunto)
+@api_bp.route("/conversas/<int:conversa_id>", methods=["DELETE"])
+@login_required
+def apagar_conversa(conversa_id):
+    bulk_delete.delete_conversations(current_user.id, conversation_ids=[_conversa(conversa_id).id])
+    return "", 204
+
+
+# Step 4: mensagens de uma conversa, das mais recentes para as mais antigas (cursor)
+@api_bp.route("/conversas/<int:conversa_id>/mensagens")
+@login_required
+@use_replica
+def listar_mensagens(conversa_id):
+    conversa = _conversa(conversa_id)
+    archive.ensure_hot(conversa)
+    pagina = _pagina(
+        Message.query.filter_by(conversation_id=conversa.id),
+        Message.timestamp, Message.id,
+        request.args.get("antes"), current_app.config["MESSAGES_PER_PAGE"],
+    )
+    return jsonify({"mensagens": [_mensagem_json(m) for m in pagina.items], "next_cursor": pagina.next_cursor})
+
+
+# Step 4.1: envia uma mensagem; a resposta do Gemini é gerada na fila (202 + tarefa)
+@api_bp.route("/conversas/<int:conversa_id>/mensagens", methods=["POST"])
+@login_required
+def enviar_mensagem(conversa_id):
+    conversa = _conversa(conversa_id)
+    conteudo = str(_dados_json().get("content") or "").strip()
+    if not conteudo:
+        abort(400, "content é obrigatório")
+    archive.ensure_hot(conversa)
+
+    mensagem, job = chat_service.queue_user_turn(conversa.id, conteudo, current_user.id)
+    return jsonify({"mensagem": _mensagem_json(mensagem), "tarefa": _tarefa_json(job)}), 202
+
+
+# Step 4.2: uma mensagem
+@api_bp.route("/conversas/<int:conversa_id>/mensagens/<int:mensagem_id>")
+@login_required
+@use_replica
+def ver_mensagem(conversa_id, mensagem_id):
+    return jsonify(_mensagem_json(_mensagem(conversa_id, mensagem_id)))
+
+
+# Step 4.3: apaga uma mensagem
+@api_bp.route("/conversas/<int:conversa_id>/mensagens/<int:mensagem_id>", methods=["DELETE"])
+@login_required
+def apagar_mensagem(conversa_id, mensagem_id):
+    chat_service.delete_message(_mensagem(conversa_id, mensagem_id))
+    return "", 204
+
+
+# Step 5: andamento de uma tarefa da fila (resposta do Gemini)
+@api_bp.route("/tarefas/<int:job_id>")
+@login_required
+def ver_tarefa(job_id):
+    job = Job.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
+    return jsonify(_tarefa_json(job))
+
+
+# Step 6: auxiliares (dono da conversa, corpo JSON, paginação e formatos)
+def _conversa(conversa_id):
+    return Conversation.query.filter_by(id=conversa_id, user_id=current_user.id).first_or_404()
+
+
+def _mensagem(conversa_id, mensagem_id):
+    conversa = _conversa(conversa_id)
+    archive.ensure_hot(conversa)
+    return Message.query.filter_by(id=mensagem_id, conversation_id=conversa.id).first_or_404()
+
+
+def _dados_json():
+    if not request.is_json:
+        abort(415, "Content-Type precisa ser application/json")
+    dados = request.get_json(silent=True)
+    if not isinstance(dados, dict):
+        abort(400, "corpo JSON inválido")
+    return dados
+
+
+def _pagina(query, coluna, coluna_id, cursor, limite_padrao):
+    try:
+        return keyset_page(query, coluna, coluna_id, cursor=cursor,
+                           limit=page_size(request.args.get("limite"), limite_padrao))
+    except InvalidCursor:
+        abort(400, "cursor inválido")
+
+
+def _data(valor):
+    return valor.isoformat() if valor is not None else None
+
+
+def _conversa_json(conversa):
+    return {
+        "id": conversa.id,
+        "title": conversa.title,
+        "message_count": conversa.message_count,
+        "total_tokens": conversa.total_tokens,
+        "last_message_preview": conversa.last_message_preview,
+        "last_message_at": _data(conversa.last_message_at),
+        "created_at": _data(conversa.created_at),
+        "updated_at": _data(conversa.updated_at),
+    }
+
+
+def _mensagem_json(mensagem):
+    return {
+        "id": mensagem.id,
+        "conversation_id": mensagem.conversation_id,
+        "role": mensagem.role,
+        "content": mensagem.content,
+        "html": str(mensagem.html),
+        "status": mensagem.status,
+        "timestamp": _data(mensagem.timestamp),
+    }
+
+
+def _tarefa_json(job):
+    return {
+        "id": job.id,
+        "status": job.status,
+        "result": json.loads(job.result) if job.result else None,
+        "error": job.error,
+        "url": url_for("api.ver_tarefa", job_id=job.id),
+    }
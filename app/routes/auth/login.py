@@ -23,7 +23,7 @@ def login():
 
     # Step 2.3: se o formulário for valido, loga o usuário e redireciona para minha conta
     if form.validate_on_submit():
-        user = User.query.filter_by(email=form.email.data).first()
+        user = User.query.filter_by(email=form.email.data, deleted_at=None).first()
 
         if user and user.check_password(form.senha.data):
             login_user(user)
@@ -1,12 +1,22 @@
 # Parte 9: parte responsavel pela conta do usuario
 
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
+from flask import (
+    Blueprint, render_template, redirect, url_for, flash, request, jsonify,
+    Response, stream_with_context, current_app, abort
+)
+from markupsafe import Markup
 from flask_login import login_required, current_user, logout_user
 from app.forms import ConversationForm,  EditProfileForm
-from app.models import User, Conversation, Message
+from app.models import Conversation, Message, Job
 from app import db
-from app.services.gemini_service import gemini_service 
-from datetime import datetime
+from app.services import archive, bulk_delete, chat_service, export, search
+from app.services.conditional import conditional_page
+from app.services.pagination import InvalidCursor, Page, encode_cursor, keyset_page, page_size
+from app.services.database import use_replica
+from app.services.fragment_cache import fragment_cache
+from app.services.user_cache import user_cache
+import json
+import time
 
 
 # Step 1: cria o blueprint auth
@@ -16,16 +26,41 @@ minha_conta_bp = Blueprint("minha_conta", __name__)
 # Step 2: rota para login
 @minha_conta_bp.route("/minha-conta")
 @login_required  # Explicação: Obrigatorio estar logado
+@use_replica  # Explicação: só leitura, pode usar a réplica
 def minha_conta():
 
-    # Step 2.1: pagina principal do usuario
-    conversas = (
-        Conversation.query.filter_by(user_id=current_user.id)
-        .order_by(Conversation.updated_at.desc())
-        .all()
+    # Step 2.1: pagina principal do usuario (só a primeira página das conversas)
+    # Explicação: uma consulta no índice (user_id, updated_at) dá a chave do cache e o total;
+    # a lista só é buscada e renderizada quando alguma conversa mudou
+    ultima_alteracao, total_conversas = (
+        db.session.query(db.func.max(Conversation.updated_at), db.func.count(Conversation.id))
+        .filter(Conversation.user_id == current_user.id)
+        .one()
     )
 
-    return render_template("minha_conta/minha_conta.html", conversas=conversas)
+    # Step 2.1.1: a mesma consulta decide o 304 (o navegador já tem a página)
+    def renderizar():
+        fragmento = fragment_cache.get_or_render(
+            "conversas", (current_user.id, ultima_alteracao, total_conversas), _render_conversas
+        )
+        return render_template(
+            "minha_conta/minha_conta.html",
+            conversas_html=Markup(fragmento["html"]),
+            total_conversas=total_conversas,
+        )
+
+    return conditional_page(renderizar, ultima_alteracao, total_conversas, last_modified=ultima_alteracao)
+
+
+# Step 2.2: lista de conversas renderizada (vai para o cache de trechos)
+def _render_conversas():
+    pagina = _pagina_conversas(None, current_app.config["CONVERSATIONS_PER_PAGE"])
+    html = render_template(
+        "minha_conta/_conversas.html",
+        conversas=pagina.items,
+        mais_conversas=pagina.next_cursor is not None,
+    )
+    return {"html": html}
 
 
 # Step 3: rota para editar dados do usuario
@@ -43,9 +78,10 @@ def editar_perfil():
 
         if form.senha.data:
             # explicassao do password_hash: senha criptografada
-            current_user.password_hash = form.senha.data
+            current_user.set_password(form.senha.data)
 
         db.session.commit()
+        user_cache.invalidate(current_user.id)  # Explicação: a cópia em cache tem os dados antigos
         flash("Perfil atualizado com sucesso!", "success")
         return redirect(url_for("minha_conta.minha_conta"))
 
@@ -55,16 +91,45 @@ def editar_perfil():
 # Step 4: rota para historico de conversas
 @minha_conta_bp.route("/historico-conversas")
 @login_required
+@use_replica
 def historico_conversas():
 
-    # Step 4.1:  historico completo de todas as conversas
-    conversas = (
-        Conversation.query.filter_by(user_id=current_user.id)
-        .order_by(Conversation.updated_at.desc())
-        .all()
+    # Step 4.1: historico por páginas; as seguintes chegam pela rota JSON ao rolar a página
+    # Explicação: max(updated_at) e o total no índice decidem o 304 antes de buscar a página
+    ultima_alteracao, total_conversas = (
+        db.session.query(db.func.max(Conversation.updated_at), db.func.count(Conversation.id))
+        .filter(Conversation.user_id == current_user.id)
+        .one()
     )
 
-    return render_template("minha_conta/historico_conversas.html", conversas=conversas)
+    def renderizar():
+        pagina = _pagina_conversas(
+            request.args.get("cursor"), current_app.config["CONVERSATIONS_PER_PAGE"]
+        )
+        return render_template(
+            "minha_conta/historico_conversas.html",
+            conversas=pagina.items,
+            proximo_cursor=pagina.next_cursor,
+            total_conversas=total_conversas,
+        )
+
+    return conditional_page(renderizar, ultima_alteracao, total_conversas, last_modified=ultima_alteracao)
+
+
+# Step 4.2: próximas páginas do histórico em JSON (carregamento ao rolar)
+@minha_conta_bp.route("/conversas")
+@login_required
+@use_replica
+def listar_conversas():
+    pagina = _pagina_conversas(
+        request.args.get("cursor"),
+        page_size(request.args.get("limite"), current_app.config["CONVERSATIONS_PER_PAGE"]),
+    )
+
+    return jsonify({
+        "conversas": [_conversa_json(conversa) for conversa in pagina.items],
+        "next_cursor": pagina.next_cursor,
+    })
 
 
 # Step 5: rota para apagar uma conversa
@@ -76,9 +141,8 @@ def apagar_conversa(conversa_id):
         id=conversa_id, user_id=current_user.id
     ).first_or_404()  # explicação: # first_or_404() → se não encontrar, retorna erro 404
 
-    # Step 5.2: apaga a conversa (e todas as mensagens por cascade)
-    db.session.delete(conversa)
-    db.session.commit()
+    # Step 5.2: apaga a conversa e as mensagens com DELETE direto (sem carregar as mensagens)
+    bulk_delete.delete_conversations(current_user.id, conversation_ids=[conversa.id])
 
     flash("Conversa apagada com sucesso!", "success")
     return redirect(url_for("minha_conta.historico_conversas"))
@@ -96,15 +160,13 @@ def apagar_todas_conversas():
     # Step 6.2: se POST, processa a exclusão
     if request.method == "POST":
         if request.form.get("confirmacao") == "APAGAR_TODAS":
-            conversas = Conversation.query.filter_by(user_id=current_user.id).all()
-            
-            total_conversas = len(conversas)
-
-            for conversa in conversas:
-                db.session.delete(conversa)
-            
-            db.session.commit()
-            flash("Todas as conversas foram apagadas!", "success")
+            # Explicação: DELETE em conjunto; contas grandes são apagadas em lotes na fila
+            tarefa = bulk_delete.delete_all_conversations(current_user.id)
+
+            if tarefa is not None and tarefa.status != Job.STATUS_DONE:
+                flash("Suas conversas estão sendo apagadas. Isso pode levar alguns instantes.", "info")
+            else:
+                flash("Todas as conversas foram apagadas!", "success")
             return redirect(url_for("minha_conta.minha_conta"))
         else:
             flash("Confirmação incorreta. Nenhuma conversa foi apagada.", "error")
@@ -122,17 +184,10 @@ def apagar_conta():
             request.form.get("confirmacao") == "APAGAR_CONTA"
         ):  # Explicação: escolhi APAGAR_CONTA porque, difícil digitar por acidente e deixa explícito o que está fazendo.
 
-            # Step 7.1.1: primeiro apaga todas as conversas do usuário
-            conversas = Conversation.query.filter_by(user_id=current_user.id).all()
-            for conversa in conversas:
-                db.session.delete(conversa)
+            # Step 7.1.1: apaga as conversas e depois o usuário (contas grandes: em lotes, na fila)
+            bulk_delete.delete_account(current_user.id)
 
-            #  Step 7.1.2: depois apaga o usuário
-            user_para_apagar = User.query.get(current_user.id)
-            db.session.delete(user_para_apagar)
-            db.session.commit()
-
-            # Step 7.1.3: desloga o usuário
+            # Step 7.1.2: desloga o usuário
             logout_user()
             flash("Sua conta foi apagada permanentemente.", "info")
             return redirect(url_for("home.index"))
@@ -168,19 +223,88 @@ def nova_conversa():
 # Step 9: rota para ver uma conversa
 @minha_conta_bp.route("/conversa/<int:conversa_id>")
 @login_required
+@use_replica
 def ver_conversa(conversa_id):
 
     # Step 9.1: visualiza uma conversa específica
     conversa = Conversation.query.filter_by(
         id=conversa_id, user_id=current_user.id
     ).first_or_404()
-    mensagens = (
-        Message.query.filter_by(conversation_id=conversa_id)
-        .order_by(Message.timestamp.asc())
-        .all()
-    )  # Explicação: busca todas as mensagens desta conversa, ordenadas por data
+    cursor = request.args.get("antes")
+
+    # Step 9.1.1: lista de mensagens do cache de trechos, com a última mensagem na chave
+    # Explicação: toda mensagem nova (inclusive a resposta que conclui um turno pendente)
+    # muda a chave; a consulta da última mensagem é uma busca no índice. O updated_at
+    # cobre o que não cria mensagem (ex.: mensagem apagada pela API). Na conversa
+    # arquivada as mensagens não estão em `messages`, então o resumo da conversa
+    # faz esse papel
+    if conversa.archived_at is None:
+        ultima = (
+            db.session.query(Message.id, Message.timestamp)
+            .filter(Message.conversation_id == conversa.id)
+            .order_by(Message.timestamp.desc(), Message.id.desc())
+            .first()
+        )
+    else:
+        ultima = ("arquivada", conversa.message_count, conversa.last_message_at)
+    chave = (current_user.id, conversa.id, conversa.created_at, conversa.updated_at, ultima, cursor)
+
+    # Step 9.1.2: a mesma chave é o ETag; sem mudança, 304 sem buscar nem renderizar as mensagens
+    # Explicação: a conversa arquivada só volta do arquivo frio quando a página é renderizada
+    def renderizar():
+        archive.ensure_hot(conversa)
+        fragmento = fragment_cache.get_or_render(
+            "mensagens", chave, lambda: _render_mensagens(conversa.id, cursor)
+        )
+
+        # Step 9.2: se há resposta desta conversa sendo gerada na fila, a página acompanha a tarefa
+        tarefa_pendente = None
+        if fragmento["pending"]:
+            tarefa_pendente = chat_service.pending_reply_job(conversa.id, current_user.id)
+
+        return render_template(
+            "minha_conta/ver_conversa.html",
+            conversa=conversa,
+            mensagens_html=Markup(fragmento["html"]) if fragmento["html"] else None,
+            cursor_anteriores=fragmento["next_cursor"],
+            tarefa_pendente=tarefa_pendente,
+        )
+
+    return conditional_page(renderizar, *chave, last_modified=conversa.updated_at)
 
-    return render_template("minha_conta/ver_conversa.html", conversa=conversa, mensagens=mensagens)
+
+# Step 9.2.1: lista de mensagens renderizada (vai para o cache de trechos)
+def _render_mensagens(conversa_id, cursor):
+    # Explicação: só as mensagens mais recentes; as anteriores chegam ao rolar para cima
+    pagina = _pagina_mensagens(conversa_id, cursor, current_app.config["MESSAGES_PER_PAGE"])
+    mensagens = pagina.items
+    html = render_template(
+        "minha_conta/_mensagens.html", mensagens=mensagens, pagina_antiga=bool(cursor)
+    ) if mensagens else ""
+    return {
+        "html": html,
+        "next_cursor": pagina.next_cursor,
+        "pending": any(m.status == Message.STATUS_PENDING for m in mensagens),
+    }
+
+
+# Step 9.3: mensagens anteriores de uma conversa em JSON (carregamento ao rolar)
+@minha_conta_bp.route("/conversa/<int:conversa_id>/mensagens")
+@login_required
+@use_replica
+def listar_mensagens(conversa_id):
+    conversa = Conversation.query.filter_by(id=conversa_id, user_id=current_user.id).first_or_404()
+    archive.ensure_hot(conversa)
+    pagina = _pagina_mensagens(
+        conversa_id,
+        request.args.get("antes"),
+        page_size(request.args.get("limite"), current_app.config["MESSAGES_PER_PAGE"]),
+    )
+
+    return jsonify({
+        "mensagens": [_mensagem_json(mensagem) for mensagem in pagina.items],
+        "next_cursor": pagina.next_cursor,
+    })
 
 # Step 10: rota para enviar mensagem
 @minha_conta_bp.route('/conversa/<int:conversa_id>/enviar-mensagem', methods=['POST'])
@@ -189,52 +313,251 @@ def enviar_mensagem(conversa_id):
 
     # Step 10.1: Envia mensagem para o Gemini e salva no banco
     conversa = Conversation.query.filter_by(id=conversa_id, user_id=current_user.id).first_or_404()
-    
-    # Step 10.2: verifica se a mensagem foi enviada
-    content = request.form.get('content')
+    archive.ensure_hot(conversa)  # Explicação: o histórico enviado ao Gemini precisa das mensagens
+
+    # Step 10.2: aceita formulário ou JSON (o `sendMessage()` do main.js envia JSON)
+    dados_json = request.get_json(silent=True) or {}
+    content = request.form.get('content') or dados_json.get('content')
+    quer_json = request.is_json or request.accept_mimetypes.best == 'application/json'
+
+    # Step 10.3: verifica se a mensagem foi enviada
     if not content:
+        if quer_json:
+            return jsonify({'error': 'Mensagem não pode estar vazia.'}), 400
         flash('Mensagem não pode estar vazia.', 'error')
         return redirect(url_for('minha_conta.ver_conversa', conversa_id=conversa_id))
-    
-    # Step 10.3: salva mensagem do usuário
-    mensagem_usuario = Message(
-        content=content,
-        role='user',
-        conversation_id=conversa_id
+
+    # Step 10.4: salva a mensagem pendente e agenda a resposta do Gemini na fila
+    # Explicação: a requisição não espera o Gemini, quem espera é a fila
+    mensagem_usuario, job = chat_service.queue_user_turn(conversa.id, content, current_user.id)
+
+    # Step 10.5: clientes JSON recebem 202 com o ID da tarefa para consultar depois
+    if quer_json:
+        return jsonify({
+            'job_id': job.id,
+            'message_id': mensagem_usuario.id,
+            'status': job.status,
+            'status_url': url_for('minha_conta.status_tarefa', job_id=job.id),
+        }), 202
+
+    # Step 10.6: formulário volta para a conversa, que acompanha a tarefa
+    return redirect(url_for('minha_conta.ver_conversa', conversa_id=conversa_id))
+
+
+# Step 10.7: rota para consultar o andamento de uma tarefa da fila
+@minha_conta_bp.route('/tarefas/<int:job_id>')
+@login_required
+def status_tarefa(job_id):
+    job = Job.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
+
+    return jsonify({
+        'job_id': job.id,
+        'status': job.status,
+        'result': json.loads(job.result) if job.result else None,
+        'error': job.error,
+    })
+
+
+# Step 11: rota para enviar mensagem com resposta em streaming (Server-Sent Events)
+# Explicação: a resposta é gerada pela fila, como no envio normal, e a tarefa grava o
+# texto parcial em jobs.output enquanto o Gemini responde; o stream repassa os pedaços
+# novos dessa coluna, então a requisição nunca chama o Gemini nem espera o rate limiter
+@minha_conta_bp.route('/conversa/<int:conversa_id>/enviar-mensagem-stream', methods=['POST'])
+@login_required
+def enviar_mensagem_stream(conversa_id):
+
+    # Step 11.1: valida a conversa e a mensagem antes de abrir o stream
+    conversa = Conversation.query.filter_by(id=conversa_id, user_id=current_user.id).first_or_404()
+    archive.ensure_hot(conversa)
+
+    content = request.form.get('content')
+    if not content:
+        return jsonify({'error': 'Mensagem não pode estar vazia.'}), 400
+
+    # Step 11.2: salva a mensagem pendente e agenda a resposta na fila (mesmo commit)
+    mensagem_usuario, job = chat_service.queue_user_turn(conversa.id, content, current_user.id)
+    mensagem_usuario_id, job_id = mensagem_usuario.id, job.id
+    status_url = url_for('minha_conta.status_tarefa', job_id=job_id)
+    intervalo = current_app.config['CHAT_STREAM_POLL_INTERVAL']
+    timeout = current_app.config['CHAT_STREAM_TIMEOUT']
+
+    # Step 11.3: formata um evento SSE (o JSON evita problemas com quebras de linha)
+    def evento(nome, dados):
+        return f"event: {nome}\ndata: {json.dumps(dados, ensure_ascii=False)}\n\n"
+
+    # Step 11.4: lê a tarefa até terminar e repassa o texto novo como `chunk`
+    # Explicação: nenhuma transação fica aberta entre as leituras
+    def gerar():
+        yield evento('user', {'message_id': mensagem_usuario_id, 'job_id': job_id, 'status_url': status_url})
+
+        enviado = ''
+        limite = time.monotonic() + timeout
+        ultimo_evento = time.monotonic()
+        while True:
+            db.session.rollback()  # Explicação: a próxima leitura vê o que os workers gravaram
+            tarefa = db.session.get(Job, job_id)
+            if tarefa is None:
+                break
+
+            parcial = tarefa.output or ''
+            if parcial != enviado:
+                if not parcial.startswith(enviado):
+                    # Explicação: a tarefa foi devolvida à fila e outra tentativa começou do zero
+                    yield evento('reset', {})
+                    enviado = ''
+                yield evento('chunk', {'text': parcial[len(enviado):]})
+                enviado = parcial
+                ultimo_evento = time.monotonic()
+
+            if tarefa.status in (Job.STATUS_DONE, Job.STATUS_FAILED):
+                break
+            if time.monotonic() >= limite:
+                # Explicação: a tarefa continua na fila; o cliente passa a consultar o status_url
+                yield evento('pending', {'job_id': job_id, 'status_url': status_url})
+                return
+            if time.monotonic() - ultimo_evento >= 15:
+                yield ": aguardando\n\n"  # Explicação: comentário SSE mantém a conexão viva
+                ultimo_evento = time.monotonic()
+            time.sleep(intervalo)
+
+        # Step 11.5: repassa a resposta salva pela tarefa (ou o erro)
+        # Explicação: o texto chegou cru em tempo real; o HTML salvo substitui o balão no fim
+        resultado = json.loads(tarefa.result) if tarefa is not None and tarefa.result else {}
+        resposta = db.session.get(Message, resultado['message_id']) if resultado.get('message_id') else None
+        if resposta is None:
+            erro = (tarefa.error if tarefa is not None else None) or 'A resposta não foi gerada.'
+            yield evento('error', {'error': erro, 'message_id': None})
+        elif resposta.status == Message.STATUS_FAILED:
+            yield evento('error', {'error': resposta.content, 'message_id': resposta.id})
+        else:
+            yield evento('done', {'message_id': resposta.id, 'html': str(resposta.html)})
+
+    return Response(
+        stream_with_context(gerar()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',  # Explicação: evita buffer em proxies (nginx/ingress)
+        },
     )
-    db.session.add(mensagem_usuario)
-    db.session.flush()  #  Explicação: garante que o ID é gerado
-    
-    # Step 10.4: busca histórico da conversa para contexto
-    historico_mensagens = Message.query.filter_by(conversation_id=conversa_id).order_by(Message.timestamp.asc()).all()
-    
-    # Step 10.5: prepara histórico para o Gemini
-    historico_gemini = []
-    for msg in historico_mensagens:
-        historico_gemini.append({
-            'role': 'user' if msg.role == 'user' else 'model', # Explicação: role usado para identificar "quem disse o que na conversa"
-            'parts': [msg.content]
-        })
-    
-    # Step 10.6: envia para o Gemini
-    resposta_texto, sucesso = gemini_service.send_message(content, historico_gemini)
-    
-    # Step 10.7: salva resposta do Gemini
-    mensagem_gemini = Message(
-        content=resposta_texto,
-        role='assistant', 
-        conversation_id=conversa_id
+
+
+# Step 12: paginação por cursor (keyset) das conversas e mensagens
+# Explicação: conversas da mais recente para a mais antiga por (updated_at, id);
+# mensagens por (timestamp, id), do fim da conversa para o começo
+def _pagina_conversas(cursor, limite):
+    try:
+        return keyset_page(
+            Conversation.query.filter_by(user_id=current_user.id),
+            Conversation.updated_at, Conversation.id,
+            cursor=cursor, limit=limite,
+        )
+    except InvalidCursor:
+        abort(400)
+
+
+def _pagina_mensagens(conversa_id, cursor, limite):
+    try:
+        pagina = keyset_page(
+            Message.query.filter_by(conversation_id=conversa_id),
+            Message.timestamp, Message.id,
+            cursor=cursor, limit=limite,
+        )
+    except InvalidCursor:
+        abort(400)
+    # Explicação: a página vem do fim para o começo, mas é exibida em ordem cronológica
+    return Page(pagina.items[::-1], pagina.next_cursor)
+
+
+# Step 12.1: formato JSON das conversas e mensagens
+def _conversa_json(conversa):
+    return {
+        "id": conversa.id,
+        "title": conversa.title,
+        "message_count": conversa.message_count,
+        "last_message_preview": conversa.last_message_preview,
+        "last_message_at": conversa.last_message_at.isoformat() if conversa.last_message_at else None,
+        "created_at": conversa.created_at.isoformat(),
+        "updated_at": conversa.updated_at.isoformat(),
+        "url": url_for("minha_conta.ver_conversa", conversa_id=conversa.id),
+        "delete_url": url_for("minha_conta.apagar_conversa", conversa_id=conversa.id),
+    }
+
+
+def _mensagem_json(mensagem):
+    return {
+        "id": mensagem.id,
+        "role": mensagem.role,
+        "content": mensagem.content,
+        "html": str(mensagem.html),
+        "status": mensagem.status,
+        "timestamp": mensagem.timestamp.isoformat(),
+    }
+
+
+# Step 13: busca no histórico de conversas do usuário (FTS5, mais relevantes primeiro)
+@minha_conta_bp.route("/buscar")
+@login_required
+@use_replica
+def buscar():
+    texto = request.args.get("q", "").strip()
+    resultados = _busca(texto)
+    return render_template("minha_conta/buscar.html", texto=texto, resultados=resultados,
+                           link_mensagem=_link_mensagem)
+
+
+# Step 13.1: a mesma busca em JSON (o trecho já vem escapado, com <mark> nos termos)
+@minha_conta_bp.route("/busca")
+@login_required
+@use_replica
+def buscar_json():
+    texto = request.args.get("q", "").strip()
+    resultados = _busca(texto)
+    return jsonify({
+        "resultados": [_resultado_json(resultado) for resultado in resultados.items],
+        "pagina": resultados.page,
+        "proxima_pagina": resultados.page + 1 if resultados.has_next else None,
+    })
+
+
+# Step 13.2: página da busca e link para a mensagem encontrada
+def _busca(texto):
+    pagina = page_size(request.args.get("pagina"), 1, maximum=1000)
+    limite = page_size(request.args.get("limite"), current_app.config["SEARCH_RESULTS_PER_PAGE"])
+    return search.search_messages(current_user.id, texto, page=pagina, per_page=limite)
+
+
+def _link_mensagem(resultado):
+    # Explicação: cursor logo depois da mensagem, assim ela é a última da página aberta
+    cursor = encode_cursor(resultado.timestamp, resultado.message_id + 1)
+    return url_for("minha_conta.ver_conversa", conversa_id=resultado.conversation_id,
+                   antes=cursor, _anchor=f"message-{resultado.message_id}")
+
+
+def _resultado_json(resultado):
+    return {
+        "message_id": resultado.message_id,
+        "conversation_id": resultado.conversation_id,
+        "conversation_title": resultado.conversation_title,
+        "role": resultado.role,
+        "timestamp": resultado.timestamp.isoformat(),
+        "snippet": str(resultado.snippet),
+        "url": _link_mensagem(resultado),
+    }
+
+
+# Step 14: exportação de todas as conversas (NDJSON ou ZIP), gerada enquanto é baixada
+@minha_conta_bp.route("/exportar")
+@login_required
+def exportar_conversas():
+    formato = request.args.get("formato", "ndjson")
+    if formato not in export.FORMATS:
+        abort(400)
+    geradores = {"ndjson": export.ndjson_chunks, "zip": export.zip_chunks}
+
+    # Explicação: stream_with_context mantém o app context (sessão do banco) até o último chunk
+    return Response(
+        stream_with_context(geradores[formato](current_user.id)),
+        mimetype=export.FORMATS[formato],
+        headers={"Content-Disposition": f'attachment; filename="{export.filename(formato)}"'},
     )
-    db.session.add(mensagem_gemini)
-    
-    # Step 10.8: atualiza timestamp da conversa
-    conversa.updated_at = datetime.utcnow()
-    
-    db.session.commit()
-    
-    if sucesso:
-        flash('Resposta recebida do Gemini!', 'success')
-    else:
-        flash('Erro ao obter resposta do Gemini.', 'error')
-    
-    return redirect(url_for('minha_conta.ver_conversa', conversa_id=conversa_id))
\ No newline at end of file
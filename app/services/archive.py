@@ -0,0 +1,350 @@
+# Parte 27: arquivo frio das conversas antigas (mensagens comprimidas)
+#
+# Explicação: as respostas do Gemini são a maior parte do banco. Conversas sem
+# atividade há ARCHIVE_AFTER_DAYS dias têm as mensagens comprimidas (zlib ou
+# zstd, com um dicionário compartilhado opcional) em uma única linha de
+# `conversation_archives`, e as linhas saem de `messages`. Quando a conversa é
+# aberta de novo, as mensagens voltam para `messages` (com os mesmos IDs) e o
+# resto do app continua igual: paginação, histórico do Gemini, envio.
+#
+# O comando `flask archive-conversations` faz o arquivamento e mostra o
+# espaço economizado. No SQLite o arquivo só diminui com --vacuum; sem ele as
+# páginas liberadas ficam livres para reuso.
+
+import json
+import zlib
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import DateTime, insert, select
+
+from app import db
+from app.models import ArchiveDictionary, Conversation, ConversationArchive, Message
+from app.services.database import use_primary
+from app.services.history_cache import history_cache
+
+try:
+    import zstandard  # Explicação: opcional, só para ARCHIVE_CODEC=zstd
+except ImportError:
+    zstandard = None
+
+# Step 1: compressões aceitas e nível padrão de cada uma
+CODECS = ("zlib", "zstd")
+DEFAULT_LEVELS = {"zlib": 9, "zstd": 19}
+ZLIB_MAX_DICTIONARY = 32 * 1024  # Explicação: o deflate só enxerga os últimos 32 KiB do dicionário
+
+# Explicação: todas as colunas da mensagem (colunas novas entram sozinhas no arquivo)
+_COLUNAS = [coluna for coluna in Message.__table__.columns if coluna.key != "conversation_id"]
+_LOTE = 500
+
+
+# Step 2: uma mensagem por linha em JSON (NDJSON), datas em ISO 8601
+def _linha(mensagem):
+    dados = {
+        coluna.key: mensagem[coluna.key].isoformat() if isinstance(mensagem[coluna.key], datetime)
+        else mensagem[coluna.key]
+        for coluna in _COLUNAS
+    }
+    return json.dumps(dados, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+def _mensagem(linha, conversation_id):
+    dados = json.loads(linha)
+    for coluna in _COLUNAS:
+        if isinstance(coluna.type, DateTime) and dados.get(coluna.key):
+            dados[coluna.key] = datetime.fromisoformat(dados[coluna.key])
+    dados["conversation_id"] = conversation_id
+    return dados
+
+
+# Step 3: compressão em partes (a conversa nunca fica inteira na memória ao arquivar)
+def _compressor(codec, level, dictionary=None):
+    if codec == "zlib":
+        return zlib.compressobj(level, zdict=dictionary) if dictionary else zlib.compressobj(level)
+    _require_zstd()
+    dicionario = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+    return zstandard.ZstdCompressor(level=level, dict_data=dicionario).compressobj()
+
+
+def _descompressor(codec, dictionary=None):
+    if codec == "zlib":
+        return zlib.decompressobj(zdict=dictionary) if dictionary else zlib.decompressobj()
+    _require_zstd()
+    dicionario = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+    return zstandard.ZstdDecompressor(dict_data=dicionario).decompressobj()
+
+
+def decompress(codec, payload, dictionary=None):
+    descompressor = _descompressor(codec, dictionary)
+    return descompressor.decompress(payload) + descompressor.flush()
+
+
+def _require_zstd():
+    if zstandard is None:
+        raise click.UsageError("ARCHIVE_CODEC=zstd precisa do pacote zstandard (pip install zstandard)")
+
+
+# Step 4: dicionário compartilhado, treinado com as mensagens mais recentes
+# Explicação: no zstd o próprio zstandard treina o dicionário; no zlib o dicionário
+# é um trecho de texto real (os últimos 32 KiB da amostra), que é o que o deflate aproveita
+def train_dictionary(codec, sample_messages=2000, size=ZLIB_MAX_DICTIONARY):
+    consulta = select(*_COLUNAS).order_by(Message.id.desc()).limit(sample_messages)
+    amostras = [_linha(mensagem) for mensagem in db.session.execute(consulta).mappings()]
+    if not amostras:
+        return None
+
+    if codec == "zlib":
+        size = min(size, ZLIB_MAX_DICTIONARY)
+    dados = b"".join(reversed(amostras))[-size:]
+    if codec == "zstd":
+        _require_zstd()
+        try:
+            dados = zstandard.train_dictionary(size, amostras).as_bytes()
+        except zstandard.ZstdError:
+            pass  # Explicação: amostra pequena demais para treinar; usa o texto como dicionário
+    dicionario = ArchiveDictionary(codec=codec, data=dados)
+    db.session.add(dicionario)
+    db.session.commit()
+    return dicionario
+
+
+def _dictionary_for(codec):
+    dicionario = (
+        ArchiveDictionary.query.filter_by(codec=codec).order_by(ArchiveDictionary.id.desc()).first()
+    )
+    return dicionario or train_dictionary(codec, size=current_app.config["ARCHIVE_DICTIONARY_SIZE"])
+
+
+# Step 5: arquiva uma conversa; retorna o ConversationArchive ou None (conversa mudou no meio)
+def archive_conversation(conversation_id, codec="zlib", level=None, dictionary=None):
+    nivel = DEFAULT_LEVELS[codec] if level is None else level
+    conversa = db.session.get(Conversation, conversation_id)
+    if conversa is None or conversa.archived_at is not None:
+        return None
+    atualizada_em = conversa.updated_at
+
+    # Step 5.1: lê e comprime fora da transação de escrita (o lock de escrita fica curto)
+    compressor = _compressor(codec, nivel, dictionary.data if dictionary else None)
+    partes, brutos, total, ultimo_id = [], 0, 0, 0
+    consulta = (
+        select(*_COLUNAS).where(Message.conversation_id == conversation_id)
+        .order_by(Message.id).execution_options(yield_per=_LOTE)
+    )
+    for mensagem in db.session.execute(consulta).mappings():
+        linha = _linha(mensagem)
+        partes.append(compressor.compress(linha))
+        brutos += len(linha)
+        total += 1
+        ultimo_id = mensagem["id"]
+    partes.append(compressor.flush())
+    db.session.rollback()  # Explicação: fecha a leitura antes de escrever
+
+    # Step 5.2: marca, grava o arquivo e apaga as mensagens no mesmo commit
+    # Explicação: toda mensagem nova muda o updated_at, então se ele mudou a conversa fica como está
+    marcada = (
+        Conversation.query.filter(
+            Conversation.id == conversation_id,
+            Conversation.archived_at.is_(None),
+            Conversation.updated_at == atualizada_em,
+        )
+        .update({Conversation.archived_at: datetime.utcnow(), Conversation.updated_at: Conversation.updated_at},
+                synchronize_session=False)
+    )
+    if not marcada:
+        db.session.rollback()
+        return None
+
+    arquivo = ConversationArchive(
+        conversation_id=conversation_id, codec=codec, dictionary_id=dictionary.id if dictionary else None,
+        payload=b"".join(partes), message_count=total, raw_bytes=brutos,
+    )
+    db.session.add(arquivo)
+    Message.query.filter(
+        Message.conversation_id == conversation_id, Message.id <= ultimo_id
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    history_cache.invalidate(conversation_id)
+    return arquivo
+
+
+# Step 6: devolve as mensagens de uma conversa arquivada para `messages`
+# Explicação: chamado pelas rotas antes de ler ou escrever mensagens; retorna True se restaurou
+def ensure_hot(conversation):
+    if conversation.archived_at is None:
+        return False
+    use_primary()  # Explicação: a réplica ainda não tem as mensagens restauradas
+
+    # Step 6.1: o UPDATE condicional garante que só uma requisição restaura
+    restaurada = (
+        Conversation.query.filter(Conversation.id == conversation.id, Conversation.archived_at.isnot(None))
+        .update({Conversation.archived_at: None, Conversation.updated_at: Conversation.updated_at},
+                synchronize_session=False)
+    )
+    arquivo = db.session.get(ConversationArchive, conversation.id) if restaurada else None
+    if arquivo is None:
+        db.session.rollback()
+        db.session.refresh(conversation)
+        return False
+
+    mensagens = list(_iter_payload(arquivo))
+
+    # Step 6.2: no SQLite um ID apagado pode ter sido reutilizado; essas mensagens ganham um ID novo
+    ids = [mensagem["id"] for mensagem in mensagens]
+    ocupados = set()
+    for inicio in range(0, len(ids), _LOTE):
+        ocupados.update(
+            mensagem_id for (mensagem_id,) in
+            db.session.query(Message.id).filter(Message.id.in_(ids[inicio:inicio + _LOTE]))
+        )
+    for mensagem in mensagens:
+        if mensagem["id"] in ocupados:
+            del mensagem["id"]
+
+    com_id = [m for m in mensagens if "id" in m]
+    sem_id = [m for m in mensagens if "id" not in m]
+    for grupo in (com_id, sem_id):
+        for inicio in range(0, len(grupo), _LOTE):
+            db.session.execute(insert(Message), grupo[inicio:inicio + _LOTE])
+
+    db.session.delete(arquivo)
+    db.session.commit()
+    history_cache.invalidate(conversation.id)
+    return True
+
+
+# Step 6.3: lê as mensagens arquivadas sem restaurar a conversa (ex.: exportação)
+def iter_archived_messages(conversation_id):
+    arquivo = db.session.get(ConversationArchive, conversation_id)
+    if arquivo is None:
+        return
+    yield from _iter_payload(arquivo)
+    db.session.expunge(arquivo)  # Explicação: o payload não fica preso na sessão até o fim da exportação
+
+
+# Explicação: descomprime em partes de 64 KiB; só uma parte e a linha incompleta ficam na memória
+def _iter_payload(arquivo, parte=64 * 1024):
+    dicionario = db.session.get(ArchiveDictionary, arquivo.dictionary_id) if arquivo.dictionary_id else None
+    descompressor = _descompressor(arquivo.codec, dicionario.data if dicionario else None)
+    payload, resto = arquivo.payload, b""
+    for inicio in range(0, len(payload) + parte, parte):
+        if inicio < len(payload):
+            resto += descompressor.decompress(payload[inicio:inicio + parte])
+        else:
+            resto += descompressor.flush()  # Explicação: última volta, depois de todo o payload
+        *linhas, resto = resto.split(b"\n")
+        for linha in linhas:
+            if linha:
+                yield _mensagem(linha, arquivo.conversation_id)
+
+
+# Step 7: arquiva as conversas sem atividade há `days` dias; retorna o relatório
+def archive_old_conversations(days=None, codec=None, level=None, use_dictionary=None, limit=None,
+                              dry_run=False):
+    config = current_app.config
+    dias = config["ARCHIVE_AFTER_DAYS"] if days is None else days
+    codec = codec or config["ARCHIVE_CODEC"]
+    usar_dicionario = config["ARCHIVE_USE_DICTIONARY"] if use_dictionary is None else use_dictionary
+    if codec not in CODECS:
+        raise click.UsageError(f"ARCHIVE_CODEC inválido: {codec} (use {', '.join(CODECS)})")
+
+    limite = datetime.utcnow() - timedelta(days=dias)
+    candidatas = (
+        db.session.query(Conversation.id)
+        .filter(Conversation.archived_at.is_(None), Conversation.updated_at < limite,
+                Conversation.message_count > 0)
+        .order_by(Conversation.id)
+    )
+    if limit:
+        candidatas = candidatas.limit(limit)
+    ids = [conversa_id for (conversa_id,) in candidatas]
+
+    relatorio = {"codec": codec, "days": dias, "candidates": len(ids), "conversations": 0, "messages": 0,
+                 "raw_bytes": 0, "compressed_bytes": 0, "size_before": database_size()}
+    if dry_run or not ids:
+        if ids:
+            relatorio["raw_bytes"] = (
+                db.session.query(db.func.coalesce(db.func.sum(db.func.length(Message.content)), 0))
+                .filter(Message.conversation_id.in_(select(candidatas.subquery().c.id))).scalar()
+            )
+        return relatorio
+
+    dicionario = _dictionary_for(codec) if usar_dicionario else None
+    for conversa_id in ids:
+        arquivo = archive_conversation(conversa_id, codec, level, dicionario)
+        if arquivo is None:
+            continue
+        relatorio["conversations"] += 1
+        relatorio["messages"] += arquivo.message_count
+        relatorio["raw_bytes"] += arquivo.raw_bytes
+        relatorio["compressed_bytes"] += arquivo.compressed_bytes
+
+    relatorio["dictionary_id"] = dicionario.id if dicionario else None
+    relatorio["size_after"] = database_size()
+    return relatorio
+
+
+# Step 8: tamanho do banco (no SQLite: páginas usadas e livres do arquivo)
+def database_size():
+    conexao = db.session.connection()
+    if conexao.dialect.name == "sqlite":
+        pagina = conexao.exec_driver_sql("PRAGMA page_size").scalar()
+        paginas = conexao.exec_driver_sql("PRAGMA page_count").scalar()
+        livres = conexao.exec_driver_sql("PRAGMA freelist_count").scalar()
+        return {"file_bytes": pagina * paginas, "free_bytes": pagina * livres}
+    if conexao.dialect.name == "postgresql":
+        return {"file_bytes": conexao.exec_driver_sql("SELECT pg_database_size(current_database())").scalar(),
+                "free_bytes": None}
+    return {"file_bytes": None, "free_bytes": None}
+
+
+def vacuum():
+    # Explicação: VACUUM não roda dentro de transação
+    db.session.commit()
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conexao:
+        conexao.exec_driver_sql("VACUUM")
+
+
+# Step 9: comando `flask archive-conversations`
+@click.command("archive-conversations")
+@click.option("--days", type=int, help="dias sem atividade (padrão: ARCHIVE_AFTER_DAYS)")
+@click.option("--codec", type=click.Choice(CODECS), help="compressão (padrão: ARCHIVE_CODEC)")
+@click.option("--level", type=int, help="nível de compressão (padrão: 9 no zlib, 19 no zstd)")
+@click.option("--dictionary/--no-dictionary", default=None, help="usa o dicionário compartilhado")
+@click.option("--limit", type=int, help="máximo de conversas nesta execução")
+@click.option("--dry-run", is_flag=True, help="só mostra quantas conversas seriam arquivadas")
+@click.option("--vacuum", "rodar_vacuum", is_flag=True, help="VACUUM no fim, para devolver o espaço ao disco")
+@with_appcontext
+def archive_command(days, codec, level, dictionary, limit, dry_run, rodar_vacuum):
+    """Comprime as mensagens das conversas antigas e mostra o espaço economizado."""
+    relatorio = archive_old_conversations(days, codec, level, dictionary, limit, dry_run)
+
+    if dry_run:
+        click.echo(f" {relatorio['candidates']} conversas sem atividade há {relatorio['days']} dias "
+                   f"({_tamanho(relatorio['raw_bytes'])} de texto)")
+        return
+
+    brutos, comprimidos = relatorio["raw_bytes"], relatorio["compressed_bytes"]
+    click.echo(f" Arquivadas {relatorio['conversations']} conversas ({relatorio['messages']} mensagens) "
+               f"com {relatorio['codec']}")
+    if brutos:
+        click.echo(f" Mensagens: {_tamanho(brutos)} -> {_tamanho(comprimidos)} ({brutos / max(comprimidos, 1):.1f}x)")
+
+    antes, depois = relatorio["size_before"], relatorio.get("size_after", relatorio["size_before"])
+    if depois["free_bytes"] is not None:
+        click.echo(f" Páginas livres no banco: {_tamanho(antes['free_bytes'])} -> {_tamanho(depois['free_bytes'])}")
+    if rodar_vacuum:
+        vacuum()
+        final = database_size()
+        click.echo(f" VACUUM: {_tamanho(antes['file_bytes'])} -> {_tamanho(final['file_bytes'])} "
+                   f"(devolvidos {_tamanho(antes['file_bytes'] - final['file_bytes'])})")
+
+
+def _tamanho(valor):
+    valor = valor or 0
+    for unidade in ("B", "KB", "MB"):
+        if abs(valor) < 1024:
+            return f"{valor:.1f} {unidade}" if unidade != "B" else f"{valor} B"
+        valor /= 1024
+    return f"{valor:.2f} GB"
@@ -0,0 +1,228 @@
+# Parte 33: arquivos estáticos com hash no nome, minificados e pré-comprimidos
+#
+# Explicação: style.css e main.js eram servidos pelo handler padrão do Flask,
+# sem compressão e com cache curto, então toda página nova voltava a pedir os
+# dois arquivos aos mesmos workers do gunicorn que esperam o Gemini. O comando
+# `flask build-assets` gera em static/dist/ uma cópia minificada de cada
+# arquivo com o hash do conteúdo no nome (style.3f9a1c2b7d.css), as versões
+# .gz e .br (brotli com `pip install brotli`) e um manifest.json. O
+# `asset_url()` dos templates usa o nome com hash, servido com cache de um ano
+# e `immutable`: o navegador nem revalida, e um deploy com arquivo novo muda a
+# URL. Sem o manifest (ou com ASSETS_MANIFEST=false, para editar o CSS/JS em
+# desenvolvimento) os templates usam os arquivos originais.
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+
+import click
+from flask import current_app, request, send_from_directory, url_for
+from flask.cli import with_appcontext
+
+try:
+    import brotli  # Explicação: opcional, só para gerar as versões .br
+except ImportError:
+    brotli = None
+
+# Step 1: arquivos processados e onde ficam os gerados (dentro da pasta static)
+ASSETS = ("css/style.css", "js/main.js")
+DIST = "dist"
+MANIFEST = "manifest.json"
+IMMUTABLE = "public, max-age={}, immutable"
+# Explicação: a ordem é a preferência quando o navegador aceita as duas
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+# Step 2: minificação sem dependências (conservadora: não renomeia nada, só tira espaço e comentário)
+# Explicação (CSS): espaço depois de ":" pode sair, antes não ("a :hover" é diferente de "a:hover")
+_CSS = re.compile(r"(\"(?:\\.|[^\"\\])*\"|'(?:\\.|[^'\\])*')|(?:\s|/\*.*?\*/)+", re.S)
+_CSS_ANTES = set("{};,>)")
+_CSS_DEPOIS = set("{};,>:(")
+
+
+def minify_css(codigo):
+    def trocar(m):
+        if m.group(1):
+            return m.group(1)
+        anterior = codigo[m.start() - 1] if m.start() else "{"
+        seguinte = codigo[m.end()] if m.end() < len(codigo) else "}"
+        return "" if anterior in _CSS_DEPOIS or seguinte in _CSS_ANTES else " "
+
+    return _CSS.sub(trocar, codigo).strip()
+
+
+# Explicação (JS): quebras de linha ficam (inserção automática de ";"), exceto onde
+# o comando certamente continua; espaço some ao lado de pontuação que não junta
+# com o vizinho (+, -, / e . ficam de fora: "a + +b", "1 .toFixed()")
+_JS_PONTUACAO = set("{}()[];,=:<>*%!&|?")
+_JS_QUEBRA_ANTES = set("{;,([")
+_JS_QUEBRA_DEPOIS = set("})];,")
+_JS_ANTES_DE_REGEX = set("(,=:[!&|?{};+-*%<>~^")
+_JS_PALAVRAS_ANTES_DE_REGEX = {"return", "typeof", "case", "do", "else", "in", "of", "void", "yield", "await"}
+
+
+def minify_js(codigo):
+    saida, i, n = [], 0, len(codigo)
+
+    def ultimo():
+        return saida[-1][-1] if saida else ""
+
+    def ultima_palavra():
+        palavra = re.search(r"[\w$]+$", saida[-1]) if saida else None
+        return palavra.group(0) if palavra else ""
+
+    def fim_do_literal(inicio, aspas):
+        j = inicio + 1
+        while j < n and codigo[j] != aspas:
+            j += 2 if codigo[j] == "\\" else 1
+        return j + 1
+
+    def fim_da_regex(inicio):
+        j, classe = inicio + 1, False
+        while j < n and (classe or codigo[j] != "/"):
+            if codigo[j] == "\\":
+                j += 1
+            elif codigo[j] == "[":
+                classe = True
+            elif codigo[j] == "]":
+                classe = False
+            j += 1
+        j += 1
+        while j < n and codigo[j].isalpha():  # Explicação: flags (g, i, m...)
+            j += 1
+        return j
+
+    while i < n:
+        c = codigo[i]
+        if c in "'\"`":
+            j = fim_do_literal(i, c)
+            saida.append(codigo[i:j])
+        elif codigo.startswith("//", i):
+            j = codigo.find("\n", i)
+            j = n if j == -1 else j
+        elif codigo.startswith("/*", i):
+            j = codigo.find("*/", i + 2)
+            j = n if j == -1 else j + 2
+            if ultimo() and not ultimo().isspace() and not codigo[j:j + 1].isspace():
+                saida.append(" ")  # Explicação: o comentário separava dois tokens
+        elif c == "/" and (ultimo() in _JS_ANTES_DE_REGEX or not ultimo()
+                           or ultima_palavra() in _JS_PALAVRAS_ANTES_DE_REGEX):
+            j = fim_da_regex(i)
+            saida.append(codigo[i:j])
+        elif c.isspace():
+            j = i
+            while j < n and codigo[j].isspace():
+                j += 1
+            anterior, seguinte = ultimo(), codigo[j:j + 1]
+            if "\n" in codigo[i:j]:
+                if anterior and seguinte and anterior not in _JS_QUEBRA_ANTES and seguinte not in _JS_QUEBRA_DEPOIS:
+                    saida.append("\n")
+            elif anterior and seguinte and anterior not in _JS_PONTUACAO and seguinte not in _JS_PONTUACAO:
+                saida.append(" ")
+        else:
+            j = i + 1
+            while j < n and (codigo[j].isalnum() or codigo[j] in "_$"):
+                j += 1
+            saida.append(codigo[i:j])
+        i = j
+
+    return "".join(saida).strip()
+
+
+MINIFIERS = {".css": minify_css, ".js": minify_js}
+
+
+# Step 3: gera static/dist (arquivos com hash, .gz, .br e o manifest)
+def build(static_folder, assets=ASSETS, brotli_quality=11):
+    destino = os.path.join(static_folder, DIST)
+    manifest, relatorio = {}, []
+    for nome in assets:
+        with open(os.path.join(static_folder, nome), encoding="utf-8") as f:
+            original = f.read()
+        base, extensao = os.path.splitext(nome)
+        minificador = MINIFIERS.get(extensao)
+        conteudo = (minificador(original) if minificador else original).encode("utf-8")
+
+        gerado = f"{base}.{hashlib.sha256(conteudo).hexdigest()[:10]}{extensao}"
+        caminho = os.path.join(destino, gerado)
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        # Explicação: mtime=0 deixa o .gz igual a cada build (mesmo conteúdo, mesmos bytes)
+        versoes = {"": conteudo, ".gz": gzip.compress(conteudo, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            versoes[".br"] = brotli.compress(conteudo, quality=brotli_quality)
+        for sufixo, dados in versoes.items():
+            with open(caminho + sufixo, "wb") as f:
+                f.write(dados)
+
+        manifest[nome] = f"{DIST}/{gerado}"
+        relatorio.append((nome, gerado, len(original.encode("utf-8")), {s or "min": len(d) for s, d in versoes.items()}))
+
+    # Explicação: o manifest é escrito por último (e trocado de uma vez) para nunca apontar
+    # para um arquivo que ainda não existe
+    temporario = os.path.join(destino, MANIFEST + ".tmp")
+    with open(temporario, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(temporario, os.path.join(destino, MANIFEST))
+    return manifest, relatorio
+
+
+# Step 4: manifest lido uma vez por processo (None = usa os arquivos originais)
+def load_manifest(app):
+    if not app.config.get("ASSETS_MANIFEST", True):
+        return None
+    try:
+        with open(os.path.join(app.static_folder, DIST, MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+# Step 5: `asset_url('css/style.css')` nos templates
+def asset_url(filename):
+    manifest = current_app.extensions.get("assets_manifest")
+    return url_for("static", filename=(manifest or {}).get(filename, filename))
+
+
+# Step 6: serve static/dist com cache imutável e a versão comprimida que o navegador aceita
+def send_static(filename):
+    if not filename.startswith(DIST + "/") or filename.endswith(MANIFEST):
+        return current_app.send_static_file(filename)
+
+    max_age = current_app.config.get("ASSETS_MAX_AGE", 365 * 24 * 3600)
+    tipo = mimetypes.guess_type(filename)[0]
+    pasta = current_app.static_folder
+    resposta = None
+    for codificacao, sufixo in ENCODINGS:
+        if request.accept_encodings[codificacao] and os.path.isfile(os.path.join(pasta, filename + sufixo)):
+            resposta = send_from_directory(pasta, filename + sufixo, mimetype=tipo, max_age=max_age)
+            resposta.headers["Content-Encoding"] = codificacao
+            break
+    if resposta is None:
+        resposta = send_from_directory(pasta, filename, mimetype=tipo, max_age=max_age)
+    resposta.headers["Cache-Control"] = IMMUTABLE.format(max_age)
+    resposta.vary.add("Accept-Encoding")
+    return resposta
+
+
+# Step 7: liga tudo no app (helper dos templates, view do static e comando)
+def init_app(app):
+    app.extensions["assets_manifest"] = load_manifest(app)
+    app.jinja_env.globals["asset_url"] = asset_url
+    app.view_functions["static"] = send_static
+    app.cli.add_command(build_command)
+
+
+# Step 8: comando `flask build-assets`
+@click.command("build-assets")
+@with_appcontext
+def build_command():
+    """Gera static/dist: arquivos minificados com hash no nome, .gz/.br e manifest.json."""
+    if brotli is None:
+        click.echo(" brotli não instalado: gerando só .gz (pip install brotli)")
+    _, relatorio = build(current_app.static_folder)
+    for nome, gerado, tamanho, versoes in relatorio:
+        tamanhos = ", ".join(f"{sufixo.lstrip('.')} {bytes_} B" for sufixo, bytes_ in versoes.items())
+        click.echo(f" {nome} ({tamanho} B) -> {DIST}/{gerado}: {tamanhos}")
@@ -0,0 +1,150 @@
+# Parte 24: exclusão em massa de conversas e contas
+#
+# Explicação: apagar pelo ORM (db.session.delete em cada conversa) carrega
+# todas as conversas e, pelo cascade, todas as mensagens na memória, numa
+# única transação gigante. Aqui tudo é DELETE em conjunto, direto no banco:
+#   DELETE FROM messages WHERE conversation_id IN (SELECT id FROM conversations WHERE user_id = ?)
+#   DELETE FROM conversations WHERE user_id = ?
+# As mensagens são apagadas explicitamente antes das conversas, então o
+# resultado é o mesmo com ou sem o ON DELETE CASCADE no schema (bancos
+# criados pela migração inicial não têm); o mesmo vale para as mensagens
+# comprimidas do arquivo frio. Contas com muitas mensagens vão
+# para a fila e são apagadas em lotes, uma transação curta por lote.
+
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import select
+
+from app import db
+from app.models import Conversation, ConversationArchive, Job, Message, User
+from app.services.history_cache import history_cache
+from app.services.job_queue import job_queue
+from app.services.user_cache import user_cache
+
+
+# Step 1: apaga todas as conversas do usuário (na hora ou na fila); retorna o Job ou None
+# Explicação: só as conversas que existem agora - as criadas durante a limpeza ficam
+def delete_all_conversations(user_id):
+    ultimo_id = (
+        db.session.query(db.func.max(Conversation.id)).filter(Conversation.user_id == user_id).scalar()
+    )
+    if ultimo_id is None:
+        return None
+
+    if _is_large(user_id):
+        return job_queue.enqueue(
+            'purge_conversations', {'user_id': user_id, 'max_conversation_id': ultimo_id}, user_id=user_id
+        )
+
+    delete_conversations(user_id, max_conversation_id=ultimo_id)
+    return None
+
+
+# Step 2: apaga a conta; contas grandes são marcadas como apagadas e limpas na fila
+def delete_account(user_id):
+    user_cache.invalidate(user_id)
+    if _is_large(user_id):
+        # Explicação: a marca e a tarefa vão no mesmo commit (o enqueue faz o commit)
+        User.query.filter_by(id=user_id).update({User.deleted_at: datetime.utcnow()}, synchronize_session=False)
+        return job_queue.enqueue('purge_conversations', {'user_id': user_id, 'delete_user': True})
+
+    delete_conversations(user_id, commit=False)
+    _delete_user(user_id)
+    db.session.commit()
+    return None
+
+
+# Step 3: DELETE em conjunto das conversas (e mensagens) do usuário
+def delete_conversations(user_id, conversation_ids=None, max_conversation_id=None, commit=True):
+    filtros = [Conversation.user_id == user_id]
+    if conversation_ids is not None:
+        filtros.append(Conversation.id.in_(conversation_ids))
+    if max_conversation_id is not None:
+        filtros.append(Conversation.id <= max_conversation_id)
+
+    # Explicação: só os IDs (inteiros), para invalidar o cache do histórico depois
+    ids = [conversa_id for (conversa_id,) in db.session.query(Conversation.id).filter(*filtros)]
+    if not ids:
+        return 0
+
+    conversas = select(Conversation.id).where(*filtros)
+    Message.query.filter(Message.conversation_id.in_(conversas)).delete(synchronize_session=False)
+    ConversationArchive.query.filter(ConversationArchive.conversation_id.in_(conversas)).delete(
+        synchronize_session=False
+    )
+    Conversation.query.filter(*filtros).delete(synchronize_session=False)
+    if commit:
+        db.session.commit()
+    history_cache.invalidate_many(ids)
+    return len(ids)
+
+
+# Step 4: limpeza em lotes (tarefa da fila); cada lote é uma transação curta
+def purge_conversations(user_id, max_conversation_id=None, delete_user=False, chunk_size=None):
+    tamanho = chunk_size or current_app.config["BULK_DELETE_CHUNK_SIZE"]
+    filtros = [Conversation.user_id == user_id]
+    if max_conversation_id is not None:
+        filtros.append(Conversation.id <= max_conversation_id)
+
+    apagadas = 0
+    while True:
+        ids = [
+            conversa_id for (conversa_id,) in
+            db.session.query(Conversation.id).filter(*filtros).order_by(Conversation.id).limit(tamanho)
+        ]
+        if not ids:
+            break
+
+        # Step 4.1: mensagens desse grupo de conversas, no máximo `tamanho` por transação
+        while True:
+            lote = [
+                mensagem_id for (mensagem_id,) in
+                db.session.query(Message.id).filter(Message.conversation_id.in_(ids)).limit(tamanho)
+            ]
+            if not lote:
+                break
+            Message.query.filter(Message.id.in_(lote)).delete(synchronize_session=False)
+            db.session.commit()
+
+        # Step 4.2: depois o arquivo frio e as próprias conversas
+        ConversationArchive.query.filter(ConversationArchive.conversation_id.in_(ids)).delete(
+            synchronize_session=False
+        )
+        Conversation.query.filter(Conversation.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        history_cache.invalidate_many(ids)
+        apagadas += len(ids)
+
+    if delete_user:
+        _delete_user(user_id)
+        db.session.commit()
+
+    return {'conversations': apagadas, 'user_deleted': delete_user}
+
+
+# Step 5: handler da fila
+@job_queue.handler('purge_conversations')
+def _purge_job(payload):
+    return purge_conversations(
+        payload['user_id'],
+        max_conversation_id=payload.get('max_conversation_id'),
+        delete_user=payload.get('delete_user', False),
+    )
+
+
+# Step 6: acima do limite de mensagens, a exclusão vai para a fila
+# Explicação: usa a contagem guardada em cada conversa, sem contar a tabela `messages`
+def _is_large(user_id):
+    total = (
+        db.session.query(db.func.coalesce(db.func.sum(Conversation.message_count), 0))
+        .filter(Conversation.user_id == user_id)
+        .scalar()
+    )
+    return total > current_app.config["BULK_DELETE_SYNC_LIMIT"]
+
+
+# Step 7: apaga o usuário e as tarefas dele (também sem carregar nada no ORM)
+def _delete_user(user_id):
+    Job.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    User.query.filter_by(id=user_id).delete(synchronize_session=False)
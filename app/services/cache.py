@@ -0,0 +1,230 @@
+# Parte 17: caches reutilizáveis (memória com LRU/TTL e disco opcional)
+#
+# Explicação: usados pelos serviços que precisam guardar resultados caros
+# (ex.: respostas do Gemini). A camada em memória é por processo; a camada
+# em disco é compartilhada pelos workers que enxergam a mesma pasta.
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+# Step 1: contadores de acerto/erro, comuns a todas as camadas
+class CacheStats:
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def as_dict(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+# Step 2: cache em memória com LRU (limite de itens) e TTL
+class LRUCache:
+
+    def __init__(self, max_entries=1000, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+        self._items = OrderedDict()  # chave -> (expira_em, valor)
+
+    # Step 2.1: busca um valor (None se não existe ou expirou)
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.stats.misses += 1
+                return None
+
+            expira_em, valor = item
+            if expira_em is not None and expira_em < time.time():
+                del self._items[key]
+                self.stats.misses += 1
+                return None
+
+            self._items.move_to_end(key)
+            self.stats.hits += 1
+            return valor
+
+    # Step 2.2: guarda um valor, removendo o menos usado se passar do limite
+    # Explicação: `expires_at` é a validade que o valor já tinha em outra camada
+    # (ex.: disco); a entrada nunca vive mais do que lá
+    def set(self, key, value, ttl=None, expires_at=None):
+        ttl = self.ttl if ttl is None else ttl
+        expira_em = time.time() + ttl if ttl else None
+        if expires_at is not None:
+            expira_em = expires_at if expira_em is None else min(expira_em, expires_at)
+        with self._lock:
+            self._items[key] = (expira_em, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+                self.stats.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+# Step 3: cache em disco (um arquivo JSON por chave), com TTL e limite de arquivos
+# Explicação: o total de arquivos é contado uma vez e depois só somado/subtraído;
+# a pasta só é listada quando a conta passa de `max_entries`, e aí a limpeza
+# desce até `low_water` do limite para a próxima listagem demorar a chegar
+class DiskCache:
+
+    def __init__(self, directory, max_entries=10000, ttl=None, low_water=0.9):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.low_water = low_water
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+        self._count = None  # Explicação: arquivos na pasta (None = ainda não contou)
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    # Step 3.1: lê do disco (arquivo ausente, corrompido ou expirado = miss)
+    def get(self, key):
+        item = self.get_item(key)
+        return None if item is None else item[0]
+
+    # Step 3.1.1: mesmo que o get, mas retorna (valor, expira_em)
+    def get_item(self, key):
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                item = json.load(f)
+        except (OSError, ValueError):
+            self.stats.misses += 1
+            return None
+
+        if item.get("expires_at") is not None and item["expires_at"] < time.time():
+            self.delete(key)
+            self.stats.misses += 1
+            return None
+
+        self.stats.hits += 1
+        return item["value"], item.get("expires_at")
+
+    # Step 3.2: grava de forma atômica (arquivo temporário + rename)
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        item = {"expires_at": time.time() + ttl if ttl else None, "value": value}
+        temporario = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            novo = not os.path.exists(self._path(key))
+            with open(temporario, "w", encoding="utf-8") as f:
+                json.dump(item, f, ensure_ascii=False)
+            os.replace(temporario, self._path(key))
+        except OSError:
+            return
+        if novo:
+            self._added(1)
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            return
+        self._added(-1)
+
+    def clear(self):
+        for entrada in self._list():
+            try:
+                os.remove(entrada.path)
+            except OSError:
+                pass
+        with self._lock:
+            self._count = 0
+
+    # Step 3.3: atualiza a contagem e limpa a pasta só quando ela passa do limite
+    # Explicação: a contagem é deste processo; arquivos criados por outros workers
+    # aparecem na próxima listagem (o excesso fica limitado pelo low_water de cada um)
+    def _added(self, total):
+        with self._lock:
+            if self._count is None:
+                self._count = len(self._list())
+            else:
+                self._count = max(0, self._count + total)
+            if self._count > self.max_entries:
+                self._evict()
+
+    def _list(self):
+        try:
+            return [e for e in os.scandir(self.directory) if e.name.endswith(".json")]
+        except OSError:
+            return []
+
+    # Step 3.4: remove os arquivos mais antigos até `low_water` do limite
+    def _evict(self):
+        arquivos = self._list()
+        self._count = len(arquivos)
+        if self._count <= self.max_entries:
+            return
+        arquivos.sort(key=lambda e: e.stat().st_mtime)
+        for entrada in arquivos[:self._count - int(self.max_entries * self.low_water)]:
+            try:
+                os.remove(entrada.path)
+                self.stats.evictions += 1
+                self._count -= 1
+            except OSError:
+                pass
+
+
+# Step 4: memória primeiro, disco depois (o que vem do disco sobe para a memória)
+class TieredCache:
+
+    def __init__(self, memory, disk=None):
+        self.memory = memory
+        self.disk = disk
+
+    # Explicação: o valor que sobe do disco mantém a validade que tinha lá, em vez
+    # de ganhar um TTL cheio na memória
+    def get(self, key):
+        valor = self.memory.get(key)
+        if valor is None and self.disk is not None:
+            item = self.disk.get_item(key)
+            if item is not None:
+                valor, expira_em = item
+                self.memory.set(key, valor, expires_at=expira_em)
+        return valor
+
+    def set(self, key, value, ttl=None):
+        self.memory.set(key, value, ttl)
+        if self.disk is not None:
+            self.disk.set(key, value, ttl)
+
+    def delete(self, key):
+        self.memory.delete(key)
+        if self.disk is not None:
+            self.disk.delete(key)
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self):
+        return {
+            "memory": self.memory.stats.as_dict(),
+            "disk": self.disk.stats.as_dict() if self.disk is not None else None,
+        }
@@ -0,0 +1,278 @@
+# Parte 13: fluxo de envio de mensagens em transações curtas
+#
+# Explicação: a chamada ao Gemini pode levar vários segundos (com retries),
+# então ela nunca acontece com uma transação aberta. O envio é dividido em:
+#   1. salva o turno do usuário como 'pending' e faz commit
+#   2. chama o modelo sem nenhuma transação/lock no banco
+#   3. salva a resposta e marca o turno como 'complete' (ou 'failed')
+
+import json
+from datetime import datetime
+
+from flask import current_app
+
+from app import db
+from app.models import Conversation, Job, Message
+from app.services.context_window import estimate_tokens, estimate_usage
+from app.services.history_cache import history_cache
+from app.services.job_queue import job_queue
+from app.services.rendering import render_message
+
+
+# Step 1: salva a mensagem do usuário como pendente
+# Explicação: com commit=False a mensagem só vai para a sessão (o queue_user_turn grava
+# a mensagem e a tarefa no mesmo commit)
+def create_user_turn(conversation_id, content, commit=True):
+    mensagem = Message(
+        content=content,
+        content_html=render_message(content),
+        role='user',
+        conversation_id=conversation_id,
+        status=Message.STATUS_PENDING,
+        prompt_tokens=estimate_tokens(content),
+    )
+    db.session.add(mensagem)
+    _touch_conversation(conversation_id, new_message=mensagem)
+    if commit:
+        db.session.commit()  # Explicação: libera o lock de escrita antes de chamar o Gemini
+    else:
+        db.session.flush()  # Explicação: garante que o ID é gerado
+    return mensagem
+
+
+# Step 1.1: salva a mensagem pendente e agenda a resposta na fila, no mesmo commit
+def queue_user_turn(conversation_id, content, user_id):
+    mensagem = create_user_turn(conversation_id, content, commit=False)
+    job = job_queue.enqueue('reply', _reply_payload(mensagem.id), user_id=user_id)
+    return mensagem, job
+
+
+# Step 1.2: tarefa da fila que ainda vai responder um turno pendente desta conversa
+# Explicação: o payload é o JSON de _reply_payload, então a busca compara o texto
+# com o dos turnos pendentes da conversa (outras conversas do usuário ficam de fora)
+def pending_reply_job(conversation_id, user_id):
+    pendentes = [
+        json.dumps(_reply_payload(message_id)) for (message_id,) in
+        db.session.query(Message.id).filter(
+            Message.conversation_id == conversation_id,
+            Message.role == 'user',
+            Message.status == Message.STATUS_PENDING,
+        )
+    ]
+    if not pendentes:
+        return None
+    return (
+        Job.query.filter(
+            Job.user_id == user_id,
+            Job.kind == 'reply',
+            Job.status.in_([Job.STATUS_QUEUED, Job.STATUS_RUNNING]),
+            Job.payload.in_(pendentes),
+        )
+        .order_by(Job.id.desc())
+        .first()
+    )
+
+
+def _reply_payload(message_id):
+    return {'message_id': message_id}
+
+
+# Step 2: monta o histórico no formato do Gemini, dentro do orçamento de tokens
+# Explicação: apenas turnos completos anteriores a `before_message_id` entram; a
+# mensagem nova vai como `message`. O cache incremental só busca as mensagens novas.
+def build_history(conversation_id, before_message_id=None):
+    return history_cache.build(
+        conversation_id,
+        before_message_id=before_message_id,
+        budget_tokens=current_app.config["CONTEXT_WINDOW_TOKENS"],
+        keep_last=current_app.config["CONTEXT_KEEP_LAST_MESSAGES"],
+    )
+
+
+# Step 2.1: compare-and-set do turno (pending -> complete/failed)
+# Explicação: uma tarefa devolvida pelo requeue_stale pode rodar em dois workers;
+# só quem muda o status grava a resposta e soma os tokens (o outro recebe None)
+def _close_turn(user_message_id, status):
+    fechado = (
+        db.session.query(Message)
+        .filter(Message.id == user_message_id, Message.status == Message.STATUS_PENDING)
+        .update({Message.status: status}, synchronize_session=False)
+    )
+    if not fechado:
+        db.session.rollback()
+        return None
+    mensagem_usuario = db.session.get(Message, user_message_id)
+    db.session.refresh(mensagem_usuario)
+    return mensagem_usuario
+
+
+# Step 3: salva a resposta do modelo e conclui o turno
+# Explicação: `usage` vem do usage_metadata da API; sem ele, usa o estimador local.
+# Retorna None se o turno já tinha sido concluído por outro worker
+def complete_turn(user_message_id, reply_text, usage=None):
+    mensagem_usuario = _close_turn(user_message_id, Message.STATUS_COMPLETE)
+    if mensagem_usuario is None:
+        return None
+
+    if usage is None:
+        usage = {
+            'prompt_tokens': mensagem_usuario.prompt_tokens or estimate_tokens(mensagem_usuario.content),
+            'response_tokens': estimate_tokens(reply_text),
+        }
+
+    # Explicação: resposta do cache de respostas não foi cobrada: sem prompt enviado e
+    # nada somado no total; response_tokens continua valendo para a janela de contexto
+    if usage.get('cached'):
+        usage = {'prompt_tokens': None, 'response_tokens': usage.get('response_tokens') or estimate_tokens(reply_text)}
+        tokens = 0
+    else:
+        tokens = usage['prompt_tokens'] + usage['response_tokens']
+
+    mensagem_gemini = Message(
+        content=reply_text,
+        content_html=render_message(reply_text),
+        role='assistant',
+        conversation_id=mensagem_usuario.conversation_id,
+        status=Message.STATUS_COMPLETE,
+        prompt_tokens=usage['prompt_tokens'],
+        response_tokens=usage['response_tokens'],
+    )
+    db.session.add(mensagem_gemini)
+    _touch_conversation(
+        mensagem_usuario.conversation_id,
+        tokens=tokens,
+        new_message=mensagem_gemini,
+    )
+
+    db.session.commit()
+    return mensagem_gemini
+
+
+# Step 4: marca o turno como falho, guardando o erro para exibir ao usuário
+def fail_turn(user_message_id, error_text):
+    mensagem_usuario = _close_turn(user_message_id, Message.STATUS_FAILED)
+    if mensagem_usuario is None:
+        return None
+
+    # Explicação: a mensagem de erro fica visível na conversa, mas como 'failed'
+    # ela (e a pergunta) não entram no histórico enviado ao Gemini
+    mensagem_erro = Message(
+        content=error_text,
+        content_html=render_message(error_text),
+        role='assistant',
+        conversation_id=mensagem_usuario.conversation_id,
+        status=Message.STATUS_FAILED,
+    )
+    db.session.add(mensagem_erro)
+    _touch_conversation(mensagem_usuario.conversation_id, new_message=mensagem_erro)
+
+    db.session.commit()
+    return mensagem_erro
+
+
+# Step 5: executa um turno completo (histórico -> Gemini -> resposta)
+def run_turn(user_message_id, service=None):
+    if service is None:
+        from app.services.gemini_service import gemini_service as service
+
+    # Step 5.1: lê o que for preciso e encerra a transação de leitura
+    mensagem_usuario = db.session.get(Message, user_message_id)
+    content = mensagem_usuario.content
+    historico = build_history(mensagem_usuario.conversation_id, before_message_id=user_message_id)
+    db.session.commit()
+
+    # Step 5.2: chamada de rede sem nenhuma transação aberta
+    # Explicação: a resposta vem em streaming e o texto parcial vai para a tarefa da
+    # fila (jobs.output), de onde a rota SSE repassa os pedaços ao navegador
+    partes = []
+
+    def repassar(texto):
+        partes.append(texto)
+        job_queue.write_output(''.join(partes))
+
+    resposta_texto, sucesso, uso = service.send_message(content, historico, return_usage=True, on_chunk=repassar)
+
+    # Step 5.3: grava o resultado em uma nova transação curta
+    if sucesso:
+        uso = uso or estimate_usage(content, historico, resposta_texto)
+        return complete_turn(user_message_id, resposta_texto, usage=uso), True
+    return fail_turn(user_message_id, resposta_texto), False
+
+
+# Step 6: handler da fila que gera a resposta de um turno pendente
+def _reply_job_failed(payload, error_text):
+    mensagem_usuario = db.session.get(Message, payload['message_id'])
+    if mensagem_usuario is not None and mensagem_usuario.status == Message.STATUS_PENDING:
+        fail_turn(mensagem_usuario.id, f"Erro ao obter resposta do Gemini: {error_text}")
+
+
+@job_queue.handler('reply', on_failure=_reply_job_failed)
+def _reply_job(payload):
+    mensagem_usuario = db.session.get(Message, payload['message_id'])
+
+    # Explicação: a conversa pode ter sido apagada enquanto a tarefa esperava
+    if mensagem_usuario is None or mensagem_usuario.status != Message.STATUS_PENDING:
+        return {'skipped': True}
+
+    resposta, sucesso = run_turn(mensagem_usuario.id)
+    if resposta is None:
+        return {'skipped': True}  # Explicação: outro worker concluiu o turno antes
+    return {'message_id': resposta.id, 'success': sucesso}
+
+
+# Step 6.1: apaga uma mensagem e refaz o resumo da conversa (contagem, tokens e última mensagem)
+# Explicação: o message_count menor faz o cache do histórico dos outros processos ler a
+# conversa de novo (ver history_cache); o deste processo já é invalidado aqui
+def delete_message(message):
+    conversation_id = message.conversation_id
+    # Explicação: só a resposta concluída e cobrada somou tokens no total (prompt + resposta,
+    # Step 3); a que veio do cache de respostas tem prompt_tokens None
+    tokens = 0
+    if message.role != 'user' and message.status == Message.STATUS_COMPLETE and message.prompt_tokens is not None:
+        tokens = (message.prompt_tokens or 0) + (message.response_tokens or 0)
+    Message.query.filter_by(id=message.id).delete(synchronize_session=False)
+
+    ultima = (
+        db.session.query(Message.timestamp, Message.content)
+        .filter(Message.conversation_id == conversation_id)
+        .order_by(Message.timestamp.desc(), Message.id.desc())
+        .first()
+    )
+    db.session.query(Conversation).filter_by(id=conversation_id).update({
+        Conversation.updated_at: datetime.utcnow(),
+        Conversation.message_count: Conversation.message_count - 1,
+        Conversation.total_tokens: Conversation.total_tokens - tokens,
+        Conversation.last_message_at: ultima.timestamp if ultima else None,
+        Conversation.last_message_preview: message_preview(ultima.content) if ultima else None,
+    }, synchronize_session=False)
+    db.session.commit()
+    history_cache.invalidate(conversation_id)
+
+
+# Step 7: atualiza o timestamp e soma os tokens do turno na conversa
+# Explicação: o incremento é feito no próprio UPDATE, sem ler o total antes.
+# Com `new_message`, o mesmo UPDATE (e a mesma transação) atualiza a contagem
+# e a prévia da última mensagem usadas na lista de conversas
+def _touch_conversation(conversation_id, tokens=0, new_message=None):
+    agora = datetime.utcnow()
+    valores = {
+        Conversation.updated_at: agora,
+        Conversation.total_tokens: Conversation.total_tokens + tokens,
+    }
+    if new_message is not None:
+        new_message.timestamp = new_message.timestamp or agora
+        valores[Conversation.message_count] = Conversation.message_count + 1
+        valores[Conversation.last_message_at] = new_message.timestamp
+        valores[Conversation.last_message_preview] = message_preview(new_message.content)
+
+    db.session.query(Conversation).filter_by(id=conversation_id).update(
+        valores, synchronize_session=False,
+    )
+
+
+# Step 7.1: prévia curta da mensagem (uma linha, até PREVIEW_CHARS caracteres)
+def message_preview(content):
+    texto = " ".join((content or "").split())
+    if len(texto) <= Conversation.PREVIEW_CHARS:
+        return texto
+    return texto[:Conversation.PREVIEW_CHARS - 3].rstrip() + "..."
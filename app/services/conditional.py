@@ -0,0 +1,98 @@
+# Parte 32: GET condicional (ETag / Last-Modified / 304) nas páginas das conversas
+#
+# Explicação: o navegador guarda a página com o ETag e, ao voltar, pergunta
+# "mudou?" (If-None-Match). A rota calcula o ETag com o que já tem de uma
+# consulta barata no índice (updated_at da conversa, ou max(updated_at) e o
+# total das conversas do usuário) e, se for igual, responde 304 sem buscar
+# as mensagens e sem renderizar o template.
+#
+# O ETag também leva o usuário (nome e email aparecem na página), os
+# parâmetros da URL (página/cursor) e a versão dos templates, do HTML das
+# mensagens e dos arquivos estáticos (um deploy com templates, renderizador ou
+# CSS/JS novos muda todos os ETags).
+# Páginas com mensagem flash pendente nunca respondem 304, senão a mensagem
+# ficaria para a próxima página.
+#
+# O Last-Modified é a data mais recente entre a alteração dos dados e a dos
+# templates (deploy). Ele é só informativo: um If-Modified-Since sozinho não
+# dá 304, porque a data (em segundos) não cobre o usuário, a página nem as
+# versões que estão no ETag.
+
+import hashlib
+import os
+from datetime import datetime, timezone
+
+from flask import current_app, make_response, request, session
+from flask_login import current_user
+
+from app.services.rendering import RENDER_VERSION
+
+# Explicação: revalida sempre (no-cache) e só no navegador do usuário (private)
+CACHE_CONTROL = "private, no-cache"
+
+
+# Step 1: versão dos templates (hash do conteúdo, calculada uma vez por processo)
+def templates_version(app):
+    if "templates_version" not in app.extensions:
+        _read_templates(app)
+    return app.extensions["templates_version"]
+
+
+# Step 1.1: data da última alteração dos templates (entra no Last-Modified)
+def templates_modified(app):
+    if "templates_modified" not in app.extensions:
+        _read_templates(app)
+    return app.extensions["templates_modified"]
+
+
+def _read_templates(app):
+    digest = hashlib.sha256()
+    modificado = 0
+    pasta = os.path.join(app.root_path, app.template_folder)
+    for raiz, pastas, arquivos in os.walk(pasta):
+        pastas.sort()
+        for nome in sorted(arquivos):
+            caminho = os.path.join(raiz, nome)
+            digest.update(nome.encode("utf-8"))
+            with open(caminho, "rb") as f:
+                digest.update(f.read())
+            modificado = max(modificado, os.path.getmtime(caminho))
+    app.extensions.setdefault("templates_version", digest.hexdigest()[:12])
+    app.extensions.setdefault("templates_modified", datetime.fromtimestamp(modificado, timezone.utc))
+
+
+# Step 2: ETag forte da página
+def page_etag(*parts):
+    usuario = (current_user.id, current_user.username, current_user.email) if current_user.is_authenticated else None
+    argumentos = sorted(request.args.items(multi=True))
+    texto = "|".join(str(parte) for parte in (
+        request.endpoint, templates_version(current_app), RENDER_VERSION, current_app.extensions.get("assets_manifest"),
+        usuario, argumentos, *parts
+    ))
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()[:32]
+
+
+# Step 3: responde 304 quando o navegador já tem a página; senão chama `render`
+# Explicação: `last_modified` é a alteração dos dados (updated_at, em UTC); o 304 só
+# sai pelo If-None-Match
+def conditional_page(render, *etag_parts, last_modified=None):
+    if session.get("_flashes"):
+        return render()
+
+    etag = page_etag(*etag_parts)
+    if request.if_none_match.contains(etag):
+        resposta = current_app.response_class(status=304)
+    else:
+        resposta = make_response(render())
+    resposta.set_etag(etag)
+    resposta.last_modified = _last_modified(last_modified)
+    resposta.headers["Cache-Control"] = CACHE_CONTROL
+    resposta.vary.add("Cookie")
+    return resposta
+
+
+def _last_modified(data):
+    modificada_em = templates_modified(current_app)
+    if data is not None:
+        modificada_em = max(modificada_em, data.replace(tzinfo=timezone.utc))
+    return modificada_em.replace(microsecond=0)
@@ -0,0 +1,120 @@
+# Parte 16: janela de contexto com orçamento de tokens
+#
+# Explicação: mandar a conversa inteira em todo turno faz o prompt (e o custo,
+# e a latência) crescer sem limite. Aqui o histórico é montado do mais novo
+# para o mais antigo até encher um orçamento de tokens:
+#   - as últimas mensagens sempre entram
+#   - a mensagem que não cabe inteira é resumida (fica só o final dela)
+#   - as mais antigas que isso ficam de fora
+# A contagem de tokens é local e fica em cache por mensagem, sem chamar
+# `count_tokens` pela rede.
+
+import math
+import threading
+from collections import OrderedDict
+
+# Step 1: parâmetros do estimador local
+CHARS_PER_TOKEN = 4  # Explicação: média aproximada para português/inglês no Gemini
+MESSAGE_OVERHEAD_TOKENS = 4  # Explicação: custo do role/separadores de cada mensagem
+MIN_COLLAPSED_TOKENS = 32  # Explicação: abaixo disso não vale a pena resumir
+COLLAPSED_PREFIX = "[...] "
+
+
+# Step 2: estima os tokens de um texto sem chamar a API
+def estimate_tokens(text):
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+# Step 3: cache de tokens por mensagem (o conteúdo de uma mensagem não muda)
+class _TokenCountCache:
+
+    def __init__(self, max_entries=50000):
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._counts = OrderedDict()
+
+    def get(self, message):
+        with self._lock:
+            count = self._counts.get(message.id)
+            if count is not None:
+                self._counts.move_to_end(message.id)
+                return count
+
+        count = estimate_tokens(message.content)
+        if message.id is not None:
+            with self._lock:
+                self._counts[message.id] = count
+                if len(self._counts) > self._max_entries:
+                    self._counts.popitem(last=False)
+        return count
+
+
+_token_counts = _TokenCountCache()
+
+
+# Step 4: tokens de uma mensagem do banco
+# Explicação: usa a contagem salva na mensagem; o cache só cobre mensagens sem contagem
+def message_tokens(message):
+    tokens = message.content_tokens
+    if tokens is None:
+        tokens = _token_counts.get(message)
+    return tokens + MESSAGE_OVERHEAD_TOKENS
+
+
+# Step 4.1: estima o uso de um turno quando a API não devolve usage_metadata
+def estimate_usage(message, history, reply):
+    prompt = estimate_tokens(message) + sum(
+        estimate_tokens(entry['parts'][0]) + MESSAGE_OVERHEAD_TOKENS for entry in history or []
+    )
+    return {'prompt_tokens': prompt, 'response_tokens': estimate_tokens(reply)}
+
+
+# Step 5: converte uma mensagem para o formato do Gemini
+def to_gemini_entry(message, content=None):
+    return {
+        'role': 'user' if message.role == 'user' else 'model', # Explicação: role usado para identificar "quem disse o que na conversa"
+        'parts': [message.content if content is None else content]
+    }
+
+
+# Step 6: encaixa o histórico no orçamento de tokens
+def fit_history(messages_newest_first, budget_tokens, keep_last=2):
+    """Recebe as mensagens da mais nova para a mais antiga (pode ser um cursor)
+    e devolve o histórico do Gemini em ordem cronológica."""
+    selecionadas = []
+    usados = 0
+
+    for posicao, mensagem in enumerate(messages_newest_first):
+        tokens = message_tokens(mensagem)
+        restante = budget_tokens - usados
+
+        # Step 6.1: cabe inteira (ou é uma das últimas, que sempre entram)
+        if tokens <= restante or posicao < keep_last:
+            if tokens > restante:
+                # Explicação: até as últimas são cortadas se sozinhas estouram o orçamento
+                selecionadas.append(_collapse(mensagem, max(restante, MIN_COLLAPSED_TOKENS)))
+            else:
+                selecionadas.append(to_gemini_entry(mensagem))
+            usados += tokens
+            continue
+
+        # Step 6.2: não cabe inteira, resume a mensagem que está na fronteira e para
+        if restante >= MIN_COLLAPSED_TOKENS:
+            selecionadas.append(_collapse(mensagem, restante))
+        break
+
+    selecionadas.reverse()
+
+    # Step 6.3: o histórico do Gemini deve começar com uma mensagem do usuário
+    while selecionadas and selecionadas[0]['role'] != 'user':
+        selecionadas.pop(0)
+
+    return selecionadas
+
+
+# Step 7: mantém só o final do texto (a parte mais próxima do presente)
+def _collapse(message, tokens):
+    caracteres = max(0, (tokens - MESSAGE_OVERHEAD_TOKENS) * CHARS_PER_TOKEN - len(COLLAPSED_PREFIX))
+    return to_gemini_entry(message, COLLAPSED_PREFIX + message.content[-caracteres:] if caracteres else COLLAPSED_PREFIX)
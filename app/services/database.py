@@ -0,0 +1,118 @@
+# Parte 23: banco de dados em produção (PostgreSQL com pool e réplica de leitura)
+#
+# Explicação: com SQLite cada pod do k8s tem o seu arquivo, e cada usuário vê
+# dados diferentes dependendo do pod. Com PostgreSQL todos os pods usam o mesmo
+# banco, cada processo mantém um pool de conexões (tamanho, overflow,
+# pre-ping e recycle configuráveis) e, se DATABASE_REPLICA_URL estiver
+# definido, as rotas marcadas com @use_replica leem da réplica.
+#
+# Depois de uma escrita o usuário volta a ler do primário por alguns segundos
+# (DATABASE_REPLICA_STICKY_SECONDS), assim ele sempre vê a própria mensagem
+# mesmo que a réplica esteja um pouco atrasada.
+
+import time
+from functools import wraps
+
+import sqlalchemy as sa
+from flask import current_app, g, has_app_context, has_request_context, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+REPLICA_ENGINE = "database_replica"
+_ULTIMA_ESCRITA = "_db_ultima_escrita"
+
+
+# Step 1: normaliza a URL (Render/Heroku usam o prefixo antigo postgres://)
+def normalize_url(url):
+    if url and url.startswith("postgres://"):
+        return "postgresql://" + url[len("postgres://"):]
+    return url
+
+
+# Step 2: opções do pool para bancos de servidor (o SQLite usa o pool padrão)
+def engine_options(config, url):
+    if not url or make_url(url).get_backend_name() == "sqlite":
+        return {}
+    return {
+        "pool_size": config["DB_POOL_SIZE"],
+        "max_overflow": config["DB_MAX_OVERFLOW"],
+        "pool_timeout": config["DB_POOL_TIMEOUT"],
+        "pool_recycle": config["DB_POOL_RECYCLE"],  # Explicação: renova conexões antes do timeout do servidor
+        "pool_pre_ping": config["DB_POOL_PRE_PING"],  # Explicação: descarta conexões mortas antes de usar
+    }
+
+
+# Step 3: aplica URL, pool e réplica no config (antes do db.init_app)
+def configure_database(app):
+    config = app.config
+    config.setdefault("DB_POOL_SIZE", 10)
+    config.setdefault("DB_MAX_OVERFLOW", 20)
+    config.setdefault("DB_POOL_TIMEOUT", 30)
+    config.setdefault("DB_POOL_RECYCLE", 1800)
+    config.setdefault("DB_POOL_PRE_PING", True)
+    config.setdefault("DATABASE_REPLICA_URL", None)
+    config.setdefault("DATABASE_REPLICA_STICKY_SECONDS", 5)
+
+    url = normalize_url(config.get("SQLALCHEMY_DATABASE_URI"))
+    config["SQLALCHEMY_DATABASE_URI"] = url
+
+    opcoes = engine_options(config, url)
+    if opcoes:
+        config["SQLALCHEMY_ENGINE_OPTIONS"] = {**opcoes, **config.get("SQLALCHEMY_ENGINE_OPTIONS", {})}
+
+    # Step 3.1: o engine da réplica fica fora do SQLALCHEMY_BINDS e é usado só pelo RoutingSession
+    # Explicação: como bind, o db.create_all() e o Alembic tentariam criar as tabelas nela
+    replica_url = normalize_url(config["DATABASE_REPLICA_URL"])
+    if replica_url:
+        app.extensions[REPLICA_ENGINE] = sa.create_engine(replica_url, **engine_options(config, replica_url))
+
+
+# Step 3.2: engine da réplica do app atual (None quando não há réplica)
+def replica_engine():
+    return current_app.extensions.get(REPLICA_ENGINE)
+
+
+# Step 4: sessão que manda os SELECTs das rotas de leitura para a réplica
+class RoutingSession(Session):
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = self._replica(clause) if bind is None else None
+        if replica is not None:
+            return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _replica(self, clause):
+        # Explicação: flush, INSERT/UPDATE/DELETE e SELECT ... FOR UPDATE ficam no primário
+        if self._flushing or not isinstance(clause, sa.Select) or clause._for_update_arg is not None:
+            return None
+        if not (has_app_context() and g.get("_db_replica")):
+            return None
+        return replica_engine()
+
+
+# Step 4.1: marca o momento da última escrita do usuário (vai no cookie da sessão)
+@event.listens_for(RoutingSession, "after_flush")
+def _marcar_escrita(db_session, flush_context):
+    if has_request_context():
+        session[_ULTIMA_ESCRITA] = time.time()
+
+
+# Step 5: decorator das rotas só de leitura
+def use_replica(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        ultima_escrita = session.get(_ULTIMA_ESCRITA, 0)
+        recente = time.time() - ultima_escrita < current_app.config["DATABASE_REPLICA_STICKY_SECONDS"]
+        g._db_replica = not recente
+        try:
+            return view(*args, **kwargs)
+        finally:
+            g._db_replica = False
+    return wrapper
+
+
+# Step 5.1: volta a ler do primário no resto da requisição (ex.: a rota de leitura vai escrever)
+def use_primary():
+    if has_app_context():
+        g._db_replica = False
@@ -0,0 +1,121 @@
+# Parte 28: exportação das conversas do usuário (NDJSON ou ZIP) em streaming
+#
+# Explicação: a exportação é um gerador - cada conversa e cada mensagem vira
+# bytes assim que sai do banco e já vai para a resposta. As consultas usam
+# yield_per (cursor no servidor no PostgreSQL) e selecionam colunas, não
+# objetos do ORM, então nada se acumula na sessão: a memória fica igual para
+# uma conta com 10 ou com 1 milhão de mensagens. Conversas no arquivo frio são
+# lidas direto do arquivo comprimido, sem restaurar.
+#
+# NDJSON: uma linha por registro, {"type": "conversation", ...} seguida das
+# linhas {"type": "message", ...} dessa conversa.
+# ZIP: um arquivo conversas/<id>.json por conversa, com as mensagens dentro.
+
+import json
+import zipfile
+from datetime import datetime
+
+from sqlalchemy import select
+
+from app import db
+from app.models import Conversation, Message
+from app.services import archive
+
+FORMATS = {"ndjson": "application/x-ndjson", "zip": "application/zip"}
+_LOTE = 500
+
+# Step 1: colunas exportadas (as mesmas chaves nos dois formatos)
+_CONVERSA = (Conversation.id, Conversation.title, Conversation.created_at, Conversation.updated_at,
+             Conversation.message_count, Conversation.total_tokens, Conversation.archived_at)
+_MENSAGEM = (Message.id, Message.role, Message.content, Message.status, Message.timestamp,
+             Message.prompt_tokens, Message.response_tokens)
+_CHAVES_MENSAGEM = [coluna.key for coluna in _MENSAGEM]
+
+
+# Step 2: conversas e mensagens do usuário, uma de cada vez
+def iter_conversations(user_id):
+    consulta = (
+        select(*_CONVERSA).where(Conversation.user_id == user_id)
+        .order_by(Conversation.id).execution_options(yield_per=_LOTE)
+    )
+    for conversa in db.session.execute(consulta).mappings():
+        yield {chave: conversa[chave] for chave in conversa.keys() if chave != "archived_at"}, \
+            _iter_messages(conversa["id"], conversa["archived_at"] is not None)
+
+
+def _iter_messages(conversation_id, arquivada):
+    if arquivada:
+        for mensagem in archive.iter_archived_messages(conversation_id):
+            yield {chave: mensagem.get(chave) for chave in _CHAVES_MENSAGEM}
+        return
+
+    consulta = (
+        select(*_MENSAGEM).where(Message.conversation_id == conversation_id)
+        .order_by(Message.id).execution_options(yield_per=_LOTE)
+    )
+    for mensagem in db.session.execute(consulta).mappings():
+        yield dict(mensagem)
+
+
+# Step 3: NDJSON
+def ndjson_chunks(user_id):
+    for conversa, mensagens in iter_conversations(user_id):
+        yield _json({"type": "conversation", **conversa}) + b"\n"
+        # Explicação: junta um lote de linhas por chunk, em vez de um chunk por mensagem
+        linhas = []
+        for mensagem in mensagens:
+            linhas.append(_json({"type": "message", "conversation_id": conversa["id"], **mensagem}) + b"\n")
+            if len(linhas) == _LOTE:
+                yield b"".join(linhas)
+                linhas = []
+        if linhas:
+            yield b"".join(linhas)
+
+
+# Step 4: ZIP escrito em streaming (o zipfile aceita saída sem seek e grava os tamanhos depois dos dados)
+class _Saida:
+
+    def __init__(self):
+        self.partes = []
+
+    def write(self, dados):
+        self.partes.append(bytes(dados))
+        return len(dados)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        dados, self.partes = b"".join(self.partes), []
+        return dados
+
+
+def zip_chunks(user_id):
+    saida = _Saida()
+    with zipfile.ZipFile(saida, mode="w", compression=zipfile.ZIP_DEFLATED) as arquivo_zip:
+        for conversa, mensagens in iter_conversations(user_id):
+            # Explicação: force_zip64 porque o tamanho do arquivo só é conhecido no fim
+            with arquivo_zip.open(f"conversas/{conversa['id']}.json", mode="w", force_zip64=True) as destino:
+                destino.write(_json(conversa)[:-1] + b',"messages":[')
+                for numero, mensagem in enumerate(mensagens):
+                    destino.write((b"," if numero else b"") + _json(mensagem))
+                    if numero % _LOTE == _LOTE - 1:
+                        yield saida.drain()
+                destino.write(b"]}")
+            yield saida.drain()
+    yield saida.drain()  # Explicação: diretório central do ZIP, gravado no close()
+
+
+# Step 5: nome do arquivo baixado
+def filename(formato):
+    return f"flub-conversas-{datetime.utcnow():%Y%m%d}.{formato}"
+
+
+def _json(dados):
+    return json.dumps(dados, ensure_ascii=False, separators=(",", ":"), default=_data).encode("utf-8")
+
+
+def _data(valor):
+    if isinstance(valor, datetime):
+        return valor.isoformat()
+    raise TypeError(f"tipo não exportável: {type(valor).__name__}")
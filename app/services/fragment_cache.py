@@ -0,0 +1,92 @@
+# Parte 30: cache dos trechos de HTML já renderizados (lista de mensagens e de conversas)
+#
+# Explicação: abrir de novo uma conversa longa buscava as mensagens e rodava o
+# template de todas elas, mesmo sem nada novo. Aqui o HTML pronto fica guardado
+# com uma chave que muda sozinha quando a conversa muda:
+#   mensagens de uma conversa -> (conversa, id e horário da última mensagem, página)
+#   lista de conversas        -> (usuário, max(updated_at), total de conversas)
+# Não existe invalidação: mensagem nova = chave nova, e a entrada antiga sai
+# pelo LRU/TTL. A chave inclui o created_at da conversa porque o SQLite pode
+# reutilizar o ID de uma conversa apagada.
+#
+# Memória por processo (LRU) e, com FRAGMENT_CACHE_DIR, disco compartilhado
+# pelos workers (as mesmas classes do cache de respostas do Gemini).
+#
+# Toda chave leva também a versão dos templates e do HTML das mensagens
+# (RENDER_VERSION): um deploy com outro _mensagens.html/_conversas.html não
+# reaproveita o trecho antigo gravado em disco. Com disco, o clear() (rodado
+# pelo `flask render-messages`) muda a "geração" guardada na pasta, que também
+# vai na chave, e os outros workers deixam de usar o que têm em memória.
+
+import hashlib
+import os
+import time
+
+from flask import current_app
+
+from app.services.cache import DiskCache, LRUCache, TieredCache
+from app.services.conditional import templates_version
+from app.services.rendering import RENDER_VERSION
+
+
+# Step 1: cria a classe do cache
+class FragmentCache:
+
+    def __init__(self, enabled=True, max_entries=500, ttl=3600, directory=None, disk_max_entries=5000):
+        self.enabled = enabled
+        self._marker = os.path.join(directory, "generation") if directory else None
+        self._cache = TieredCache(
+            LRUCache(max_entries=max_entries, ttl=ttl),
+            DiskCache(directory, max_entries=disk_max_entries, ttl=ttl) if directory else None,
+        )
+
+    # Step 1.1: devolve o trecho guardado ou chama `render` e guarda o resultado
+    # Explicação: `render` retorna um dict serializável em JSON (HTML e o que a rota precisar junto)
+    def get_or_render(self, namespace, key_parts, render):
+        if not self.enabled:
+            return render()
+        versao = (RENDER_VERSION, templates_version(current_app), self.generation())
+        chave = self.key(namespace, (*versao, *key_parts))
+        valor = self._cache.get(chave)
+        if valor is None:
+            valor = render()
+            self._cache.set(chave, valor)
+        return valor
+
+    # Step 1.2: chave curta e segura como nome de arquivo (o disco usa a chave no nome)
+    @staticmethod
+    def key(namespace, key_parts):
+        texto = "|".join("" if parte is None else str(parte) for parte in key_parts)
+        return f"{namespace}-{hashlib.sha256(texto.encode('utf-8')).hexdigest()[:32]}"
+
+    # Step 1.3: geração do disco (data do arquivo de marcação; 0 sem disco)
+    def generation(self):
+        if self._marker is None:
+            return 0
+        try:
+            return os.stat(self._marker).st_mtime_ns
+        except OSError:
+            return 0
+
+    # Step 1.4: apaga as duas camadas e muda a geração (os outros workers mudam de chave)
+    def clear(self):
+        self._cache.clear()
+        if self._marker is not None:
+            try:
+                with open(self._marker, "w", encoding="utf-8") as f:
+                    f.write(str(time.time_ns()))
+            except OSError:
+                pass
+
+    def stats(self):
+        return {"entries": len(self._cache.memory), **self._cache.stats()}
+
+
+# Step 2: cria a instância global do cache
+fragment_cache = FragmentCache(
+    enabled=os.getenv("FRAGMENT_CACHE_ENABLED", "true").lower() == "true",
+    max_entries=int(os.getenv("FRAGMENT_CACHE_MAX_ENTRIES", "500")),
+    ttl=int(os.getenv("FRAGMENT_CACHE_TTL", "3600")),
+    directory=os.getenv("FRAGMENT_CACHE_DIR") or None,
+    disk_max_entries=int(os.getenv("FRAGMENT_CACHE_DISK_MAX_ENTRIES", "5000")),
+)
@@ -1,28 +1,29 @@
 # Parte 11: conexão com a api da gemini
 
 import os
-import google.generativeai as genai
+import threading
 from flask import current_app
 import json
 import time
+import hashlib
+import unicodedata
 from typing import List, Dict, Optional
-import threading
+from app.services.rate_limiter import TokenBucket, create_backend
+from app.services.cache import LRUCache, DiskCache, TieredCache
+from app.services.llm_backends import create_llm_backend
 
 
 # Step 1: cria a classe para se comunicar com o Gemini
 class GeminiService:
 
-    # Step 1.1 configura a API key do Gemini
-    def __init__(self):
-
-        # Step 1.1.1: pega a API key do .env
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
-            raise ValueError("GEMINI_API_KEY não encontrada no .env")
+    # Step 1.1 configura o serviço
+    def __init__(self, backend=None):
 
-        # Step 1.1.2: modelo do Gemini
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel("gemini-2.5-flash")
+        # Step 1.1.1: backend que gera o texto (Gemini real ou falso, ver llm_backends.py)
+        # Explicação: criado só no primeiro uso, então importar o serviço não exige
+        # GEMINI_API_KEY nem rede
+        self._backend = backend
+        self._backend_lock = threading.Lock()
         
         # Step 1.1.3: parâmetros padrão de geração
         self.default_generation_config = {
@@ -55,24 +56,56 @@ class GeminiService:
         ]
 
         # Step 1.1.5: Sistema de rate limiting para evitar erro 429
+        # Explicação: token bucket compartilhado por todos os workers (arquivo SQLite
+        # no nó por padrão, ou um banco compartilhado entre réplicas)
         self._last_request_time = 0
-        self._min_request_interval = 2.0  # Mínimo 2 segundos entre requisições
-        self._request_lock = threading.Lock()
+        self._default_min_request_interval = 60.0 / float(os.getenv("GEMINI_RATE_LIMIT_RPM", "30"))  # 30/min = 2s entre requisições
+        self._min_request_interval = self._default_min_request_interval
+        self._rate_limiter = TokenBucket(
+            rate=1.0 / self._min_request_interval,
+            capacity=float(os.getenv("GEMINI_RATE_LIMIT_BURST", "1")),
+            backend=create_backend(os.getenv("GEMINI_RATE_LIMIT_BACKEND", "sqlite:///instance/gemini_rate_limit.db")),
+            max_wait=float(os.getenv("GEMINI_RATE_LIMIT_MAX_WAIT", "30")),  # Explicação: espera maior = erro 429 na hora
+        )
         self._consecutive_errors = 0
         self._max_consecutive_errors = 5
 
+        # Step 1.1.5.1: cache de respostas para prompts repetidos (memória + disco opcional)
+        # Explicação: um acerto no cache não passa pelo rate limiter nem chama a API
+        self._response_cache = None
+        if os.getenv("GEMINI_CACHE_ENABLED", "true").lower() == "true":
+            ttl = int(os.getenv("GEMINI_CACHE_TTL", "3600"))
+            cache_dir = os.getenv("GEMINI_CACHE_DIR")
+            self._response_cache = TieredCache(
+                LRUCache(max_entries=int(os.getenv("GEMINI_CACHE_MAX_ENTRIES", "1000")), ttl=ttl),
+                DiskCache(cache_dir, max_entries=int(os.getenv("GEMINI_CACHE_DISK_MAX_ENTRIES", "10000")), ttl=ttl)
+                if cache_dir else None,
+            )
+
+    # Step 1.1.2: backend configurado em LLM_BACKEND (gemini por padrão)
+    @property
+    def backend(self):
+        if self._backend is None:
+            with self._backend_lock:
+                if self._backend is None:
+                    self._backend = create_llm_backend()
+        return self._backend
+
+    @backend.setter
+    def backend(self, backend):
+        self._backend = backend
+
     # Step 1.1.6: Método interno para controle de rate limiting
     def _apply_rate_limit(self):
-        """Aplica rate limiting entre requisições"""
-        with self._request_lock:
-            current_time = time.time()
-            time_since_last = current_time - self._last_request_time
-            
-            if time_since_last < self._min_request_interval:
-                sleep_time = self._min_request_interval - time_since_last
-                time.sleep(sleep_time)
-            
-            self._last_request_time = time.time()
+        """Reserva uma ficha no token bucket e espera a vez, sem segurar nenhum lock"""
+        self._rate_limiter.acquire()
+        self._last_request_time = time.time()
+
+    # Step 1.1.6.1: troca o intervalo mínimo e a taxa do token bucket juntos
+    # Explicação: a taxa fica no estado compartilhado do balde, então vale para todos os workers
+    def _set_min_request_interval(self, interval):
+        self._min_request_interval = interval
+        self._rate_limiter.set_rate(1.0 / interval)
 
     # Step 1.1.7: Método para tratamento de erro 429 com retry automático
     def _handle_api_call_with_retry(self, api_call_func, *args, **kwargs):
@@ -83,10 +116,12 @@ class GeminiService:
         base_delay = 5  # segundos
         
         for attempt in range(max_retries):
+            # Aplica rate limiting antes de cada tentativa
+            # Explicação: fora do try - o 429 do max_wait do balde falha na hora, sem o
+            # backoff abaixo (que só vale para o 429 devolvido pela API)
+            self._apply_rate_limit()
+
             try:
-                # Aplica rate limiting antes de cada tentativa
-                self._apply_rate_limit()
-                
                 # Executa a chamada à API
                 result = api_call_func(*args, **kwargs)
                 
@@ -103,7 +138,7 @@ class GeminiService:
                     
                     # Se muitos erros consecutivos, aumenta o delay
                     if self._consecutive_errors >= self._max_consecutive_errors:
-                        self._min_request_interval = 10.0  # Aumenta intervalo mínimo
+                        self._set_min_request_interval(10.0)  # Aumenta intervalo mínimo
                     
                     if attempt < max_retries - 1:
                         # Exponential backoff com jitter
@@ -124,10 +159,44 @@ class GeminiService:
         
         raise Exception("Falha inesperada no retry mechanism")
 
+    # Step 1.1.8: extrai o uso de tokens da resposta (usage_metadata)
+    @staticmethod
+    def get_usage(response):
+        """Retorna {'prompt_tokens', 'response_tokens'} ou None se a API não informou"""
+        usage = getattr(response, "usage_metadata", None)
+        if not usage or not getattr(usage, "prompt_token_count", None):
+            return None
+        return {
+            "prompt_tokens": usage.prompt_token_count,
+            "response_tokens": getattr(usage, "candidates_token_count", None) or 0,
+        }
+
+    # Step 1.1.9: chave do cache - modelo, configurações, histórico e prompt normalizados
+    def _response_cache_key(self, message, conversation_history, config, safety):
+        def normalizar(texto):
+            # Explicação: "O que é  Python?" e "o que é python?" caem na mesma chave
+            return " ".join(unicodedata.normalize("NFC", str(texto)).split()).casefold()
+
+        dados = {
+            "model": self.backend.model_name,
+            "generation_config": config,
+            "safety_settings": safety,
+            "history": [
+                {"role": h["role"], "parts": [normalizar(p) for p in h["parts"]]}
+                for h in conversation_history or []
+            ],
+            "message": normalizar(message),
+        }
+        texto = json.dumps(dados, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
     # Step 1.2: cria o método para enviar mensagem
+    # Explicação: com return_usage=True retorna (texto, sucesso, uso_de_tokens). Com
+    # `on_chunk` a resposta vem em streaming do backend e cada pedaço é repassado à
+    # função assim que chega, mas o retorno é o mesmo de uma chamada normal (texto completo)
     def send_message(self, message, conversation_history=None, 
                    generation_config=None, safety_settings=None,
-                   stream=False):
+                   stream=False, return_usage=False, on_chunk=None):
         
         # Step 1.2.1: combina configurações padrão com personalizadas
         final_config = self.default_generation_config.copy()
@@ -138,57 +207,59 @@ class GeminiService:
         if safety_settings:
             final_safety = safety_settings
 
-        # Step 1.2.3: envia mensagem para o Gemini e retorna resposta
         try:
-            generation_config_obj = genai.types.GenerationConfig(**final_config)
-            
+            # Step 1.2.2: consulta o cache antes do rate limiter (só respostas completas e únicas)
+            cache_key = None
+            if self._response_cache is not None and not stream and final_config.get("candidate_count", 1) == 1:
+                cache_key = self._response_cache_key(message, conversation_history, final_config, final_safety)
+                cached = self._response_cache.get(cache_key)
+                if cached is not None:
+                    # Explicação: o acerto não chamou a API; `cached` avisa o complete_turn para
+                    # não registrar os tokens como uma chamada cobrada
+                    usage = {**(cached["usage"] or {}), "cached": True}
+                    if on_chunk is not None:
+                        on_chunk(cached["text"])
+                    return (cached["text"], True, usage) if return_usage else (cached["text"], True)
+
+            # Step 1.2.3: envia mensagem para o Gemini e retorna resposta
             # Define a função de chamada à API
             def api_call():
-                if conversation_history:
-                    # Step 1.2.3.1: se a conversa tem histórico, usa contexto da conversa
-                    chat = self.model.start_chat(history=conversation_history)
-                    if stream:
-                        # Explicação: modo streaming para resposta em tempo real
-                        response = chat.send_message(
-                            message, 
-                            generation_config=generation_config_obj,
-                            safety_settings=final_safety,
-                            stream=True
-                        )
-                        return response, True
-                    else:
-                        response = chat.send_message(
-                            message, 
-                            generation_config=generation_config_obj,
-                            safety_settings=final_safety
-                        )
-                else:
-                    # Step 1.2.3.2: no caso de nova conversa
-                    if stream:
-                        response = self.model.generate_content(
-                            message, 
-                            generation_config=generation_config_obj,
-                            safety_settings=final_safety,
-                            stream=True
-                        )
-                        return response, True
-                    else:
-                        response = self.model.generate_content(
-                            message, 
-                            generation_config=generation_config_obj,
-                            safety_settings=final_safety
-                        )
-                
-                return response.text, True
+                # Explicação: com histórico o backend usa o contexto da conversa
+                response = self.backend.generate(
+                    message,
+                    history=conversation_history,
+                    generation_config=final_config,
+                    safety_settings=final_safety,
+                    stream=stream or on_chunk is not None
+                )
+                if stream or on_chunk is not None:
+                    # Explicação: modo streaming para resposta em tempo real
+                    return response, None
+                return response.text, self.get_usage(response)
 
             # Executa com tratamento de erro 429
-            result, success = self._handle_api_call_with_retry(api_call)
-            return result, success
+            # Explicação: no streaming o uso só chega no último pedaço (get_usage no chunk final)
+            result, usage = self._handle_api_call_with_retry(api_call)
+
+            # Step 1.2.4: repassa os pedaços e junta o texto completo
+            # Explicação: o retry só cobre o início do stream; um erro no meio não repete a
+            # chamada (os pedaços já enviados seriam repetidos)
+            if on_chunk is not None:
+                partes = []
+                for chunk in result:
+                    if chunk.text:
+                        partes.append(chunk.text)
+                        on_chunk(chunk.text)
+                    usage = self.get_usage(chunk) or usage
+                result = "".join(partes)
+            if cache_key is not None:
+                self._response_cache.set(cache_key, {"text": result, "usage": usage})
+            return (result, True, usage) if return_usage else (result, True)
 
         except Exception as e:
             error_msg = f"Erro ao comunicar com Gemini: {str(e)}"
             current_app.logger.error(error_msg)
-            return error_msg, False
+            return (error_msg, False, None) if return_usage else (error_msg, False)
 
     # Step 1.3: método para gerar múltiplas versões da resposta
     def generate_multiple_candidates(self, message, num_candidates=3, 
@@ -199,25 +270,14 @@ class GeminiService:
             config["candidate_count"] = num_candidates
             config["temperature"] = 0.8  # Explicação: aumenta criatividade para variedade
             
-            generation_config_obj = genai.types.GenerationConfig(**config)
-            
             def api_call():
-                if conversation_history:
-                    chat = self.model.start_chat(history=conversation_history)
-                    response = chat.send_message(
-                        message,
-                        generation_config=generation_config_obj,
-                        safety_settings=self.default_safety_settings
-                    )
-                else:
-                    response = self.model.generate_content(
-                        message,
-                        generation_config=generation_config_obj,
-                        safety_settings=self.default_safety_settings
-                    )
-                
                 # Step 1.3.2: retorna todas as candidatas geradas
-                candidates = [candidate.text for candidate in response.candidates]
+                candidates = self.backend.generate_candidates(
+                    message,
+                    history=conversation_history,
+                    generation_config=config,
+                    safety_settings=self.default_safety_settings
+                )
                 return candidates, True
             
             # Executa com tratamento de erro 429
@@ -232,13 +292,7 @@ class GeminiService:
     def count_tokens(self, text, conversation_history=None):
         try:
             def api_call():
-                if conversation_history:
-                    chat = self.model.start_chat(history=conversation_history)
-                    count_data = chat.count_tokens(text)
-                else:
-                    count_data = self.model.count_tokens(text)
-                    
-                return count_data.total_tokens, True
+                return self.backend.count_tokens(text, history=conversation_history), True
             
             # Executa com tratamento de erro 429
             return self._handle_api_call_with_retry(api_call)
@@ -253,11 +307,11 @@ class GeminiService:
         # Step 1.5.1: analisa o conteúdo do texto para segurança
         try:
             def api_call():
-                response = self.model.generate_content(
+                response = self.backend.generate(
                     f"Analise este conteúdo para segurança e appropriateness: {text}"
                 )
                 
-                token_count = self.model.count_tokens(text).total_tokens
+                token_count = self.backend.count_tokens(text)
                 
                 analysis_result = {
                     "text_length": len(text),
@@ -288,7 +342,8 @@ class GeminiService:
                 "status": "online" if success else "offline",
                 "consecutive_errors": self._consecutive_errors,
                 "min_request_interval": self._min_request_interval,
-                "last_request_time": self._last_request_time
+                "last_request_time": self._last_request_time,
+                "rate_limit_budget": self._rate_limiter.budget()
             }
             
             return status_info, success
@@ -300,13 +355,19 @@ class GeminiService:
                 "consecutive_errors": self._consecutive_errors
             }, False
 
+    # Step 1.13.1: contadores do cache de respostas
+    def get_cache_stats(self):
+        if self._response_cache is None:
+            return {"enabled": False}
+        return {"enabled": True, "entries": len(self._response_cache.memory), **self._response_cache.stats()}
+
     # Step 1.14: Método para ajustar rate limiting dinamicamente
     def adjust_rate_limits(self, requests_per_minute=30):
         """Ajusta os limites de rate limiting dinamicamente"""
         if requests_per_minute <= 0:
             raise ValueError("requests_per_minute deve ser maior que 0")
         
-        self._min_request_interval = 60.0 / requests_per_minute
+        self._set_min_request_interval(60.0 / requests_per_minute)
         current_app.logger.info(f" Rate limiting ajustado para {requests_per_minute} req/min")
         
         return {
@@ -318,7 +379,9 @@ class GeminiService:
     def reset_error_counters(self):
         """Reseta os contadores de erro consecutivos"""
         self._consecutive_errors = 0
-        self._min_request_interval = 2.0  # Volta ao valor padrão
+        # Explicação: volta ao GEMINI_RATE_LIMIT_RPM configurado, em todos os workers
+        self._min_request_interval = self._default_min_request_interval
+        self._rate_limiter.reset_rate()
         current_app.logger.info(" Contadores de erro resetados")
         return True
 
@@ -374,6 +437,8 @@ class GeminiService:
     def list_available_models():
         # Step 1.9.1: lista todos os modelos disponíveis na API
         try:
+            import google.generativeai as genai
+
             models = genai.list_models()
             model_list = []
             
@@ -408,8 +473,10 @@ class GeminiService:
             "rate_limiting": {
                 "min_request_interval": self._min_request_interval,
                 "consecutive_errors": self._consecutive_errors,
-                "max_consecutive_errors": self._max_consecutive_errors
-            }
+                "max_consecutive_errors": self._max_consecutive_errors,
+                "budget": self._rate_limiter.budget()
+            },
+            "response_cache": self.get_cache_stats()
         }
 
     # Step 1.12: método para resetar configurações
@@ -0,0 +1,192 @@
+# Parte 18: cache incremental do histórico de cada conversa
+#
+# Explicação: em vez de buscar a conversa inteira a cada envio, cada processo
+# guarda, por conversa, o final do histórico já pronto para o Gemini e o ID
+# da última mensagem vista. No próximo turno só as mensagens com ID maior
+# saem do banco.
+#
+# Apagar (a conversa ou uma mensagem) só limpa o cache do processo que apagou,
+# então cada build confere a entrada com o banco em uma consulta pela chave
+# primária: o created_at da conversa (o SQLite reutiliza o ID de uma conversa
+# apagada) e o message_count, que tem de ser o de antes mais as mensagens com
+# ID maior que o último visto. Mensagem apagada em outro processo = contagem
+# menor = o final da conversa é lido de novo.
+
+import os
+from collections import namedtuple
+
+from sqlalchemy import func, select
+
+from app import db
+from app.models import Conversation, Message
+from app.services.cache import LRUCache
+from app.services.context_window import estimate_tokens, fit_history, message_tokens
+
+# Step 1: entrada leve do cache (compatível com fit_history, sem objeto do ORM)
+CachedMessage = namedtuple("CachedMessage", "id role content content_tokens timestamp")
+
+# Step 1.1: estado de uma conversa: última mensagem vista + entradas em ordem cronológica
+# Explicação: created_at, max_id e message_count conferem a entrada com o banco (Step 2.2)
+_Estado = namedtuple("_Estado", "created_at max_id message_count last_message_id entries")
+
+
+# Step 2: cria a classe do cache
+class HistoryCache:
+
+    def __init__(self, max_conversations=1000, ttl=3600):
+        self._cache = LRUCache(max_entries=max_conversations, ttl=ttl)
+
+    # Step 2.1: histórico pronto para o Gemini, dentro do orçamento de tokens
+    def build(self, conversation_id, before_message_id=None, budget_tokens=8000, keep_last=2):
+        estado = self._cache.get(conversation_id)
+        conferida = self._check(conversation_id, estado.max_id if estado else 0)
+        if conferida is None:  # Explicação: conversa apagada
+            self._cache.delete(conversation_id)
+            return []
+
+        if estado is not None and not self._valid(estado, conferida):
+            estado = None
+            conferida = self._check(conversation_id, 0)  # Explicação: recomeça a contagem do zero
+        if estado is None:
+            estado = self._load_tail(conversation_id, before_message_id, budget_tokens)
+
+        estado = self._append_new(estado, conversation_id, before_message_id, budget_tokens)
+        estado = estado._replace(
+            created_at=conferida.created_at,
+            max_id=conferida.max_id or estado.max_id,
+            message_count=conferida.message_count,
+        )
+        self._cache.set(conversation_id, estado)
+
+        # Explicação: outra requisição pode ter avançado o cache além deste turno
+        entradas = [
+            e for e in estado.entries
+            if before_message_id is None or e.id < before_message_id
+        ]
+        return fit_history(reversed(entradas), budget_tokens=budget_tokens, keep_last=keep_last)
+
+    # Step 2.2: confere o cache com o banco em uma consulta (conversa + mensagens com ID maior)
+    # Explicação: uma instrução só, para a contagem e as mensagens novas virem do mesmo snapshot
+    @staticmethod
+    def _check(conversation_id, max_id):
+        novas = (Message.conversation_id == conversation_id, Message.id > max_id)
+        return db.session.execute(
+            select(
+                Conversation.created_at, Conversation.message_count,
+                select(func.count(Message.id)).where(*novas).scalar_subquery().label("new_messages"),
+                select(func.max(Message.id)).where(*novas).scalar_subquery().label("max_id"),
+            ).where(Conversation.id == conversation_id)
+        ).first()
+
+    @staticmethod
+    def _valid(estado, conferida):
+        return (
+            estado.created_at == conferida.created_at
+            and estado.message_count + conferida.new_messages == conferida.message_count
+        )
+
+    # Step 2.3: invalida no próprio processo quando a conversa (ou mensagens dela) é apagada
+    def invalidate(self, conversation_id):
+        self._cache.delete(conversation_id)
+
+    def invalidate_many(self, conversation_ids):
+        for conversation_id in conversation_ids:
+            self._cache.delete(conversation_id)
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        return {"conversations": len(self._cache), **self._cache.stats.as_dict()}
+
+    # Step 3: primeira carga - lê só o final da conversa, do mais novo para o mais antigo
+    def _load_tail(self, conversation_id, before_message_id, budget_tokens):
+        query = self._columns().filter(
+            Message.conversation_id == conversation_id,
+            Message.status != Message.STATUS_FAILED,
+        )
+        if before_message_id is not None:
+            query = query.filter(Message.id < before_message_id)
+
+        entradas = []
+        usados = 0
+        ultimo_id = pendente = None
+        # Explicação: a ordem é a da conversa (timestamp, com o ID para desempatar): mensagens
+        # que voltam do arquivo frio (ensure_hot) ganham IDs novos, maiores que os das recentes
+        for linha in query.order_by(Message.timestamp.desc(), Message.id.desc()).yield_per(50):
+            ultimo_id = max(ultimo_id or 0, linha.id)
+            if linha.status == Message.STATUS_PENDING:
+                pendente = min(pendente or linha.id, linha.id)  # Explicação: como no Step 4, o turno em andamento é lido de novo depois
+                continue
+            entrada = self._entry(linha)
+            entradas.append(entrada)
+            usados += message_tokens(entrada)
+            if usados > budget_tokens:
+                break  # Explicação: a mensagem da fronteira fica (pode ser resumida)
+
+        entradas.reverse()
+        ultimo_id = pendente - 1 if pendente else (ultimo_id or 0)
+        return _Estado(None, 0, 0, ultimo_id, tuple(entradas))
+
+    # Step 4: acrescenta só as mensagens novas desde a última vista
+    def _append_new(self, estado, conversation_id, before_message_id, budget_tokens):
+        query = self._columns().filter(
+            Message.conversation_id == conversation_id,
+            Message.id > estado.last_message_id,
+        )
+        if before_message_id is not None:
+            query = query.filter(Message.id < before_message_id)
+
+        entradas = list(estado.entries)
+        vistos = {e.id for e in entradas}
+        lidos = []
+        pendente = None
+        for linha in query.order_by(Message.timestamp.asc(), Message.id.asc()):
+            if linha.status == Message.STATUS_PENDING:
+                # Explicação: turno em andamento - o ID para de avançar aqui para que
+                # ele seja lido de novo quando terminar, mas o que vem depois já entra
+                pendente = min(pendente or linha.id, linha.id)
+                continue
+            if linha.status == Message.STATUS_COMPLETE and linha.id not in vistos:
+                entradas.append(self._entry(linha))
+            lidos.append(linha.id)  # Explicação: 'failed' é pulado de vez
+        ultimo_id = max(
+            [estado.last_message_id] + [i for i in lidos if pendente is None or i < pendente]
+        )
+
+        if len(entradas) == len(estado.entries) and ultimo_id == estado.last_message_id:
+            return estado
+        entradas.sort(key=lambda e: (e.timestamp, e.id))
+        return estado._replace(last_message_id=ultimo_id, entries=self._trim(entradas, budget_tokens))
+
+    # Step 5: descarta do início o que nunca caberia no orçamento (memória limitada)
+    @staticmethod
+    def _trim(entradas, budget_tokens):
+        usados = 0
+        inicio = len(entradas)
+        while inicio > 0 and usados <= budget_tokens:
+            inicio -= 1
+            usados += message_tokens(entradas[inicio])
+        return tuple(entradas[inicio:])
+
+    @staticmethod
+    def _columns():
+        # Explicação: só as colunas necessárias, sem montar objetos do ORM
+        return db.session.query(
+            Message.id, Message.role, Message.content, Message.status,
+            Message.prompt_tokens, Message.response_tokens, Message.timestamp,
+        )
+
+    @staticmethod
+    def _entry(linha):
+        tokens = linha.prompt_tokens if linha.role == 'user' else linha.response_tokens
+        if tokens is None:
+            tokens = estimate_tokens(linha.content)
+        return CachedMessage(linha.id, linha.role, linha.content, tokens, linha.timestamp)
+
+
+# Step 6: cria a instância global do cache
+history_cache = HistoryCache(
+    max_conversations=int(os.getenv("HISTORY_CACHE_MAX_CONVERSATIONS", "1000")),
+    ttl=int(os.getenv("HISTORY_CACHE_TTL", "3600")),
+)
@@ -0,0 +1,251 @@
+# Parte 14: fila de tarefas em segundo plano guardada no banco
+#
+# Explicação: as tarefas ficam na tabela `jobs`, então qualquer processo
+# (worker do gunicorn ou `flask jobs-worker`) pode executá-las. Cada processo
+# web sobe algumas threads que pegam tarefas da fila, assim a requisição
+# responde na hora e não fica presa esperando o Gemini.
+
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+
+from app import db
+from app.models import Job
+
+
+# Step 1: cria a classe da fila
+class JobQueue:
+
+    # Step 1.1: handlers registrados por tipo de tarefa
+    def __init__(self, app=None):
+        self.app = None
+        self._handlers = {}
+        self._threads = []
+        self._start_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._current = threading.local()  # Explicação: tarefa que a thread está executando
+        if app is not None:
+            self.init_app(app)
+
+    # Step 1.2: liga a fila ao app (mesmo padrão do db.init_app)
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault("JOB_QUEUE_WORKERS", 2)
+        app.config.setdefault("JOB_QUEUE_POLL_INTERVAL", 1.0)
+        app.config.setdefault("JOB_QUEUE_STALE_AFTER", 300)
+        app.config.setdefault("JOB_QUEUE_MAX_ATTEMPTS", 3)
+        app.extensions["job_queue"] = self
+        app.cli.add_command(jobs_worker_command)
+
+        # Explicação: as threads sobem na primeira requisição do processo (depois do fork do
+        # gunicorn, e os comandos `flask ...` não sobem threads), não no primeiro enqueue:
+        # tarefas que ficaram na fila depois de um restart voltam a andar sem esperar uma
+        # mensagem nova (o health check já é a primeira requisição)
+        if app.config["JOB_QUEUE_WORKERS"] > 0:
+            app.before_request(self._start_on_request)
+
+    def _start_on_request(self):
+        if not self._threads:
+            self.start()
+
+    # Step 1.3: registra a função que executa um tipo de tarefa
+    def handler(self, kind, on_failure=None):
+        """Decorator: @job_queue.handler('reply') def executar(payload): ..."""
+        def decorator(func):
+            self._handlers[kind] = (func, on_failure)
+            return func
+        return decorator
+
+    # Step 1.4: coloca uma tarefa na fila (faz commit junto com o que já estiver na sessão)
+    def enqueue(self, kind, payload=None, user_id=None):
+        if kind not in self._handlers:
+            raise ValueError(f"Tipo de tarefa desconhecido: {kind}")
+
+        job = Job(kind=kind, payload=json.dumps(payload or {}), user_id=user_id,
+                  status=Job.STATUS_QUEUED, attempts=0)
+        db.session.add(job)
+        db.session.commit()
+
+        # Step 1.4.1: sem threads configuradas (ex.: testes), executa na hora
+        if current_app.config["JOB_QUEUE_WORKERS"] <= 0:
+            if self._claim(job.id):
+                self._execute(job.id)
+        else:
+            self.start()
+            self._wakeup.set()
+
+        return job
+
+    # Step 1.5: sobe as threads de trabalho deste processo (só uma vez)
+    # Explicação: é chamado na primeira requisição e no enqueue, depois do fork do gunicorn
+    def start(self, workers=None):
+        with self._start_lock:
+            if self._threads:
+                return
+            total = workers or self.app.config["JOB_QUEUE_WORKERS"]
+            self._stopping.clear()
+            for numero in range(total):
+                thread = threading.Thread(
+                    target=self._worker_loop, name=f"job-worker-{numero}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    # Step 1.6: pede para as threads pararem (usado pelo comando CLI)
+    def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    # Step 1.7: laço de cada thread: pega a próxima tarefa ou espera
+    def _worker_loop(self):
+        intervalo = self.app.config["JOB_QUEUE_POLL_INTERVAL"]
+        while not self._stopping.is_set():
+            try:
+                with self.app.app_context():
+                    job_id = self._claim_next()
+                    if job_id is not None:
+                        self._execute(job_id)
+                        continue
+            except Exception as e:
+                self.app.logger.error(f" Erro na fila de tarefas: {e}")
+
+            # Explicação: acorda no enqueue deste processo ou a cada intervalo
+            # para pegar tarefas criadas por outros processos
+            self._wakeup.wait(intervalo)
+            self._wakeup.clear()
+
+    # Step 1.8: reserva a próxima tarefa da fila
+    def _claim_next(self):
+        self.requeue_stale()
+        while True:
+            job_id = (
+                db.session.query(Job.id)
+                .filter(Job.status == Job.STATUS_QUEUED)
+                .order_by(Job.id.asc())
+                .limit(1)
+                .scalar()
+            )
+            db.session.commit()
+            if job_id is None:
+                return None
+            if self._claim(job_id):
+                return job_id
+            # Explicação: outro worker pegou primeiro, tenta a próxima
+
+    # Step 1.9: UPDATE condicional - só um worker consegue mudar queued -> running
+    def _claim(self, job_id):
+        claimed = (
+            db.session.query(Job)
+            .filter(Job.id == job_id, Job.status == Job.STATUS_QUEUED)
+            .update(
+                {
+                    Job.status: Job.STATUS_RUNNING,
+                    Job.started_at: datetime.utcnow(),
+                    Job.attempts: Job.attempts + 1,
+                    Job.output: None,  # Explicação: a nova tentativa gera o texto do zero
+                },
+                synchronize_session=False,
+            )
+        )
+        db.session.commit()
+        return claimed == 1
+
+    # Step 1.10: executa o handler e grava o resultado
+    def _execute(self, job_id):
+        job = db.session.get(Job, job_id)
+        func, on_failure = self._handlers[job.kind]
+        payload = json.loads(job.payload)
+
+        self._current.job_id = job_id
+        try:
+            result = func(payload)
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f" Tarefa {job_id} ({job.kind}) falhou: {e}")
+            self._finish(job_id, Job.STATUS_FAILED, error=str(e))
+            if on_failure:
+                on_failure(payload, str(e))
+            return
+        finally:
+            self._current.job_id = None
+
+        self._finish(job_id, Job.STATUS_DONE, result=result)
+
+    # Step 1.10.1: grava o texto parcial da tarefa em execução nesta thread
+    # Explicação: chamado pelo handler durante o streaming; a rota SSE lê a coluna e
+    # repassa o que ainda não enviou. Sem tarefa em execução (chamada direta), não faz nada
+    def write_output(self, text):
+        job_id = getattr(self._current, "job_id", None)
+        if job_id is None:
+            return
+        db.session.query(Job).filter_by(id=job_id).update({Job.output: text}, synchronize_session=False)
+        db.session.commit()
+
+    # Step 1.11: marca a tarefa como concluída ou falha
+    def _finish(self, job_id, status, result=None, error=None):
+        db.session.query(Job).filter_by(id=job_id).update(
+            {
+                Job.status: status,
+                Job.result: json.dumps(result) if result is not None else None,
+                Job.error: error,
+                Job.finished_at: datetime.utcnow(),
+            },
+            synchronize_session=False,
+        )
+        db.session.commit()
+
+    # Step 1.12: devolve para a fila tarefas presas em 'running' (processo morreu no meio)
+    # Explicação: o mesmo UPDATE condicional do _claim, então dois workers nunca
+    # devolvem (ou abandonam) a mesma tarefa duas vezes
+    def requeue_stale(self):
+        limite = datetime.utcnow() - timedelta(seconds=self.app.config["JOB_QUEUE_STALE_AFTER"])
+        max_tentativas = self.app.config["JOB_QUEUE_MAX_ATTEMPTS"]
+        presa = (Job.status == Job.STATUS_RUNNING, Job.started_at < limite)
+
+        db.session.query(Job).filter(*presa, Job.attempts < max_tentativas).update(
+            {Job.status: Job.STATUS_QUEUED}, synchronize_session=False,
+        )
+        esgotadas = (
+            db.session.query(Job.id, Job.kind, Job.payload)
+            .filter(*presa, Job.attempts >= max_tentativas)
+            .all()
+        )
+        db.session.commit()
+
+        # Step 1.12.1: só quem conseguiu marcar a tarefa como falha chama o on_failure
+        erro = "Tarefa abandonada após várias tentativas"
+        for job_id, kind, payload in esgotadas:
+            abandonada = db.session.query(Job).filter(Job.id == job_id, *presa).update(
+                {Job.status: Job.STATUS_FAILED, Job.error: erro, Job.finished_at: datetime.utcnow()},
+                synchronize_session=False,
+            )
+            db.session.commit()
+            _, on_failure = self._handlers.get(kind, (None, None))
+            if abandonada and on_failure:
+                on_failure(json.loads(payload), erro)
+
+
+# Step 2: cria a instância global da fila
+job_queue = JobQueue()
+
+
+# Step 3: comando `flask jobs-worker` para rodar workers dedicados, fora do gunicorn
+@click.command("jobs-worker")
+@click.option("--threads", default=2, show_default=True, help="Número de threads de trabalho")
+def jobs_worker_command(threads):
+    """Executa as tarefas da fila até receber Ctrl+C."""
+    job_queue.start(workers=threads)
+    click.echo(f" Fila de tarefas rodando com {threads} threads (Ctrl+C para sair)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        job_queue.stop()
@@ -0,0 +1,197 @@
+# Parte 19: backends de modelo de linguagem usados pelo GeminiService
+#
+# Explicação: o GeminiService cuida de rate limiting, retry e cache; quem
+# realmente gera o texto é um backend. Assim dá para trocar o Gemini por um
+# backend falso (determinístico, offline) em testes, benchmarks e testes de carga.
+#   LLM_BACKEND=gemini  -> API do Google (precisa de GEMINI_API_KEY)
+#   LLM_BACKEND=fake    -> respostas simuladas, sem rede
+
+import hashlib
+import os
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from types import SimpleNamespace
+
+from app.services.context_window import estimate_tokens
+
+
+# Step 1: interface comum dos backends
+# Explicação: backend sem algum dos métodos falha ao ser criado, não no meio de uma requisição
+class LLMBackend(ABC):
+
+    model_name = None
+
+    # Step 1.1: gera uma resposta; com stream=True retorna um iterável de pedaços.
+    # A resposta (e cada pedaço) tem `.text` e `.usage_metadata`
+    @abstractmethod
+    def generate(self, message, history=None, generation_config=None,
+                 safety_settings=None, stream=False):
+        raise NotImplementedError
+
+    # Step 1.2: gera várias versões da resposta
+    @abstractmethod
+    def generate_candidates(self, message, history=None, generation_config=None,
+                            safety_settings=None):
+        raise NotImplementedError
+
+    # Step 1.3: conta os tokens de um texto (com o histórico, se houver)
+    @abstractmethod
+    def count_tokens(self, text, history=None):
+        raise NotImplementedError
+
+
+# Step 2: backend real (google.generativeai)
+class GeminiBackend(LLMBackend):
+
+    def __init__(self, model_name="gemini-2.5-flash", api_key=None):
+        # Explicação: importado aqui para o backend falso não depender do pacote do Google
+        import google.generativeai as genai
+
+        # Step 2.1: pega a API key do .env
+        api_key = api_key or os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY não encontrada no .env")
+
+        self._genai = genai
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(model_name)
+        self.model_name = self.model.model_name
+
+    def _config(self, generation_config):
+        return self._genai.types.GenerationConfig(**(generation_config or {}))
+
+    def generate(self, message, history=None, generation_config=None,
+                 safety_settings=None, stream=False):
+        kwargs = {"generation_config": self._config(generation_config),
+                  "safety_settings": safety_settings}
+        if stream:
+            kwargs["stream"] = True
+
+        # Step 2.2: se a conversa tem histórico, usa contexto da conversa
+        if history:
+            chat = self.model.start_chat(history=history)
+            return chat.send_message(message, **kwargs)
+        return self.model.generate_content(message, **kwargs)
+
+    def generate_candidates(self, message, history=None, generation_config=None,
+                            safety_settings=None):
+        response = self.generate(message, history, generation_config, safety_settings)
+        return [candidate.text for candidate in response.candidates]
+
+    def count_tokens(self, text, history=None):
+        if history:
+            return self.model.start_chat(history=history).count_tokens(text).total_tokens
+        return self.model.count_tokens(text).total_tokens
+
+
+# Step 3: backend falso para testes e testes de carga, sem rede
+class FakeBackend(LLMBackend):
+
+    model_name = "models/fake"
+
+    # Step 3.1: palavras usadas para montar as respostas simuladas
+    _VOCABULARIO = (
+        "python flask banco dados conversa resposta exemplo função classe código "
+        "teste rota template usuário mensagem token modelo cache fila desempenho"
+    ).split()
+
+    def __init__(self, latency=0.2, chunk_chars=40, chunk_delay=0.02,
+                 error_429_rate=0.0, error_5xx_rate=0.0, reply_words=(20, 120), seed=0):
+        self.latency = latency
+        self.chunk_chars = chunk_chars
+        self.chunk_delay = chunk_delay
+        self.error_429_rate = error_429_rate
+        self.error_5xx_rate = error_5xx_rate
+        self.reply_words = reply_words
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self.calls = 0
+
+    # Step 3.2: cria a partir das variáveis FAKE_LLM_* do .env
+    @classmethod
+    def from_env(cls):
+        return cls(
+            latency=float(os.getenv("FAKE_LLM_LATENCY", "0.2")),
+            chunk_chars=int(os.getenv("FAKE_LLM_CHUNK_CHARS", "40")),
+            chunk_delay=float(os.getenv("FAKE_LLM_CHUNK_DELAY", "0.02")),
+            error_429_rate=float(os.getenv("FAKE_LLM_ERROR_429_RATE", "0")),
+            error_5xx_rate=float(os.getenv("FAKE_LLM_ERROR_5XX_RATE", "0")),
+            seed=int(os.getenv("FAKE_LLM_SEED", "0")),
+        )
+
+    # Step 3.3: sorteia erros injetados (429 usa o mesmo texto da API real)
+    def _maybe_fail(self):
+        with self._random_lock:
+            self.calls += 1
+            sorteio = self._random.random()
+        if sorteio < self.error_429_rate:
+            raise Exception("429 RESOURCE_EXHAUSTED: Quota exceeded (fake backend)")
+        if sorteio < self.error_429_rate + self.error_5xx_rate:
+            raise Exception("503 Service Unavailable (fake backend)")
+
+    # Step 3.4: resposta determinística - o mesmo prompt sempre gera o mesmo texto
+    def _reply(self, message, history, generation_config, variante=0):
+        semente = hashlib.sha256(f"{variante}:{message}".encode("utf-8")).digest()
+        gerador = random.Random(semente)
+        minimo, maximo = self.reply_words
+        palavras = [gerador.choice(self._VOCABULARIO) for _ in range(gerador.randint(minimo, maximo))]
+        texto = f"Resposta simulada para: {message[:80]}\n\n" + " ".join(palavras) + "."
+
+        # Explicação: respeita o max_output_tokens como o modelo real
+        limite = (generation_config or {}).get("max_output_tokens")
+        if limite:
+            texto = texto[: limite * 4]
+        return texto
+
+    @staticmethod
+    def _usage(message, history, texto):
+        prompt = estimate_tokens(message) + sum(
+            estimate_tokens(str(h["parts"][0])) for h in history or []
+        )
+        resposta = estimate_tokens(texto)
+        return SimpleNamespace(prompt_token_count=prompt, candidates_token_count=resposta,
+                               total_token_count=prompt + resposta)
+
+    def generate(self, message, history=None, generation_config=None,
+                 safety_settings=None, stream=False):
+        self._maybe_fail()
+        texto = self._reply(message, history, generation_config)
+        usage = self._usage(message, history, texto)
+        pedacos = [texto[i:i + self.chunk_chars] for i in range(0, len(texto), self.chunk_chars)]
+
+        # Step 3.5: streaming - primeiro pedaço depois da latência, os outros em intervalos
+        if stream:
+            def gerar():
+                time.sleep(self.latency)
+                for numero, pedaco in enumerate(pedacos):
+                    if numero:
+                        time.sleep(self.chunk_delay)
+                    ultimo = numero == len(pedacos) - 1
+                    yield SimpleNamespace(text=pedaco, usage_metadata=usage if ultimo else None)
+            return gerar()
+
+        time.sleep(self.latency + self.chunk_delay * max(0, len(pedacos) - 1))
+        return SimpleNamespace(text=texto, usage_metadata=usage,
+                               candidates=[SimpleNamespace(text=texto)])
+
+    def generate_candidates(self, message, history=None, generation_config=None,
+                            safety_settings=None):
+        self._maybe_fail()
+        total = (generation_config or {}).get("candidate_count", 1)
+        time.sleep(self.latency)
+        return [self._reply(message, history, generation_config, variante=i) for i in range(total)]
+
+    def count_tokens(self, text, history=None):
+        return estimate_tokens(text) + sum(estimate_tokens(str(h["parts"][0])) for h in history or [])
+
+
+# Step 4: cria o backend configurado em LLM_BACKEND
+def create_llm_backend(name=None):
+    name = (name or os.getenv("LLM_BACKEND", "gemini")).lower()
+    if name == "fake":
+        return FakeBackend.from_env()
+    if name == "gemini":
+        return GeminiBackend(model_name=os.getenv("GEMINI_MODEL", "gemini-2.5-flash"))
+    raise ValueError(f"LLM_BACKEND desconhecido: {name}")
@@ -0,0 +1,68 @@
+# Parte 21: paginação por cursor (keyset)
+#
+# Explicação: com OFFSET o banco ainda percorre todas as linhas puladas, e a
+# página "escorrega" quando chegam itens novos. Aqui a página seguinte começa
+# depois do último item visto, usando a ordem (coluna, id):
+#   WHERE (updated_at, id) < (:ultimo_updated_at, :ultimo_id)
+#   ORDER BY updated_at DESC, id DESC LIMIT :limite
+# Com os índices compostos, cada página custa o mesmo, seja a primeira ou a milésima.
+
+import base64
+import json
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+# Step 1: uma página de resultados e o cursor da próxima (None = acabou)
+Page = namedtuple("Page", "items next_cursor")
+
+
+# Step 2: erro para cursores corrompidos ou adulterados (vira 400 nas rotas)
+class InvalidCursor(ValueError):
+    pass
+
+
+# Step 3: o cursor é o (valor, id) do último item, em base64 para ir na URL
+def encode_cursor(value, item_id):
+    dados = json.dumps([value.isoformat() if value is not None else None, item_id])
+    return base64.urlsafe_b64encode(dados.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        dados = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        valor, item_id = json.loads(dados)
+        return datetime.fromisoformat(valor), int(item_id)
+    except (ValueError, TypeError):
+        raise InvalidCursor(f"Cursor inválido: {cursor!r}")
+
+
+# Step 4: aplica o cursor, a ordem e o limite; busca um item a mais para saber se há próxima página
+def keyset_page(query, order_column, id_column, cursor=None, limit=20, descending=True):
+    if cursor:
+        valor, item_id = decode_cursor(cursor)
+        chave = tuple_(order_column, id_column)
+        query = query.filter(chave < (valor, item_id) if descending else chave > (valor, item_id))
+
+    if descending:
+        query = query.order_by(order_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(order_column.asc(), id_column.asc())
+
+    itens = query.limit(limit + 1).all()
+    if len(itens) <= limit:
+        return Page(itens, None)
+
+    itens = itens[:limit]
+    ultimo = itens[-1]
+    return Page(itens, encode_cursor(getattr(ultimo, order_column.key), getattr(ultimo, id_column.key)))
+
+
+# Step 5: lê o tamanho da página da query string, dentro de um limite máximo
+def page_size(value, default, maximum=100):
+    try:
+        tamanho = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(tamanho, maximum))
@@ -0,0 +1,290 @@
+# Parte 15: rate limiting com token bucket compartilhado entre processos
+#
+# Explicação: cada chamada ao Gemini consome uma "ficha" do balde, que é
+# reabastecido a `rate` fichas por segundo até `capacity`. O estado do balde
+# fica num backend plugável:
+#   - MemoryBackend: só dentro do processo (testes/desenvolvimento)
+#   - SQLBackend: qualquer URL do SQLAlchemy. Um arquivo SQLite é compartilhado
+#     por todos os workers do nó; um Postgres compartilhado vale para todas as réplicas.
+# A ficha é reservada numa seção crítica curta e quem precisa esperar dorme
+# FORA do lock, então uma espera nunca bloqueia as outras threads. Com
+# `max_wait`, quem teria de esperar mais que isso não reserva nada e recebe
+# o erro 429 na hora (a fila de espera não cresce sem limite).
+#
+# A taxa trocada em tempo de execução (ex.: mais devagar depois de vários 429)
+# também fica no backend, então vale para todos os processos que usam o balde,
+# até alguém voltar para a taxa configurada (reset_rate).
+
+import os
+import threading
+import time
+
+from sqlalchemy import (Column, Float, MetaData, String, Table, create_engine,
+                        event, select)
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+
+
+# Step 1: cálculo do token bucket (igual para todos os backends)
+def _refill(tokens, updated_at, now, rate, capacity):
+    return min(capacity, tokens + max(0.0, now - updated_at) * rate)
+
+
+def _reserve(tokens, updated_at, now, rate, capacity, cost, max_wait=None):
+    """Retorna (fichas restantes, segundos de espera). Fichas podem ficar negativas:
+    é a fila de quem já reservou e está esperando. Se a espera passar de `max_wait`,
+    as fichas voltam sem o custo (nada foi reservado)."""
+    tokens = _refill(tokens, updated_at, now, rate, capacity)
+    restante = tokens - cost
+    wait = 0.0 if restante >= 0 else -restante / rate
+    if max_wait is not None and wait > max_wait:
+        return tokens, wait
+    return restante, wait
+
+
+# Step 2: backend em memória (um processo)
+class MemoryBackend:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._rates = {}
+
+    def reserve(self, key, rate, capacity, cost, max_wait=None):
+        with self._lock:
+            now = time.time()
+            rate = self._rates.get(key, rate)
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens, wait = _reserve(tokens, updated_at, now, rate, capacity, cost, max_wait)
+            self._buckets[key] = (tokens, now)
+        return wait
+
+    def peek(self, key, rate, capacity):
+        """Retorna (fichas, taxa em vigor)."""
+        with self._lock:
+            now = time.time()
+            rate = self._rates.get(key, rate)
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+        return _refill(tokens, updated_at, now, rate, capacity), rate
+
+    # Explicação: `rate=None` volta para a taxa configurada em cada TokenBucket
+    def set_rate(self, key, rate, default_rate, capacity):
+        with self._lock:
+            now = time.time()
+            if key in self._buckets:
+                # Explicação: o que reabasteceu até agora conta com a taxa antiga
+                tokens, updated_at = self._buckets[key]
+                antiga = self._rates.get(key, default_rate)
+                self._buckets[key] = (_refill(tokens, updated_at, now, antiga, capacity), now)
+            if rate is None:
+                self._rates.pop(key, None)
+            else:
+                self._rates[key] = rate
+
+
+# Step 3: backend em banco (SQLite no nó ou banco compartilhado entre réplicas)
+class SQLBackend:
+
+    def __init__(self, url):
+        self._url = make_url(url)
+        self._engine = None
+        self._engine_lock = threading.Lock()
+        self._metadata = MetaData()
+        self._table = Table(
+            "rate_limit_buckets", self._metadata,
+            Column("key", String(100), primary_key=True),
+            Column("tokens", Float, nullable=False),
+            Column("updated_at", Float, nullable=False),
+        )
+        # Explicação: tabela à parte (e não uma coluna nova) para o create_all
+        # funcionar nos arquivos de balde que já existem
+        self._rates = Table(
+            "rate_limit_rates", self._metadata,
+            Column("key", String(100), primary_key=True),
+            Column("rate", Float, nullable=False),
+        )
+
+    # Step 3.1: conecta só no primeiro uso (importar o serviço não toca no disco)
+    def _get_engine(self):
+        with self._engine_lock:
+            if self._engine is not None:
+                return self._engine
+
+            url = self._url
+            if url.get_backend_name() == "sqlite":
+                # Step 3.1.1: garante a pasta do arquivo (ex.: instance/)
+                if url.database and url.database != ":memory:":
+                    os.makedirs(os.path.dirname(os.path.abspath(url.database)), exist_ok=True)
+                engine = create_engine(url, connect_args={"timeout": 5})
+
+                # Step 3.1.2: BEGIN IMMEDIATE pega o lock de escrita no início da transação,
+                # assim dois processos nunca leem o mesmo saldo (receita do SQLAlchemy)
+                @event.listens_for(engine, "connect")
+                def _sem_begin_automatico(dbapi_connection, connection_record):
+                    dbapi_connection.isolation_level = None
+
+                @event.listens_for(engine, "begin")
+                def _begin_immediate(connection):
+                    connection.exec_driver_sql("BEGIN IMMEDIATE")
+            else:
+                engine = create_engine(url, pool_pre_ping=True)
+
+            self._metadata.create_all(engine)
+            self._engine = engine
+            return engine
+
+    # Step 3.2: taxa trocada em tempo de execução (ou a configurada, se ninguém trocou)
+    def _rate(self, conn, key, rate):
+        compartilhada = conn.execute(
+            select(self._rates.c.rate).where(self._rates.c.key == key)
+        ).scalar()
+        return rate if compartilhada is None else compartilhada
+
+    # Step 3.3: reserva as fichas numa transação curta (SELECT ... FOR UPDATE)
+    def reserve(self, key, rate, capacity, cost, max_wait=None):
+        for tentativa in range(2):
+            try:
+                with self._get_engine().begin() as conn:
+                    now = time.time()
+                    row = conn.execute(
+                        select(self._table.c.tokens, self._table.c.updated_at)
+                        .where(self._table.c.key == key)
+                        .with_for_update()
+                    ).first()
+                    rate = self._rate(conn, key, rate)
+
+                    if row is None:
+                        tokens, wait = _reserve(capacity, now, now, rate, capacity, cost, max_wait)
+                        conn.execute(self._table.insert().values(key=key, tokens=tokens, updated_at=now))
+                    else:
+                        tokens, wait = _reserve(row.tokens, row.updated_at, now, rate, capacity, cost, max_wait)
+                        conn.execute(
+                            self._table.update()
+                            .where(self._table.c.key == key)
+                            .values(tokens=tokens, updated_at=now)
+                        )
+                return wait
+            except IntegrityError:
+                # Explicação: outra réplica criou o balde ao mesmo tempo, tenta de novo
+                if tentativa:
+                    raise
+
+    def peek(self, key, rate, capacity):
+        """Retorna (fichas, taxa em vigor)."""
+        with self._get_engine().connect() as conn:
+            row = conn.execute(
+                select(self._table.c.tokens, self._table.c.updated_at)
+                .where(self._table.c.key == key)
+            ).first()
+            rate = self._rate(conn, key, rate)
+        if row is None:
+            return float(capacity), rate
+        return _refill(row.tokens, row.updated_at, time.time(), rate, capacity), rate
+
+    # Step 3.4: troca a taxa de todos os processos (`rate=None` volta para a configurada)
+    def set_rate(self, key, rate, default_rate, capacity):
+        with self._get_engine().begin() as conn:
+            now = time.time()
+            row = conn.execute(
+                select(self._table.c.tokens, self._table.c.updated_at)
+                .where(self._table.c.key == key)
+                .with_for_update()
+            ).first()
+            if row is not None:
+                # Explicação: o que reabasteceu até agora conta com a taxa antiga
+                antiga = self._rate(conn, key, default_rate)
+                conn.execute(
+                    self._table.update()
+                    .where(self._table.c.key == key)
+                    .values(tokens=_refill(row.tokens, row.updated_at, now, antiga, capacity), updated_at=now)
+                )
+            conn.execute(self._rates.delete().where(self._rates.c.key == key))
+            if rate is not None:
+                conn.execute(self._rates.insert().values(key=key, rate=rate))
+
+
+# Step 4: cria o backend a partir da configuração ("memory" ou URL do SQLAlchemy)
+def create_backend(spec):
+    if not spec or spec == "memory":
+        return MemoryBackend()
+    return SQLBackend(spec)
+
+
+# Step 5: o balde usado pelo serviço
+# Explicação: `max_wait` (segundos) é a maior espera aceita; None = espera o que for preciso
+class TokenBucket:
+
+    def __init__(self, rate, capacity=1, backend=None, key="gemini", max_wait=None):
+        if rate <= 0:
+            raise ValueError("rate deve ser maior que 0")
+        self.rate = float(rate)
+        self.default_rate = self.rate
+        self.capacity = float(capacity)
+        self.key = key
+        self.max_wait = max_wait
+        self._backend = backend or MemoryBackend()
+        self._fallback = None
+
+    # Step 5.1: troca a taxa de todos os processos do balde (ex.: ao receber muitos 429)
+    def set_rate(self, rate):
+        if rate <= 0:
+            raise ValueError("rate deve ser maior que 0")
+        self.rate = float(rate)
+        self._share_rate(self.rate)
+
+    # Step 5.1.1: volta para a taxa configurada, também em todos os processos
+    def reset_rate(self):
+        self.rate = self.default_rate
+        self._share_rate(None)
+
+    def _share_rate(self, rate):
+        try:
+            self._backend.set_rate(self.key, rate, self.default_rate, self.capacity)
+        except Exception:
+            # Explicação: sem o backend, a taxa nova vale só para este processo (self.rate)
+            pass
+        if self._fallback is not None:
+            self._fallback.set_rate(self.key, rate, self.default_rate, self.capacity)
+
+    # Step 5.2: reserva uma ficha e diz quanto tempo esperar (sem dormir)
+    # Explicação: a taxa passada é a configurada; o backend usa a compartilhada, se houver.
+    # Uma espera maior que `max_wait` volta sem reservar a ficha
+    def reserve(self, cost=1):
+        try:
+            return self._backend.reserve(self.key, self.default_rate, self.capacity, cost, self.max_wait)
+        except Exception:
+            # Explicação: se o backend compartilhado falhar, limita só este processo
+            # em vez de derrubar o chat
+            if self._fallback is None:
+                self._fallback = MemoryBackend()
+                if self.rate != self.default_rate:
+                    self._fallback.set_rate(self.key, self.rate, self.default_rate, self.capacity)
+            return self._fallback.reserve(self.key, self.default_rate, self.capacity, cost, self.max_wait)
+
+    # Step 5.3: reserva e espera fora de qualquer lock
+    # Explicação: se a espera passaria de `max_wait`, falha na hora com o mesmo erro 429
+    # do retry do GeminiService, em vez de segurar a thread
+    def acquire(self, cost=1):
+        wait = self.reserve(cost)
+        if self.max_wait is not None and wait > self.max_wait:
+            raise Exception(
+                f"Erro 429: Limite de requisições excedido (espera de {wait:.1f}s "
+                f"maior que o máximo de {self.max_wait:.1f}s)"
+            )
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    # Step 5.4: saldo atual do balde (negativo = requisições esperando)
+    def budget(self):
+        try:
+            tokens, rate = self._backend.peek(self.key, self.default_rate, self.capacity)
+        except Exception:
+            tokens, rate = None, self.rate
+        return {
+            "tokens": tokens,
+            "capacity": self.capacity,
+            "rate_per_second": rate,
+            "requests_per_minute": rate * 60,
+            "backend": type(self._backend).__name__,
+        }
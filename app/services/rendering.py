@@ -0,0 +1,118 @@
+# Parte 29: HTML das mensagens, gerado uma vez quando a mensagem é salva
+#
+# Explicação: antes o template aplicava `replace('\n', '<br>')|safe` no texto
+# de todas as mensagens a cada visualização - custo repetido e, pior, o texto
+# do usuário (e do modelo) virava HTML sem nenhum filtro. Agora o Markdown
+# (com blocos de código destacados pelo Pygments) é convertido uma vez, o
+# resultado passa pelo nh3 (só tags, atributos e classes da lista abaixo
+# sobrevivem) e fica em messages.content_html. A conversa só junta os trechos
+# prontos.
+#
+# A migração só cria a coluna: o HTML das mensagens antigas é gerado por
+# `flask render-messages` (também usado depois de mudar o renderizador, com
+# --all); até lá elas são renderizadas a cada visualização.
+
+import click
+import markdown
+import nh3
+from flask.cli import with_appcontext
+from markupsafe import Markup
+from pygments.token import STANDARD_TYPES
+from sqlalchemy import select, update
+
+from app import db
+
+# Step 1: extensões do Markdown
+# Explicação: nl2br mantém as quebras de linha como antes; codehilite usa classes CSS
+# (o tema está no style.css), então o HTML salvo não depende de estilo inline
+EXTENSIONS = ["fenced_code", "codehilite", "tables", "sane_lists", "nl2br"]
+EXTENSION_CONFIGS = {"codehilite": {"css_class": "codehilite", "guess_lang": False}}
+
+# Step 2: o que pode sobreviver à limpeza
+ALLOWED_TAGS = {
+    "p", "br", "hr", "strong", "em", "b", "i", "code", "pre", "span", "div", "blockquote",
+    "ul", "ol", "li", "h1", "h2", "h3", "h4", "h5", "h6", "a",
+    "table", "thead", "tbody", "tr", "th", "td",
+}
+ALLOWED_ATTRIBUTES = {
+    "a": {"href", "title"},
+    "span": {"class"},
+    "div": {"class"},
+    "th": {"align"},
+    "td": {"align"},
+}
+URL_SCHEMES = {"http", "https", "mailto"}
+
+# Step 2.1: classes permitidas - só as do bloco de código e dos tokens do Pygments
+# Explicação: o Markdown deixa passar HTML cru, e sem essa lista o texto poderia usar
+# classes do Bootstrap (position-fixed, vw-100, modal...) para cobrir a página
+ALLOWED_CLASSES = {
+    "div": {"codehilite"},
+    "span": {classe for classe in STANDARD_TYPES.values() if classe} | {"hll"},
+}
+
+_LOTE = 500
+
+# Step 2.2: versão do HTML gerado
+# Explicação: vai na chave do cache de trechos e no ETag das páginas; aumente ao
+# mudar o Markdown/limpeza acima e rode `flask render-messages --all`
+RENDER_VERSION = 1
+
+
+# Step 3: Markdown -> HTML limpo (string)
+def render_message(content):
+    html = markdown.markdown(content or "", extensions=EXTENSIONS, extension_configs=EXTENSION_CONFIGS)
+    return nh3.clean(html, tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRIBUTES, url_schemes=URL_SCHEMES,
+                     attribute_filter=_filtrar_classes, link_rel="noopener noreferrer nofollow")
+
+
+# Explicação: o nh3 desta versão não tem allowed_classes, então o filtro tira as outras
+def _filtrar_classes(tag, atributo, valor):
+    if atributo != "class":
+        return valor
+    classes = [classe for classe in valor.split() if classe in ALLOWED_CLASSES.get(tag, ())]
+    return " ".join(classes) or None
+
+
+# Step 4: HTML para o template (usa o salvo; mensagens sem HTML ainda são renderizadas na hora)
+def message_html(message):
+    return Markup(message.content_html if message.content_html is not None else render_message(message.content))
+
+
+# Step 5: preenche content_html das mensagens antigas, em lotes (uma transação por lote)
+def backfill(all_messages=False, batch_size=_LOTE):
+    from app.models import Message
+
+    total, ultimo_id = 0, 0
+    while True:
+        consulta = select(Message.id, Message.content).where(Message.id > ultimo_id)
+        if not all_messages:
+            consulta = consulta.where(Message.content_html.is_(None))
+        lote = db.session.execute(consulta.order_by(Message.id).limit(batch_size)).all()
+        if not lote:
+            return total
+
+        db.session.execute(
+            update(Message),
+            [{"id": linha.id, "content_html": render_message(linha.content)} for linha in lote],
+        )
+        db.session.commit()
+        total += len(lote)
+        ultimo_id = lote[-1].id
+
+
+# Step 6: comando `flask render-messages`
+@click.command("render-messages")
+@click.option("--all", "all_messages", is_flag=True, help="renderiza de novo todas as mensagens")
+@click.option("--batch-size", type=int, default=_LOTE, show_default=True)
+@with_appcontext
+def render_command(all_messages, batch_size):
+    """Gera o HTML salvo das mensagens que ainda não têm."""
+    from app.services.fragment_cache import fragment_cache
+
+    total = backfill(all_messages, batch_size)
+    # Explicação: os trechos guardados têm o HTML antigo; com FRAGMENT_CACHE_DIR o
+    # clear também muda a geração, e os workers deixam de usar o que têm em memória
+    if total:
+        fragment_cache.clear()
+    click.echo(f" {total} mensagens renderizadas")
@@ -0,0 +1,129 @@
+# Parte 26: busca no histórico de conversas (SQLite FTS5)
+#
+# Explicação: `LIKE '%texto%'` em messages.content lê a tabela inteira. A
+# tabela virtual `messages_fts` é um índice invertido do conteúdo das
+# mensagens (external content: o texto continua só em `messages`) e é mantida
+# em sincronia por triggers de INSERT/UPDATE/DELETE, então qualquer caminho
+# de escrita (ORM, DELETE em massa, migrações) atualiza o índice.
+# Os resultados vêm ordenados por relevância (bm25) e com um trecho do texto
+# em que os termos encontrados ficam destacados.
+#
+# No PostgreSQL a mesma busca usa to_tsvector/websearch_to_tsquery com um
+# índice GIN, criado pela migração.
+
+import re
+from collections import namedtuple
+from datetime import datetime
+
+from markupsafe import Markup, escape
+from sqlalchemy import DDL, event, text
+
+from app import db
+from app.models import Message
+
+# Step 1: um resultado da busca e uma página de resultados
+SearchHit = namedtuple("SearchHit", "message_id conversation_id conversation_title role timestamp snippet")
+SearchPage = namedtuple("SearchPage", "items page has_next")
+
+# Explicação: marcadores que não aparecem em texto digitado; viram <mark> depois do escape
+_INICIO, _FIM = "\x02", "\x03"
+SNIPPET_TOKENS = 16
+
+# Step 2: tabela FTS5 e triggers (SQLite); o mesmo SQL está na migração
+FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+    "content, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN "
+    "INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN "
+    "INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN "
+    "INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+    "INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content); END",
+)
+PG_INDEX_DDL = "CREATE INDEX IF NOT EXISTS ix_messages_content_fts ON messages USING gin (to_tsvector('simple', content))"
+
+# Explicação: bancos criados com db.create_all() (testes, setup-dev) também ganham o índice
+for _comando in FTS_DDL:
+    event.listen(Message.__table__, "after_create", DDL(_comando).execute_if(dialect="sqlite"))
+event.listen(Message.__table__, "after_create", DDL(PG_INDEX_DDL).execute_if(dialect="postgresql"))
+
+
+# Step 3: transforma o texto digitado em uma consulta FTS5 segura
+# Explicação: cada palavra vira um termo entre aspas com prefixo ("palav"*), todas obrigatórias.
+# Aspas, parênteses, AND/OR/NEAR etc. digitados pelo usuário não viram sintaxe do FTS5
+def fts_query(texto):
+    palavras = re.findall(r"\w+", texto or "")
+    return " ".join(f'"{palavra}"*' for palavra in palavras)
+
+
+# Step 4: busca nas mensagens das conversas do usuário, mais relevantes primeiro
+# Explicação: paginação por número de página - o bm25 precisa de todos os resultados para
+# ordenar, então um cursor não economizaria trabalho aqui
+def search_messages(user_id, texto, page=1, per_page=20):
+    consulta = fts_query(texto)
+    if not consulta:
+        return SearchPage([], page, False)
+
+    if db.engine.dialect.name == "postgresql":
+        sql, parametros = _postgres_sql(), {"consulta": " ".join(re.findall(r"\w+", texto))}
+    else:
+        sql, parametros = _sqlite_sql(), {"consulta": consulta}
+
+    parametros.update(user_id=user_id, inicio=_INICIO, fim=_FIM, limite=per_page + 1,
+                      offset=(page - 1) * per_page, tokens=SNIPPET_TOKENS)
+    linhas = db.session.execute(text(sql), parametros).all()
+
+    itens = [
+        SearchHit(linha.id, linha.conversation_id, linha.title, linha.role, _datetime(linha.timestamp),
+                  highlight(linha.trecho))
+        for linha in linhas[:per_page]
+    ]
+    return SearchPage(itens, page, len(linhas) > per_page)
+
+
+# Explicação: primeiro ordena e corta a página (só rowid e bm25), depois monta o trecho
+# apenas das mensagens da página - o snippet() de todos os resultados custava ~15% da busca
+def _sqlite_sql():
+    return (
+        "WITH pagina AS ("
+        " SELECT m.id, m.conversation_id, m.role, m.timestamp, c.title, bm25(messages_fts) AS relevancia"
+        " FROM messages_fts"
+        " JOIN messages m ON m.id = messages_fts.rowid"
+        " JOIN conversations c ON c.id = m.conversation_id"
+        " WHERE messages_fts MATCH :consulta AND c.user_id = :user_id"
+        " ORDER BY relevancia, m.id DESC"
+        " LIMIT :limite OFFSET :offset)"
+        " SELECT pagina.id, pagina.conversation_id, pagina.title, pagina.role, pagina.timestamp,"
+        " snippet(messages_fts, 0, :inicio, :fim, '…', :tokens) AS trecho"
+        " FROM pagina JOIN messages_fts ON messages_fts.rowid = pagina.id"
+        " WHERE messages_fts MATCH :consulta"
+        " ORDER BY pagina.relevancia, pagina.id DESC"
+    )
+
+
+def _postgres_sql():
+    return (
+        "SELECT m.id, m.conversation_id, c.title, m.role, m.timestamp,"
+        " ts_headline('simple', m.content, q, 'StartSel=' || :inicio || ', StopSel=' || :fim"
+        " || ', MaxWords=' || :tokens || ', MinWords=5') AS trecho"
+        " FROM messages m"
+        " JOIN conversations c ON c.id = m.conversation_id,"
+        " websearch_to_tsquery('simple', :consulta) q"
+        " WHERE to_tsvector('simple', m.content) @@ q AND c.user_id = :user_id"
+        " ORDER BY ts_rank(to_tsvector('simple', m.content), q) DESC, m.id DESC"
+        " LIMIT :limite OFFSET :offset"
+    )
+
+
+# Step 5: escapa o trecho e troca os marcadores por <mark> (o resto do texto nunca vira HTML)
+def highlight(trecho):
+    seguro = str(escape(trecho or ""))
+    return Markup(seguro.replace(_INICIO, "<mark>").replace(_FIM, "</mark>"))
+
+
+def _datetime(valor):
+    # Explicação: com text() o SQLite devolve o timestamp como string
+    if isinstance(valor, str):
+        return datetime.fromisoformat(valor)
+    return valor
@@ -0,0 +1,141 @@
+# Parte 22: perfil de produção do SQLite (WAL, busy_timeout e PRAGMAs)
+#
+# Explicação: com o journal padrão (rollback), quem escreve bloqueia quem lê e
+# vários workers do gunicorn acabam em "database is locked". Cada conexão nova
+# recebe os PRAGMAs abaixo (todos configuráveis no config.py):
+#   journal_mode=WAL      leitores não bloqueiam o escritor (e vice-versa)
+#   busy_timeout          espera o lock em vez de falhar na hora
+#   synchronous=NORMAL    seguro com WAL e bem mais rápido que FULL
+#   mmap_size/cache_size  leituras direto da memória
+#   temp_store=MEMORY     ordenações e tabelas temporárias sem disco
+# Uma thread por processo faz checkpoint do WAL de tempos em tempos, para o
+# arquivo -wal não crescer sem limite.
+
+import os
+import threading
+import time
+
+from sqlalchemy import event
+
+from app import db
+
+# Step 1: valores aceitos (PRAGMA não aceita parâmetros, então tudo é validado)
+_JOURNAL_MODES = {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"}
+_SYNCHRONOUS = {"OFF", "NORMAL", "FULL", "EXTRA"}
+_TEMP_STORES = {"DEFAULT", "FILE", "MEMORY"}
+_CHECKPOINT_MODES = {"PASSIVE", "FULL", "RESTART", "TRUNCATE"}
+
+
+# Step 2: cria a classe do perfil
+class SQLiteProfile:
+
+    def __init__(self, app=None):
+        self._checkpointers = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    # Step 2.1: liga o perfil aos engines SQLite do app (mesmo padrão do db.init_app)
+    def init_app(self, app):
+        app.config.setdefault("SQLITE_PRAGMAS_ENABLED", True)
+        app.config.setdefault("SQLITE_JOURNAL_MODE", "WAL")
+        app.config.setdefault("SQLITE_BUSY_TIMEOUT_MS", 5000)
+        app.config.setdefault("SQLITE_SYNCHRONOUS", "NORMAL")
+        app.config.setdefault("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)
+        app.config.setdefault("SQLITE_CACHE_SIZE", -64000)
+        app.config.setdefault("SQLITE_TEMP_STORE", "MEMORY")
+        app.config.setdefault("SQLITE_FOREIGN_KEYS", True)
+        app.config.setdefault("SQLITE_WAL_AUTOCHECKPOINT", 1000)
+        app.config.setdefault("SQLITE_CHECKPOINT_INTERVAL", 300)
+        app.config.setdefault("SQLITE_CHECKPOINT_MODE", "PASSIVE")
+        app.extensions["sqlite_profile"] = self
+        self.pragmas(app.config)  # Explicação: valor inválido no .env falha já na inicialização
+
+        with app.app_context():
+            engines = [engine for engine in db.engines.values() if engine.dialect.name == "sqlite"]
+
+        for engine in engines:
+            self._listen(app, engine)
+
+    # Step 2.2: PRAGMAs de cada conexão nova (lidos do config na hora da conexão)
+    def _listen(self, app, engine):
+        @event.listens_for(engine, "connect")
+        def _aplicar_pragmas(dbapi_connection, connection_record):
+            if not app.config["SQLITE_PRAGMAS_ENABLED"]:
+                return
+            cursor = dbapi_connection.cursor()
+            try:
+                for pragma in self.pragmas(app.config):
+                    cursor.execute(pragma)
+            finally:
+                cursor.close()
+
+            if app.config["SQLITE_JOURNAL_MODE"].upper() == "WAL":
+                self._start_checkpointer(app, engine)
+
+    # Step 3: monta a lista de PRAGMAs a partir do config
+    @staticmethod
+    def pragmas(config):
+        journal_mode = _escolha(config["SQLITE_JOURNAL_MODE"], _JOURNAL_MODES, "SQLITE_JOURNAL_MODE")
+        synchronous = _escolha(config["SQLITE_SYNCHRONOUS"], _SYNCHRONOUS, "SQLITE_SYNCHRONOUS")
+        temp_store = _escolha(config["SQLITE_TEMP_STORE"], _TEMP_STORES, "SQLITE_TEMP_STORE")
+
+        # Explicação: busy_timeout primeiro, para o journal_mode=WAL já esperar o lock
+        return [
+            f"PRAGMA busy_timeout = {int(config['SQLITE_BUSY_TIMEOUT_MS'])}",
+            f"PRAGMA journal_mode = {journal_mode}",
+            f"PRAGMA synchronous = {synchronous}",
+            f"PRAGMA mmap_size = {int(config['SQLITE_MMAP_SIZE'])}",
+            f"PRAGMA cache_size = {int(config['SQLITE_CACHE_SIZE'])}",
+            f"PRAGMA temp_store = {temp_store}",
+            f"PRAGMA foreign_keys = {'ON' if config['SQLITE_FOREIGN_KEYS'] else 'OFF'}",
+            f"PRAGMA wal_autocheckpoint = {int(config['SQLITE_WAL_AUTOCHECKPOINT'])}",
+        ]
+
+    # Step 4: thread de checkpoint, uma por engine e por processo
+    # Explicação: iniciada na primeira conexão, ou seja, já dentro do worker do gunicorn (depois do fork)
+    def _start_checkpointer(self, app, engine):
+        intervalo = float(app.config["SQLITE_CHECKPOINT_INTERVAL"])
+        if intervalo <= 0 or engine.url.database in (None, "", ":memory:"):
+            return
+
+        chave = (os.getpid(), id(engine))
+        with self._lock:
+            if chave in self._checkpointers:
+                return
+            modo = _escolha(app.config["SQLITE_CHECKPOINT_MODE"], _CHECKPOINT_MODES, "SQLITE_CHECKPOINT_MODE")
+            thread = threading.Thread(
+                target=self._checkpoint_loop, args=(app, engine, intervalo, modo),
+                name="sqlite-checkpoint", daemon=True,
+            )
+            self._checkpointers[chave] = thread
+        thread.start()
+
+    def _checkpoint_loop(self, app, engine, intervalo, modo):
+        while True:
+            time.sleep(intervalo)
+            self.checkpoint(app, engine, modo)
+
+    # Step 4.1: executa um checkpoint; retorna (ocupado, páginas no WAL, páginas copiadas)
+    @staticmethod
+    def checkpoint(app, engine, mode="PASSIVE"):
+        modo = _escolha(mode, _CHECKPOINT_MODES, "SQLITE_CHECKPOINT_MODE")
+        try:
+            with engine.connect() as conn:
+                resultado = tuple(conn.exec_driver_sql(f"PRAGMA wal_checkpoint({modo})").first())
+        except Exception as e:
+            app.logger.warning(f"Checkpoint do WAL falhou: {e}")
+            return None
+        app.logger.debug(f"Checkpoint do WAL ({modo}): {resultado}")
+        return resultado
+
+
+def _escolha(valor, permitidos, nome):
+    valor = str(valor).upper()
+    if valor not in permitidos:
+        raise ValueError(f"{nome} inválido: {valor} (use {', '.join(sorted(permitidos))})")
+    return valor
+
+
+# Step 5: cria a instância global do perfil
+sqlite_profile = SQLiteProfile()
@@ -0,0 +1,56 @@
+# Parte 25: cache do usuário logado (user_loader do Flask-Login)
+#
+# Explicação: o Flask-Login chama o user_loader em toda requisição autenticada,
+# e cada chamada era um SELECT em `users`. Cada processo guarda uma cópia
+# desligada da sessão de cada usuário por alguns segundos (TTL) e a devolve
+# com session.merge(load=False), que liga a cópia à sessão sem ir ao banco.
+# A edição do perfil e a exclusão da conta invalidam a entrada. Em outros
+# processos a cópia antiga vive no máximo USER_CACHE_TTL segundos.
+
+import os
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+from app import db
+from app.services.cache import LRUCache
+
+
+# Step 1: cria a classe do cache
+class UserCache:
+
+    def __init__(self, max_users=1000, ttl=60):
+        self._cache = LRUCache(max_entries=max_users, ttl=ttl)
+
+    # Step 1.1: usuário ligado à sessão atual, sem SELECT (None = não está no cache)
+    def get(self, user_id):
+        copia = self._cache.get(user_id)
+        if copia is None:
+            return None
+        return db.session.merge(copia, load=False)
+
+    # Step 1.2: guarda uma cópia só com as colunas (a instância da sessão não é compartilhada)
+    # Explicação: make_transient_to_detached dá a identidade (users.id) à cópia, como se
+    # tivesse vindo do banco, e é isso que permite o merge sem carregar de novo
+    def set(self, user):
+        colunas = {atributo.key: getattr(user, atributo.key) for atributo in inspect(user).mapper.column_attrs}
+        copia = type(user)(**colunas)
+        make_transient_to_detached(copia)
+        self._cache.set(user.id, copia)
+
+    # Step 1.3: invalida quando o usuário muda (perfil) ou é apagado
+    def invalidate(self, user_id):
+        self._cache.delete(user_id)
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        return {"users": len(self._cache), **self._cache.stats.as_dict()}
+
+
+# Step 2: cria a instância global do cache
+user_cache = UserCache(
+    max_users=int(os.getenv("USER_CACHE_MAX_ENTRIES", "1000")),
+    ttl=int(os.getenv("USER_CACHE_TTL", "60")),
+)
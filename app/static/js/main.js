@@ -133,21 +133,57 @@ document.addEventListener('DOMContentLoaded', function () {
 // ===== FUNÇÕES PARA CHAT =====
 
 /**
- * Envia mensagem via AJAX (para implementação futura)
+ * Chamada à API JSON (/api/v1); erros viram exceção com a mensagem do servidor
+ */
+async function apiFetch(path, options = {}) {
+    const response = await fetch(`/api/v1${path}`, {
+        credentials: 'same-origin',
+        ...options,
+        headers: {
+            'Accept': 'application/json',
+            ...(options.body ? { 'Content-Type': 'application/json' } : {}),
+            ...(options.headers || {}),
+        },
+    });
+
+    if (response.status === 204) return null;
+    const dados = await response.json();
+    if (!response.ok) {
+        throw new Error(dados.error || `HTTP ${response.status}`);
+    }
+    return dados;
+}
+
+/**
+ * Envia mensagem pela API; retorna { mensagem, tarefa } (a resposta do Gemini é gerada na fila)
  */
 async function sendMessage(conversationId, message) {
     try {
-        const response = await fetch(`/minha-conta/conversa/${conversationId}/enviar-mensagem`, {
+        return await apiFetch(`/conversas/${conversationId}/mensagens`, {
             method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
             body: JSON.stringify({ content: message })
         });
-
-        return await response.json();
     } catch (error) {
         console.error('Erro ao enviar mensagem:', error);
         throw error;
     }
-}
\ No newline at end of file
+}
+
+/**
+ * Consulta a tarefa até terminar; retorna a tarefa com status 'done' ou 'failed'
+ */
+async function waitForTask(task, interval = 1500) {
+    while (task.status !== 'done' && task.status !== 'failed') {
+        await new Promise(resolve => setTimeout(resolve, interval));
+        task = await apiFetch(`/tarefas/${task.id}`);
+    }
+    return task;
+}
+
+/**
+ * Mensagens da conversa (mais recentes primeiro); `before` é o next_cursor da página anterior
+ */
+async function listMessages(conversationId, before = null) {
+    const query = before ? `?antes=${encodeURIComponent(before)}` : '';
+    return apiFetch(`/conversas/${conversationId}/mensagens${query}`);
+}
@@ -0,0 +1,2 @@
+# Parte 20: este arquivo faz a pasta 'benchmarks' ser um pacote Python
+# Explicação: rode com `python -m benchmarks.bench_rotas --help`
@@ -0,0 +1,136 @@
+# Parte 26: benchmark da busca no histórico (FTS5 x LIKE)
+#
+# Explicação: popula o banco com o mesmo gerador do bench_rotas (por padrão
+# 1 milhão de mensagens), acrescenta algumas mensagens com palavras raras e
+# mede a latência da busca (app/services/search.py) para termos comuns,
+# raros, com prefixo e sem resultado. Para comparação, mede também o
+# `LIKE '%termo%'` que a busca substitui.
+#
+# Uso:
+#   python -m benchmarks.bench_busca --users 10 --messages-per-user 100000 --output busca.json
+
+import argparse
+import json
+import random
+import sys
+import time
+
+from benchmarks.bench_rotas import configure_environment, percentile, seed
+
+# Step 1: buscas medidas (nome -> texto digitado)
+QUERIES = {
+    "comum": "python",
+    "duas_comuns": "banco dados",
+    "prefixo": "mensa",
+    "rara": "xilofone",
+    "rara_e_comum": "xilofone python",
+    "sem_resultado": "paralelepípedo",
+}
+RARAS = ("xilofone", "ornitorrinco", "quimera")
+
+
+# Step 2: mensagens com palavras raras (uma a cada `intervalo` mensagens do usuário)
+def add_rare_messages(app, intervalo, random_seed=0):
+    from sqlalchemy import insert
+
+    from app import db
+    from app.models import Conversation, Message
+
+    gerador = random.Random(random_seed)
+    with app.app_context():
+        lote = []
+        for conversa in Conversation.query.all():
+            for _ in range(max(1, conversa.message_count // intervalo)):
+                lote.append({
+                    "conversation_id": conversa.id, "role": "user", "status": Message.STATUS_COMPLETE,
+                    "content": f"Pergunta sobre {gerador.choice(RARAS)} e python",
+                })
+        db.session.execute(insert(Message), lote)
+        db.session.commit()
+        return len(lote)
+
+
+# Step 3: mede uma busca N vezes (cada usuário busca nas próprias conversas)
+def bench_query(app, usuarios, texto, repeticoes, like=False):
+    from sqlalchemy import text
+
+    from app import db
+    from app.services.search import search_messages
+
+    latencias, resultados = [], 0
+    with app.app_context():
+        for numero in range(repeticoes):
+            user_id = usuarios[numero % len(usuarios)]
+            inicio = time.perf_counter()
+            if like:
+                linhas = db.session.execute(text(
+                    "SELECT m.id FROM messages m JOIN conversations c ON c.id = m.conversation_id"
+                    " WHERE c.user_id = :user_id AND m.content LIKE :padrao"
+                    " ORDER BY m.id DESC LIMIT 20"
+                ), {"user_id": user_id, "padrao": f"%{texto}%"}).all()
+            else:
+                linhas = search_messages(user_id, texto).items
+            latencias.append((time.perf_counter() - inicio) * 1000)
+            resultados = max(resultados, len(linhas))
+            db.session.rollback()
+
+    return {
+        "results": resultados,
+        "p50": round(percentile(latencias, 50), 3),
+        "p95": round(percentile(latencias, 95), 3),
+        "p99": round(percentile(latencias, 99), 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Latência da busca no histórico (FTS5 x LIKE)")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--conversations-per-user", type=int, default=20)
+    parser.add_argument("--messages-per-user", type=int, default=100000)
+    parser.add_argument("--rare-every", type=int, default=1000, help="uma mensagem rara a cada N mensagens")
+    parser.add_argument("--repetitions", type=int, default=50, help="buscas medidas por consulta")
+    parser.add_argument("--like-repetitions", type=int, default=5, help="buscas medidas com LIKE")
+    parser.add_argument("--database-url", help="reaproveita um banco já populado")
+    parser.add_argument("--output", help="arquivo JSON de saída (padrão: stdout)")
+    args = parser.parse_args(argv)
+
+    database_url = configure_environment(args.database_url, fake_latency=0)
+
+    from app import create_app, db
+    from app.models import Message, User
+
+    app = create_app()
+    inicio = time.perf_counter()
+    seed(app, args.users, args.conversations_per_user, args.messages_per_user)
+    with app.app_context():
+        ja_tem_raras = Message.query.filter(Message.content.like("Pergunta sobre %")).first() is not None
+    raras = 0 if ja_tem_raras else add_rare_messages(app, args.rare_every)
+    with app.app_context():
+        usuarios = [u.id for u in User.query.filter(User.email.like("bench%@flub-bench.com"))]
+        total_mensagens = db.session.query(db.func.count(Message.id)).scalar()
+    print(f"Banco pronto em {time.perf_counter() - inicio:.1f}s ({total_mensagens} mensagens)", file=sys.stderr)
+
+    relatorio = {
+        "params": {**{k: v for k, v in vars(args).items() if k != "output"}, "database_url": database_url},
+        "messages": total_mensagens,
+        "rare_messages_added": raras,
+        "fts": {},
+        "like": {},
+    }
+    for nome, texto in QUERIES.items():
+        print(f"Buscando {nome}...", file=sys.stderr)
+        relatorio["fts"][nome] = bench_query(app, usuarios, texto, args.repetitions)
+    # Explicação: "sem_resultado" é o pior caso do LIKE (lê a tabela inteira)
+    for nome in ("comum", "rara", "sem_resultado"):
+        relatorio["like"][nome] = bench_query(app, usuarios, QUERIES[nome], args.like_repetitions, like=True)
+
+    texto = json.dumps(relatorio, indent=2, sort_keys=True, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    else:
+        print(texto)
+
+
+if __name__ == "__main__":
+    main()
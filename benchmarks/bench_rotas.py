@@ -0,0 +1,432 @@
+# Parte 20: benchmark ponta a ponta das rotas do chat
+#
+# Explicação: cria usuários, conversas e mensagens em escala configurável e
+# dispara requisições concorrentes nas rotas principais, com o backend falso
+# do modelo (sem rede, ver app/services/llm_backends.py). Para cada rota mede
+# latência (p50/p95/p99), vazão, consultas SQL por requisição e pico de RSS,
+# e grava tudo em JSON para comparar entre versões.
+#
+# Uso:
+#   python -m benchmarks.bench_rotas --users 4 --messages-per-user 10000 \
+#       --requests 200 --concurrency 8 --output bench.json
+#   python -m benchmarks.bench_rotas --output novo.json --compare bench.json
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+# Step 1: rotas medidas, na ordem em que rodam (a de escrita fica por último)
+ROUTES = ("login", "minha_conta", "historico_conversas", "ver_conversa", "enviar_mensagem")
+
+SENHA = "Bench@123"
+
+_VOCABULARIO = (
+    "python flask banco dados conversa resposta exemplo função classe código teste "
+    "rota template usuário mensagem token modelo cache fila desempenho consulta índice"
+).split()
+
+
+# Step 2: configura o ambiente antes de importar o app (o Config lê o .env na importação)
+def configure_environment(database_url=None, fake_latency=0.2, workers=0):
+    if database_url is None:
+        pasta = tempfile.mkdtemp(prefix="flub-bench-")
+        database_url = f"sqlite:///{os.path.join(pasta, 'bench.db')}"
+
+    os.environ["SQLALCHEMY_DATABASE_URI"] = database_url
+    os.environ["LLM_BACKEND"] = "fake"
+    os.environ["FAKE_LLM_LATENCY"] = str(fake_latency)
+    os.environ["JOB_QUEUE_WORKERS"] = str(workers)
+    # Explicação: o rate limiter e o cache de respostas distorceriam a medida das rotas
+    os.environ["GEMINI_RATE_LIMIT_BACKEND"] = "memory"
+    os.environ["GEMINI_RATE_LIMIT_RPM"] = "1000000"
+    os.environ["GEMINI_RATE_LIMIT_BURST"] = "1000000"
+    os.environ["GEMINI_CACHE_ENABLED"] = "false"
+    os.environ.setdefault("SECRET_KEY", "chave-do-benchmark")
+    return database_url
+
+
+# Step 3: popula o banco (usuários benchN@flub-bench.com, senha SENHA)
+def seed(app, users=2, conversations_per_user=5, messages_per_user=100, random_seed=0):
+    """Cria os dados do benchmark se ainda não existem e retorna os alvos de cada usuário"""
+    from sqlalchemy import insert
+
+    from app import bcrypt, db
+    from app.models import Conversation, Message, User
+    from app.services.chat_service import message_preview
+    from app.services.context_window import estimate_tokens
+
+    gerador = random.Random(random_seed)
+
+    def texto(palavras):
+        return " ".join(gerador.choice(_VOCABULARIO) for _ in range(palavras)) + "."
+
+    with app.app_context():
+        db.create_all()
+        # Explicação: bcrypt é lento de propósito, então o hash é calculado uma vez só
+        senha_hash = bcrypt.generate_password_hash(SENHA).decode("utf-8")
+        inicio = datetime.utcnow() - timedelta(days=30)
+
+        for numero in range(users):
+            email = f"bench{numero}@flub-bench.com"
+            if User.query.filter_by(email=email).first() is not None:
+                continue  # Explicação: banco já populado (--database-url reaproveitado)
+
+            usuario = User(username=f"bench{numero}", email=email, password_hash=senha_hash)
+            db.session.add(usuario)
+            db.session.flush()
+
+            # Step 3.1: as mensagens são divididas entre as conversas do usuário
+            total_conversas = max(1, conversations_per_user)
+            por_conversa = [messages_per_user // total_conversas] * total_conversas
+            for i in range(messages_per_user % total_conversas):
+                por_conversa[i] += 1
+
+            for indice, quantidade in enumerate(por_conversa):
+                momento = inicio + timedelta(hours=indice)
+                conversa = Conversation(
+                    title=f"Conversa {indice + 1}", user_id=usuario.id,
+                    created_at=momento, updated_at=momento,
+                )
+                db.session.add(conversa)
+                db.session.flush()
+
+                # Step 3.2: insere as mensagens em lotes, sem montar objetos do ORM
+                lote = []
+                total_tokens = 0
+                for posicao in range(quantidade):
+                    role = "user" if posicao % 2 == 0 else "assistant"
+                    conteudo = texto(gerador.randint(5, 40) if role == "user" else gerador.randint(40, 200))
+                    tokens = estimate_tokens(conteudo)
+                    total_tokens += tokens
+                    lote.append({
+                        "conversation_id": conversa.id,
+                        "role": role,
+                        "content": conteudo,
+                        "timestamp": momento + timedelta(seconds=posicao),
+                        "status": Message.STATUS_COMPLETE,
+                        "prompt_tokens": tokens if role == "user" else None,
+                        "response_tokens": tokens if role == "assistant" else None,
+                    })
+                    if len(lote) >= 5000:
+                        db.session.execute(insert(Message), lote)
+                        lote = []
+                if lote:
+                    db.session.execute(insert(Message), lote)
+
+                conversa.updated_at = momento + timedelta(seconds=quantidade)
+                conversa.total_tokens = total_tokens
+                conversa.message_count = quantidade
+                if quantidade:
+                    conversa.last_message_at = momento + timedelta(seconds=quantidade - 1)
+                    conversa.last_message_preview = message_preview(conteudo)
+            db.session.commit()
+
+        # Step 3.3: alvos de cada usuário (a maior conversa primeiro)
+        alvos = []
+        for numero in range(users):
+            usuario = User.query.filter_by(email=f"bench{numero}@flub-bench.com").first()
+            conversas = [
+                c.id for c in Conversation.query.filter_by(user_id=usuario.id)
+                .order_by(Conversation.id).all()
+            ]
+            alvos.append({"email": usuario.email, "conversas": conversas})
+        return alvos
+
+
+# Step 4: contador de consultas SQL por thread (cada requisição roda na thread do worker)
+class _SQLCounter(threading.local):
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+
+# Step 5: amostra o RSS do processo enquanto uma rota roda
+class _RSSSampler(threading.Thread):
+
+    def __init__(self, interval=0.01):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = current_rss_bytes()
+        self._parar = threading.Event()
+
+    def run(self):
+        while not self._parar.is_set():
+            self.peak = max(self.peak, current_rss_bytes())
+            self._parar.wait(self.interval)
+
+    def stop(self):
+        self._parar.set()
+        self.join()
+        self.peak = max(self.peak, current_rss_bytes())
+        return self.peak
+
+
+def current_rss_bytes():
+    # Explicação: /proc no Linux; nos outros sistemas fica o pico do processo (ru_maxrss)
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes():
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico if sys.platform == "darwin" else pico * 1024  # Explicação: KB no Linux
+
+
+# Step 6: percentil pelo método nearest-rank
+def percentile(valores, p):
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    posicao = max(0, math.ceil(p / 100 * len(ordenados)) - 1)
+    return ordenados[posicao]
+
+
+# Step 7: uma requisição de cada rota; retorna True se a resposta é a esperada
+def _request(app, rota, cliente, alvo, numero):
+    conversa_id = alvo["conversas"][numero % len(alvo["conversas"])]
+
+    if rota == "login":
+        # Explicação: cliente novo a cada login, senão a rota só redireciona
+        resposta = app.test_client().post("/auth/login", data={"email": alvo["email"], "senha": SENHA})
+        esperado = 302
+    elif rota == "minha_conta":
+        resposta = cliente.get("/minha-conta/minha-conta")
+        esperado = 200
+    elif rota == "historico_conversas":
+        resposta = cliente.get("/minha-conta/historico-conversas")
+        esperado = 200
+    elif rota == "ver_conversa":
+        resposta = cliente.get(f"/minha-conta/conversa/{conversa_id}")
+        esperado = 200
+    elif rota == "enviar_mensagem":
+        resposta = cliente.post(
+            f"/minha-conta/conversa/{conversa_id}/enviar-mensagem",
+            json={"content": f"Pergunta de benchmark {numero}: {random.choice(_VOCABULARIO)}?"},
+        )
+        esperado = 202
+    else:
+        raise ValueError(f"Rota desconhecida: {rota}")
+
+    resposta.get_data()  # Explicação: garante que o corpo inteiro foi gerado
+    resposta.close()
+    return resposta.status_code == esperado
+
+
+# Step 8: roda uma rota com N workers concorrentes até completar o total de requisições
+def bench_route(app, rota, clientes, alvos, requests=100, warmup=5):
+    from app import db
+
+    for numero in range(warmup):
+        _request(app, rota, clientes[0], alvos[0], numero)
+
+    contador_sql = _SQLCounter()
+    with app.app_context():
+        engine = db.engine
+    from sqlalchemy import event
+    event.listen(engine, "before_cursor_execute", contador_sql)
+
+    proximo = iter(range(requests))
+    proximo_lock = threading.Lock()
+    latencias, consultas = [], []
+    erros = [0]
+    resultados_lock = threading.Lock()
+
+    def worker(indice):
+        cliente, alvo = clientes[indice], alvos[indice]
+        while True:
+            with proximo_lock:
+                numero = next(proximo, None)
+            if numero is None:
+                return
+            contador_sql.count = 0
+            inicio = time.perf_counter()
+            try:
+                ok = _request(app, rota, cliente, alvo, numero)
+            except Exception:
+                ok = False
+            duracao = time.perf_counter() - inicio
+            with resultados_lock:
+                latencias.append(duracao * 1000)
+                consultas.append(contador_sql.count)
+                if not ok:
+                    erros[0] += 1
+
+    amostrador = _RSSSampler()
+    amostrador.start()
+    inicio = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(clientes))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duracao_total = time.perf_counter() - inicio
+    pico_rss = amostrador.stop()
+    event.remove(engine, "before_cursor_execute", contador_sql)
+
+    return {
+        "requests": len(latencias),
+        "errors": erros[0],
+        "concurrency": len(clientes),
+        "duration_s": round(duracao_total, 3),
+        "throughput_rps": round(len(latencias) / duracao_total, 2) if duracao_total else None,
+        "latency_ms": {
+            "p50": _arredondar(percentile(latencias, 50)),
+            "p95": _arredondar(percentile(latencias, 95)),
+            "p99": _arredondar(percentile(latencias, 99)),
+            "mean": _arredondar(sum(latencias) / len(latencias) if latencias else None),
+            "max": _arredondar(max(latencias) if latencias else None),
+        },
+        "sql_queries": {
+            "mean": _arredondar(sum(consultas) / len(consultas) if consultas else None),
+            "max": max(consultas) if consultas else None,
+            "total": sum(consultas),
+        },
+        "peak_rss_mb": round(pico_rss / 2 ** 20, 1),
+    }
+
+
+def _arredondar(valor):
+    return None if valor is None else round(valor, 3)
+
+
+# Step 9: cliente logado para cada worker (os workers se revezam entre os usuários)
+def login_clients(app, alvos, concurrency):
+    clientes, alvos_dos_workers = [], []
+    for indice in range(concurrency):
+        alvo = alvos[indice % len(alvos)]
+        cliente = app.test_client()
+        resposta = cliente.post("/auth/login", data={"email": alvo["email"], "senha": SENHA})
+        if resposta.status_code != 302:
+            raise RuntimeError(f"Login do benchmark falhou para {alvo['email']}")
+        clientes.append(cliente)
+        alvos_dos_workers.append(alvo)
+    return clientes, alvos_dos_workers
+
+
+# Step 10: roda o benchmark completo e monta o relatório
+def run(app, alvos, routes=ROUTES, requests=100, concurrency=4, warmup=5):
+    app.config["WTF_CSRF_ENABLED"] = False  # Explicação: os formulários são postados direto
+    clientes, alvos_dos_workers = login_clients(app, alvos, concurrency)
+
+    resultados = {}
+    for rota in routes:
+        resultados[rota] = bench_route(app, rota, clientes, alvos_dos_workers, requests, warmup)
+    return resultados
+
+
+def build_report(resultados, args, database_url):
+    return {
+        "meta": {
+            "created_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "database": database_url.split(":", 1)[0],
+            "process_peak_rss_mb": round(peak_rss_bytes() / 2 ** 20, 1),
+        },
+        "params": {
+            "users": args.users,
+            "conversations_per_user": args.conversations_per_user,
+            "messages_per_user": args.messages_per_user,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "warmup": args.warmup,
+            "fake_latency": args.fake_latency,
+            "workers": args.workers,
+            "seed": args.seed,
+        },
+        "routes": resultados,
+    }
+
+
+# Step 11: compara com um relatório anterior (variação percentual por métrica)
+def compare(atual, anterior):
+    linhas = [f"{'rota':<22}{'métrica':<16}{'antes':>12}{'agora':>12}{'variação':>11}"]
+    for rota, dados in atual["routes"].items():
+        antes = anterior.get("routes", {}).get(rota)
+        if not antes:
+            continue
+        metricas = [
+            ("p50_ms", antes["latency_ms"]["p50"], dados["latency_ms"]["p50"]),
+            ("p95_ms", antes["latency_ms"]["p95"], dados["latency_ms"]["p95"]),
+            ("p99_ms", antes["latency_ms"]["p99"], dados["latency_ms"]["p99"]),
+            ("throughput_rps", antes["throughput_rps"], dados["throughput_rps"]),
+            ("sql_mean", antes["sql_queries"]["mean"], dados["sql_queries"]["mean"]),
+            ("peak_rss_mb", antes["peak_rss_mb"], dados["peak_rss_mb"]),
+        ]
+        for nome, valor_antes, valor_agora in metricas:
+            if valor_antes is None or valor_agora is None:
+                continue
+            variacao = (valor_agora - valor_antes) / valor_antes * 100 if valor_antes else 0.0
+            linhas.append(f"{rota:<22}{nome:<16}{valor_antes:>12}{valor_agora:>12}{variacao:>+10.1f}%")
+    return "\n".join(linhas)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark ponta a ponta das rotas do chat")
+    parser.add_argument("--users", type=int, default=2)
+    parser.add_argument("--conversations-per-user", type=int, default=5)
+    parser.add_argument("--messages-per-user", type=int, default=1000,
+                        help="mensagens por usuário (ex.: 10 a 100000)")
+    parser.add_argument("--requests", type=int, default=100, help="requisições medidas por rota")
+    parser.add_argument("--concurrency", type=int, default=4, help="workers simultâneos")
+    parser.add_argument("--warmup", type=int, default=5, help="requisições de aquecimento por rota")
+    parser.add_argument("--routes", default=",".join(ROUTES), help="rotas separadas por vírgula")
+    parser.add_argument("--fake-latency", type=float, default=0.2,
+                        help="segundos até o primeiro pedaço do backend falso")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="JOB_QUEUE_WORKERS (0 = a resposta é gerada na própria requisição)")
+    parser.add_argument("--database-url", help="banco a usar (padrão: SQLite temporário)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="arquivo JSON de saída (padrão: stdout)")
+    parser.add_argument("--compare", help="relatório JSON anterior para comparar")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    routes = [r.strip() for r in args.routes.split(",") if r.strip()]
+    desconhecidas = set(routes) - set(ROUTES)
+    if desconhecidas:
+        raise SystemExit(f"Rotas desconhecidas: {', '.join(sorted(desconhecidas))}")
+
+    database_url = configure_environment(args.database_url, args.fake_latency, args.workers)
+
+    from app import create_app
+    app = create_app()
+
+    inicio = time.perf_counter()
+    alvos = seed(app, args.users, args.conversations_per_user, args.messages_per_user, args.seed)
+    print(f"Banco pronto em {time.perf_counter() - inicio:.1f}s ({database_url})", file=sys.stderr)
+
+    resultados = run(app, alvos, routes, args.requests, args.concurrency, args.warmup)
+    relatorio = build_report(resultados, args, database_url)
+
+    texto = json.dumps(relatorio, indent=2, sort_keys=True, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    else:
+        print(texto)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print(compare(relatorio, json.load(f)), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
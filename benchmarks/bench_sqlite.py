@@ -0,0 +1,166 @@
+# Parte 22: benchmark de concorrência do SQLite (padrão x perfil WAL)
+#
+# Explicação: simula vários workers do gunicorn (um processo cada) lendo e
+# escrevendo no mesmo arquivo SQLite ao mesmo tempo. Roda duas vezes, com o
+# SQLite padrão (journal de rollback, synchronous=FULL) e com o perfil do
+# app/services/sqlite_profile.py, e compara vazão, latência e erros
+# "database is locked".
+#
+# Uso:
+#   python -m benchmarks.bench_sqlite --processes 4 --duration 10 --output sqlite.json
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_rotas import configure_environment, percentile, seed
+
+# Step 1: os dois modos comparados
+MODES = {
+    # Explicação: o que o sqlite3 do Python faz sem configuração nenhuma
+    "padrao": {"SQLITE_PRAGMAS_ENABLED": "false"},
+    "perfil": {"SQLITE_PRAGMAS_ENABLED": "true", "SQLITE_CHECKPOINT_INTERVAL": "1"},
+}
+
+
+def _prepare(env, database_url, fake_latency=0):
+    configure_environment(database_url, fake_latency=fake_latency)
+    os.environ.update(env)
+
+
+# Step 2: popula o banco de um modo (em outro processo, com o ambiente do modo)
+def _seed_process(env, database_url, users, messages_per_user):
+    _prepare(env, database_url)
+    from app import create_app
+    seed(create_app(), users=users, conversations_per_user=5, messages_per_user=messages_per_user)
+
+
+# Step 3: um worker - leituras (páginas da conversa) e escritas (turnos completos)
+def _worker_process(env, database_url, users, start_at, duration, write_ratio, numero, resultados):
+    _prepare(env, database_url)
+    from sqlalchemy.exc import OperationalError
+
+    from app import create_app, db
+    from app.models import Conversation, Message, User
+    from app.services import chat_service
+
+    app = create_app()
+    gerador = random.Random(numero)
+    leituras, escritas, erros = [], [], 0
+
+    with app.app_context():
+        usuario = User.query.filter_by(email=f"bench{numero % users}@flub-bench.com").first()
+        conversas = [c.id for c in Conversation.query.filter_by(user_id=usuario.id)]
+        usuario_id = usuario.id
+        db.session.remove()
+
+        time.sleep(max(0, start_at - time.time()))  # Explicação: todos começam juntos
+        fim = start_at + duration
+        while time.time() < fim:
+            conversa_id = gerador.choice(conversas)
+            escrita = gerador.random() < write_ratio
+            inicio = time.perf_counter()
+            try:
+                if escrita:
+                    mensagem = chat_service.create_user_turn(conversa_id, f"pergunta {gerador.random()}")
+                    chat_service.complete_turn(mensagem.id, "resposta " * 40)
+                else:
+                    (Conversation.query.filter_by(user_id=usuario_id)
+                     .order_by(Conversation.updated_at.desc(), Conversation.id.desc()).limit(30).all())
+                    (Message.query.filter_by(conversation_id=conversa_id)
+                     .order_by(Message.timestamp.desc(), Message.id.desc()).limit(50).all())
+            except OperationalError:
+                erros += 1
+                db.session.rollback()
+            else:
+                (escritas if escrita else leituras).append((time.perf_counter() - inicio) * 1000)
+            finally:
+                db.session.remove()  # Explicação: fim da "requisição", libera a transação de leitura
+
+    resultados.put({"reads": leituras, "writes": escritas, "errors": erros})
+
+
+def _latencias(valores):
+    return {
+        "count": len(valores),
+        "p50": _arredondar(percentile(valores, 50)),
+        "p95": _arredondar(percentile(valores, 95)),
+        "p99": _arredondar(percentile(valores, 99)),
+    }
+
+
+def _arredondar(valor):
+    return None if valor is None else round(valor, 3)
+
+
+# Step 4: roda um modo completo e agrega os resultados dos workers
+def run_mode(nome, args):
+    contexto = multiprocessing.get_context("spawn")
+    pasta = tempfile.mkdtemp(prefix=f"flub-sqlite-{nome}-")
+    database_url = f"sqlite:///{os.path.join(pasta, 'bench.db')}"
+    env = MODES[nome]
+
+    semeador = contexto.Process(target=_seed_process, args=(env, database_url, args.users, args.messages_per_user))
+    semeador.start()
+    semeador.join()
+
+    resultados = contexto.Queue()
+    start_at = time.time() + 3  # Explicação: tempo para os processos importarem o app
+    workers = [
+        contexto.Process(target=_worker_process, args=(
+            env, database_url, args.users, start_at, args.duration, args.write_ratio, numero, resultados))
+        for numero in range(args.processes)
+    ]
+    for worker in workers:
+        worker.start()
+    parciais = [resultados.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+
+    leituras = [v for p in parciais for v in p["reads"]]
+    escritas = [v for p in parciais for v in p["writes"]]
+    return {
+        "operations": len(leituras) + len(escritas),
+        "throughput_ops": round((len(leituras) + len(escritas)) / args.duration, 2),
+        "errors_locked": sum(p["errors"] for p in parciais),
+        "reads_ms": _latencias(leituras),
+        "writes_ms": _latencias(escritas),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concorrência do SQLite: padrão x perfil WAL")
+    parser.add_argument("--processes", type=int, default=4, help="processos simultâneos (workers)")
+    parser.add_argument("--duration", type=float, default=10, help="segundos de carga por modo")
+    parser.add_argument("--write-ratio", type=float, default=0.2, help="fração de operações de escrita")
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--messages-per-user", type=int, default=2000)
+    parser.add_argument("--output", help="arquivo JSON de saída (padrão: stdout)")
+    args = parser.parse_args(argv)
+
+    relatorio = {"params": vars(args).copy(), "modes": {}}
+    relatorio["params"].pop("output")
+    for nome in MODES:
+        print(f"Rodando modo {nome}...", file=sys.stderr)
+        relatorio["modes"][nome] = run_mode(nome, args)
+
+    padrao, perfil = relatorio["modes"]["padrao"], relatorio["modes"]["perfil"]
+    relatorio["speedup_throughput"] = (
+        round(perfil["throughput_ops"] / padrao["throughput_ops"], 2) if padrao["throughput_ops"] else None
+    )
+
+    texto = json.dumps(relatorio, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    else:
+        print(texto)
+
+
+if __name__ == "__main__":
+    main()
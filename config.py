@@ -13,8 +13,66 @@ class Config:
     SECRET_KEY = os.getenv("SECRET_KEY")
 
     # Step 2.2: configurações de banco de dados
-    SQLALCHEMY_DATABASE_URI = os.getenv("SQLALCHEMY_DATABASE_URI")
+    SQLALCHEMY_DATABASE_URI = os.getenv("SQLALCHEMY_DATABASE_URI") or os.getenv("DATABASE_URL")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Step 2.2.1: pool de conexões (PostgreSQL) e réplica de leitura opcional
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+    DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+    DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+    DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+    DATABASE_REPLICA_STICKY_SECONDS = float(os.getenv("DATABASE_REPLICA_STICKY_SECONDS", "5"))
+
     # Step 2.3: configuração de debug
-    DEBUG = os.getenv("DEBUG")
\ No newline at end of file
+    DEBUG = os.getenv("DEBUG")
+
+    # Step 2.4: fila de tarefas em segundo plano (0 = executa na própria requisição)
+    JOB_QUEUE_WORKERS = int(os.getenv("JOB_QUEUE_WORKERS", "2"))
+    JOB_QUEUE_POLL_INTERVAL = float(os.getenv("JOB_QUEUE_POLL_INTERVAL", "1.0"))
+    JOB_QUEUE_STALE_AFTER = int(os.getenv("JOB_QUEUE_STALE_AFTER", "300"))
+    JOB_QUEUE_MAX_ATTEMPTS = int(os.getenv("JOB_QUEUE_MAX_ATTEMPTS", "3"))
+    # Explicação: a rota de streaming lê o texto parcial gravado pela tarefa a cada intervalo;
+    # o timeout cobre a espera na fila mais a geração, depois dele o cliente consulta a tarefa
+    CHAT_STREAM_POLL_INTERVAL = float(os.getenv("CHAT_STREAM_POLL_INTERVAL", "0.25"))
+    CHAT_STREAM_TIMEOUT = int(os.getenv("CHAT_STREAM_TIMEOUT", "120"))
+
+    # Step 2.5: orçamento de tokens do histórico enviado ao Gemini a cada turno
+    CONTEXT_WINDOW_TOKENS = int(os.getenv("CONTEXT_WINDOW_TOKENS", "8000"))
+    CONTEXT_KEEP_LAST_MESSAGES = int(os.getenv("CONTEXT_KEEP_LAST_MESSAGES", "2"))
+
+    # Step 2.6: tamanho das páginas (paginação por cursor) das conversas e mensagens
+    CONVERSATIONS_PER_PAGE = int(os.getenv("CONVERSATIONS_PER_PAGE", "30"))
+    MESSAGES_PER_PAGE = int(os.getenv("MESSAGES_PER_PAGE", "50"))
+    SEARCH_RESULTS_PER_PAGE = int(os.getenv("SEARCH_RESULTS_PER_PAGE", "20"))
+
+    # Step 2.6.1: exclusão em massa - acima de BULK_DELETE_SYNC_LIMIT mensagens a limpeza
+    # vai para a fila e roda em lotes de BULK_DELETE_CHUNK_SIZE linhas (uma transação por lote)
+    BULK_DELETE_SYNC_LIMIT = int(os.getenv("BULK_DELETE_SYNC_LIMIT", "5000"))
+    BULK_DELETE_CHUNK_SIZE = int(os.getenv("BULK_DELETE_CHUNK_SIZE", "1000"))
+
+    # Step 2.6.2: arquivo frio - conversas sem atividade há ARCHIVE_AFTER_DAYS dias têm as
+    # mensagens comprimidas pelo comando `flask archive-conversations` (ver app/services/archive.py)
+    ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+    ARCHIVE_CODEC = os.getenv("ARCHIVE_CODEC", "zlib")  # Explicação: 'zlib' ou 'zstd' (pip install zstandard)
+    ARCHIVE_USE_DICTIONARY = os.getenv("ARCHIVE_USE_DICTIONARY", "true").lower() == "true"
+    ARCHIVE_DICTIONARY_SIZE = int(os.getenv("ARCHIVE_DICTIONARY_SIZE", str(32 * 1024)))
+
+    # Step 2.6.3: arquivos estáticos com hash no nome, gerados por `flask build-assets`
+    # (ver app/services/assets.py); ASSETS_MANIFEST=false volta a servir os originais
+    ASSETS_MANIFEST = os.getenv("ASSETS_MANIFEST", "true").lower() == "true"
+    ASSETS_MAX_AGE = int(os.getenv("ASSETS_MAX_AGE", str(365 * 24 * 3600)))  # Explicação: 1 ano
+
+    # Step 2.7: perfil do SQLite aplicado em cada conexão (ver app/services/sqlite_profile.py)
+    SQLITE_PRAGMAS_ENABLED = os.getenv("SQLITE_PRAGMAS_ENABLED", "true").lower() == "true"
+    SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+    SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+    SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+    SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-64000"))  # Explicação: negativo = KiB (64 MB)
+    SQLITE_TEMP_STORE = os.getenv("SQLITE_TEMP_STORE", "MEMORY")
+    SQLITE_FOREIGN_KEYS = os.getenv("SQLITE_FOREIGN_KEYS", "true").lower() == "true"
+    SQLITE_WAL_AUTOCHECKPOINT = int(os.getenv("SQLITE_WAL_AUTOCHECKPOINT", "1000"))  # Explicação: em páginas
+    SQLITE_CHECKPOINT_INTERVAL = float(os.getenv("SQLITE_CHECKPOINT_INTERVAL", "300"))  # Explicação: segundos, 0 desliga
+    SQLITE_CHECKPOINT_MODE = os.getenv("SQLITE_CHECKPOINT_MODE", "PASSIVE")
@@ -51,6 +51,15 @@ def get_metadata():
     return target_db.metadata
 
 
+# Explicação: a busca (migração b4e8f1a2c3d5_busca_fts5) cria a tabela virtual FTS5
+# `messages_fts` e as tabelas internas dela (_data, _idx, _docsize, _config) fora dos
+# modelos; sem este filtro o autogenerate escreveria uma migração que apaga o índice
+def include_object(object, name, type_, reflected, compare_to):
+    if type_ == "table" and name.startswith("messages_fts"):
+        return False
+    return True
+
+
 def run_migrations_offline():
     """Run migrations in 'offline' mode.
 
@@ -65,7 +74,8 @@ def run_migrations_offline():
     """
     url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url, target_metadata=get_metadata(), literal_binds=True
+        url=url, target_metadata=get_metadata(), literal_binds=True,
+        include_object=include_object
     )
 
     with context.begin_transaction():
@@ -93,10 +103,18 @@ def run_migrations_online():
     conf_args = current_app.extensions['migrate'].configure_args
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
+    conf_args.setdefault("include_object", include_object)
 
     connectable = get_engine()
 
     with connectable.connect() as connection:
+        # Explicação: o perfil do SQLite liga foreign_keys em toda conexão, e o modo batch
+        # recria tabelas com DROP TABLE - com as chaves ligadas isso apagaria em cascata as
+        # linhas das tabelas filhas (ex.: recriar `conversations` apagaria `messages`)
+        if connection.dialect.name == "sqlite":
+            connection.exec_driver_sql("PRAGMA foreign_keys=OFF")
+            connection.commit()
+
         context.configure(
             connection=connection,
             target_metadata=get_metadata(),
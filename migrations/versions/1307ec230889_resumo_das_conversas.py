@@ -0,0 +1,63 @@
+"""Contagem de mensagens e prévia da última mensagem nas conversas
+
+Revision ID: 1307ec230889
+Revises: 641e58ee8e63
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1307ec230889'
+down_revision = '641e58ee8e63'
+branch_labels = None
+depends_on = None
+
+PREVIEW_CHARS = 120
+
+
+def _preview(content):
+    # Explicação: mesma regra do chat_service.message_preview (copiada, migrações não importam o app)
+    texto = " ".join((content or "").split())
+    if len(texto) <= PREVIEW_CHARS:
+        return texto
+    return texto[:PREVIEW_CHARS - 3].rstrip() + "..."
+
+
+def upgrade():
+    with op.batch_alter_table('conversations', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('message_count', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('last_message_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('last_message_preview', sa.String(length=PREVIEW_CHARS), nullable=True))
+
+    # Explicação: contagem e data da última mensagem direto no SQL
+    op.execute(
+        "UPDATE conversations SET"
+        " message_count = (SELECT count(*) FROM messages"
+        " WHERE messages.conversation_id = conversations.id),"
+        " last_message_at = (SELECT max(messages.timestamp) FROM messages"
+        " WHERE messages.conversation_id = conversations.id)"
+    )
+
+    # Explicação: a prévia precisa da mesma normalização do app, então é feita em Python
+    conn = op.get_bind()
+    ultimas = conn.execute(sa.text(
+        "SELECT m.conversation_id, m.content FROM messages m"
+        " WHERE m.id = (SELECT m2.id FROM messages m2"
+        " WHERE m2.conversation_id = m.conversation_id"
+        " ORDER BY m2.timestamp DESC, m2.id DESC LIMIT 1)"
+    ))
+    previas = [{"id": conversa_id, "preview": _preview(content)} for conversa_id, content in ultimas]
+    if previas:
+        conn.execute(
+            sa.text("UPDATE conversations SET last_message_preview = :preview WHERE id = :id"),
+            previas,
+        )
+
+def downgrade():
+    with op.batch_alter_table('conversations', schema=None) as batch_op:
+        batch_op.drop_column('last_message_preview')
+        batch_op.drop_column('last_message_at')
+        batch_op.drop_column('message_count')
@@ -0,0 +1,34 @@
+"""Índices compostos para as listas de conversas e mensagens
+
+Revision ID: 641e58ee8e63
+Revises: fe687d6c3548
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '641e58ee8e63'
+down_revision = 'fe687d6c3548'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Explicação: conversas do usuário por updated_at (minha conta e histórico)
+    with op.batch_alter_table('conversations', schema=None) as batch_op:
+        batch_op.create_index('ix_conversations_user_id_updated_at', ['user_id', 'updated_at'], unique=False)
+
+    # Explicação: mensagens de uma conversa por timestamp (página da conversa)
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.create_index('ix_messages_conversation_id_timestamp_id', ['conversation_id', 'timestamp', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.drop_index('ix_messages_conversation_id_timestamp_id')
+
+    with op.batch_alter_table('conversations', schema=None) as batch_op:
+        batch_op.drop_index('ix_conversations_user_id_updated_at')
@@ -0,0 +1,26 @@
+"""Marca de conta apagada (limpeza dos dados em segundo plano)
+
+Revision ID: 9c2d4b7e5a10
+Revises: 1307ec230889
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c2d4b7e5a10'
+down_revision = '1307ec230889'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('deleted_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('deleted_at')
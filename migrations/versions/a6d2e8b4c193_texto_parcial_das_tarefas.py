@@ -0,0 +1,26 @@
+"""Texto parcial da resposta gravado pela tarefa durante o streaming
+
+Revision ID: a6d2e8b4c193
+Revises: f3a9d1c7b2e4
+Create Date: 2026-10-18 23:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6d2e8b4c193'
+down_revision = 'f3a9d1c7b2e4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('jobs', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('output', sa.Text(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('jobs', schema=None) as batch_op:
+        batch_op.drop_column('output')
@@ -0,0 +1,51 @@
+"""Busca no histórico: tabela FTS5 das mensagens (SQLite) ou índice GIN (PostgreSQL)
+
+Revision ID: b4e8f1a2c3d5
+Revises: 9c2d4b7e5a10
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b4e8f1a2c3d5'
+down_revision = '9c2d4b7e5a10'
+branch_labels = None
+depends_on = None
+
+# Explicação: mesmo SQL do app/services/search.py (copiado, migrações não importam o app)
+FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+    "content, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN "
+    "INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN "
+    "INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN "
+    "INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+    "INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content); END",
+)
+PG_INDEX_DDL = "CREATE INDEX IF NOT EXISTS ix_messages_content_fts ON messages USING gin (to_tsvector('simple', content))"
+
+
+def upgrade():
+    dialeto = op.get_bind().dialect.name
+    if dialeto == 'sqlite':
+        for comando in FTS_DDL:
+            op.execute(comando)
+        # Explicação: indexa as mensagens que já existem
+        op.execute("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+    elif dialeto == 'postgresql':
+        op.execute(PG_INDEX_DDL)
+
+
+def downgrade():
+    dialeto = op.get_bind().dialect.name
+    if dialeto == 'sqlite':
+        for trigger in ('messages_fts_insert', 'messages_fts_delete', 'messages_fts_update'):
+            op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        op.execute("DROP TABLE IF EXISTS messages_fts")
+    elif dialeto == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_messages_content_fts")
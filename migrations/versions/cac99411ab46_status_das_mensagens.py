@@ -0,0 +1,27 @@
+"""Status das mensagens (pending/complete/failed)
+
+Revision ID: cac99411ab46
+Revises: 817c76800f58
+Create Date: 2026-10-18 09:12:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'cac99411ab46'
+down_revision = '817c76800f58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Explicação: mensagens existentes já foram respondidas, então entram como 'complete'
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('status', sa.String(length=20), nullable=False, server_default='complete'))
+
+
+def downgrade():
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.drop_column('status')
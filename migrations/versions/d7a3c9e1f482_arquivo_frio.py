@@ -0,0 +1,49 @@
+"""Arquivo frio: mensagens comprimidas das conversas antigas
+
+Revision ID: d7a3c9e1f482
+Revises: b4e8f1a2c3d5
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7a3c9e1f482'
+down_revision = 'b4e8f1a2c3d5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('conversations', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('archived_at', sa.DateTime(), nullable=True))
+
+    op.create_table('archive_dictionaries',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('codec', sa.String(length=20), nullable=False),
+    sa.Column('data', sa.LargeBinary(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('conversation_archives',
+    sa.Column('conversation_id', sa.Integer(), nullable=False),
+    sa.Column('codec', sa.String(length=20), nullable=False),
+    sa.Column('dictionary_id', sa.Integer(), nullable=True),
+    sa.Column('payload', sa.LargeBinary(), nullable=False),
+    sa.Column('message_count', sa.Integer(), nullable=False),
+    sa.Column('raw_bytes', sa.Integer(), nullable=False),
+    sa.Column('archived_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['conversation_id'], ['conversations.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['dictionary_id'], ['archive_dictionaries.id'], ),
+    sa.PrimaryKeyConstraint('conversation_id')
+    )
+
+
+def downgrade():
+    # Explicação: as mensagens arquivadas só existem comprimidas; restaure com o app antes de voltar
+    op.drop_table('conversation_archives')
+    op.drop_table('archive_dictionaries')
+    with op.batch_alter_table('conversations', schema=None) as batch_op:
+        batch_op.drop_column('archived_at')
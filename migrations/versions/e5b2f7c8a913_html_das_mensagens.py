@@ -0,0 +1,45 @@
+"""HTML das mensagens gerado ao salvar (Markdown limpo)
+
+Revision ID: e5b2f7c8a913
+Revises: d7a3c9e1f482
+Create Date: 2026-10-18 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b2f7c8a913'
+down_revision = 'd7a3c9e1f482'
+branch_labels = None
+depends_on = None
+
+
+# Explicação: as mensagens existentes ficam com content_html NULL (renderizadas na hora)
+# até rodar `flask render-messages`, que usa o renderizador do app
+def upgrade():
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('content_html', sa.Text(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.drop_column('content_html')
+
+    # Explicação: no SQLite o drop_column recria a tabela `messages` e leva junto os triggers
+    # da busca (mesmo SQL da migração b4e8f1a2c3d5_busca_fts5)
+    if op.get_bind().dialect.name == 'sqlite':
+        for comando in FTS_TRIGGERS:
+            op.execute(comando)
+
+
+FTS_TRIGGERS = (
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN "
+    "INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN "
+    "INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN "
+    "INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+    "INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content); END",
+)
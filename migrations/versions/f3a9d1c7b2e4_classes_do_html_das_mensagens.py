@@ -0,0 +1,26 @@
+"""HTML das mensagens gerado de novo com a lista de classes permitidas
+
+Revision ID: f3a9d1c7b2e4
+Revises: e5b2f7c8a913
+Create Date: 2026-10-18 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a9d1c7b2e4'
+down_revision = 'e5b2f7c8a913'
+branch_labels = None
+depends_on = None
+
+
+# Explicação: o HTML salvo antes aceitava qualquer classe; as mensagens com classe voltam a
+# content_html NULL (renderizadas na hora, já com o filtro) até rodar `flask render-messages`
+def upgrade():
+    op.execute("UPDATE messages SET content_html = NULL WHERE content_html LIKE '%class=%'")
+
+
+def downgrade():
+    pass
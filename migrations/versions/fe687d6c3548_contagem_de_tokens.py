@@ -0,0 +1,60 @@
+"""Contagem de tokens por mensagem e total por conversa
+
+Revision ID: fe687d6c3548
+Revises: 41a324e24fc4
+Create Date: 2026-10-18 11:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'fe687d6c3548'
+down_revision = '41a324e24fc4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('prompt_tokens', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('response_tokens', sa.Integer(), nullable=True))
+
+    with op.batch_alter_table('conversations', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('total_tokens', sa.Integer(), nullable=False, server_default='0'))
+
+    # Explicação: mensagens antigas recebem a mesma estimativa local do app
+    # (~4 caracteres por token); o uso real da API não foi guardado
+    op.execute(
+        "UPDATE messages SET prompt_tokens = (length(content) + 3) / 4 WHERE role = 'user'"
+    )
+    op.execute(
+        "UPDATE messages SET response_tokens = (length(content) + 3) / 4 WHERE role <> 'user'"
+    )
+    # Explicação: como no complete_turn sem usage_metadata, o prompt da resposta é a
+    # estimativa da pergunta que ela respondeu (a mensagem do usuário anterior)
+    op.execute(
+        "UPDATE messages SET prompt_tokens = ("
+        " SELECT pergunta.prompt_tokens FROM messages AS pergunta"
+        " WHERE pergunta.conversation_id = messages.conversation_id"
+        " AND pergunta.role = 'user' AND pergunta.id < messages.id"
+        " ORDER BY pergunta.id DESC LIMIT 1)"
+        " WHERE role <> 'user' AND status = 'complete'"
+    )
+    # Explicação: o total soma prompt + resposta de cada turno concluído, como o
+    # _touch_conversation faz em tempo de execução (só as respostas do modelo contam)
+    op.execute(
+        "UPDATE conversations SET total_tokens = ("
+        " SELECT coalesce(sum(coalesce(prompt_tokens, 0) + coalesce(response_tokens, 0)), 0)"
+        " FROM messages WHERE messages.conversation_id = conversations.id"
+        " AND messages.role <> 'user' AND messages.status = 'complete')"
+    )
+
+def downgrade():
+    with op.batch_alter_table('conversations', schema=None) as batch_op:
+        batch_op.drop_column('total_tokens')
+
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.drop_column('response_tokens')
+        batch_op.drop_column('prompt_tokens')
@@ -2,8 +2,21 @@
 
 import os
 import sys
+
+# Explicação: valores padrão para rodar os testes sem um arquivo .env
+os.environ.setdefault("SECRET_KEY", "chave-de-teste")
+os.environ.setdefault("GEMINI_API_KEY", "chave-de-teste")
+os.environ.setdefault("LLM_BACKEND", "fake")  # Explicação: sem rede nos testes
+os.environ.setdefault("FAKE_LLM_LATENCY", "0")
+os.environ.setdefault("FAKE_LLM_CHUNK_DELAY", "0")
+os.environ.setdefault("SQLALCHEMY_DATABASE_URI", "sqlite:///:memory:")
+os.environ.setdefault("GEMINI_RATE_LIMIT_BACKEND", "memory")
+os.environ.setdefault("JOB_QUEUE_WORKERS", "0")  # Explicação: tarefas rodam na própria requisição
+
+from types import SimpleNamespace
 from app import create_app, db
 
+
 def test_app_creation():
     """Testa se a aplicação Flask cria corretamente"""
     print(" Testando criação da aplicação...")
@@ -17,6 +30,7 @@ def test_app_creation():
         print(f" Erro ao criar aplicação: {e}")
         return False
 
+
 def test_database_connection():
     """Testa conexão com o banco de dados"""
     print(" Testando conexão com banco...")
@@ -32,6 +46,7 @@ def test_database_connection():
         print(f"Erro no banco: {e}")
         return False
 
+
 def test_routes():
     """Testa se as rotas básicas funcionam"""
     print(" Testando rotas...")
@@ -54,6 +69,1265 @@ def test_routes():
     
     return True
 
+
+def _app_com_usuario_logado():
+    """Cria app com banco em memória, um usuário logado e uma conversa"""
+    from app.models import User, Conversation
+    from app.services.fragment_cache import fragment_cache
+    from app.services.history_cache import history_cache
+    from app.services.user_cache import user_cache
+
+    history_cache.clear()  # Explicação: cada teste tem um banco novo com IDs repetidos
+    user_cache.clear()
+    fragment_cache.clear()
+
+    app = create_app()
+    app.config["WTF_CSRF_ENABLED"] = False
+    with app.app_context():
+        db.create_all()
+        user = User(username="teste", email="teste@teste.com", password_hash="x")
+        user.set_password("Senha@123")
+        db.session.add(user)
+        db.session.commit()
+        conversa = Conversation(title="Conversa de teste", user_id=user.id)
+        db.session.add(conversa)
+        db.session.commit()
+        conversa_id = conversa.id
+
+    client = app.test_client()
+    client.post("/auth/login", data={"email": "teste@teste.com", "senha": "Senha@123"})
+    return app, client, conversa_id
+
+
+def _resposta_falsa(texto, sucesso=True, uso=None, chamadas=None):
+    """Substituto do gemini_service.send_message (respeita return_usage)"""
+    def send_message(message, conversation_history=None, return_usage=False, **kwargs):
+        if chamadas is not None:
+            chamadas.append(conversation_history)
+        return (texto, sucesso, uso) if return_usage else (texto, sucesso)
+    return send_message
+
+
+def test_enviar_mensagem_stream(monkeypatch):
+    """Testa se a rota SSE agenda a resposta na fila e repassa o texto gravado pela tarefa"""
+    from app.models import Job, Message
+    from app.services.gemini_service import gemini_service
+
+    app, client, conversa_id = _app_com_usuario_logado()
+    monkeypatch.setattr(gemini_service, "send_message", _resposta_falsa("Olá, mundo!"))
+
+    response = client.post(
+        f"/minha-conta/conversa/{conversa_id}/enviar-mensagem-stream", data={"content": "oi"}
+    )
+    corpo = response.get_data(as_text=True)
+
+    assert response.mimetype == "text/event-stream"
+    assert "event: user" in corpo and "event: chunk" in corpo and "event: done" in corpo
+    assert "Olá, mundo!" in corpo
+    with app.app_context():
+        mensagens = Message.query.order_by(Message.id).all()
+        assert [(m.role, m.content) for m in mensagens] == [("user", "oi"), ("assistant", "Olá, mundo!")]
+        assert [(j.kind, j.status) for j in Job.query] == [("reply", "done")]
+
+
+def test_stream_repassa_os_pedacos_do_backend(monkeypatch, tmp_path):
+    """Testa se os pedaços do FakeBackend chegam como `event: chunk` antes do `event: done`"""
+    import json
+    from config import Config
+    from app.models import Message
+    from app.services.gemini_service import gemini_service
+    from app.services.job_queue import job_queue
+    from app.services.llm_backends import FakeBackend
+    from app.services.rate_limiter import TokenBucket
+
+    # Explicação: banco em arquivo e uma thread da fila, como em produção (a tarefa grava
+    # os pedaços enquanto a requisição lê)
+    monkeypatch.setattr(Config, "SQLALCHEMY_DATABASE_URI", f"sqlite:///{tmp_path / 'stream.db'}")
+    monkeypatch.setattr(Config, "JOB_QUEUE_WORKERS", 1)
+    monkeypatch.setattr(Config, "CHAT_STREAM_POLL_INTERVAL", 0.01)
+    monkeypatch.setattr(gemini_service, "_backend", FakeBackend(latency=0, chunk_chars=10, chunk_delay=0.05))
+    monkeypatch.setattr(gemini_service, "_rate_limiter", TokenBucket(rate=1000, capacity=10))
+    app, client, conversa_id = _app_com_usuario_logado()
+
+    try:
+        response = client.post(
+            f"/minha-conta/conversa/{conversa_id}/enviar-mensagem-stream",
+            data={"content": f"pergunta do streaming {tmp_path.name}"},
+        )
+        corpo = response.get_data(as_text=True)
+    finally:
+        job_queue.stop()
+
+    # Step 1: vários pedaços, todos antes do fim
+    pedacos = [
+        json.loads(bloco.split("data: ", 1)[1])["text"]
+        for bloco in corpo.split("\n\n") if bloco.startswith("event: chunk")
+    ]
+    assert len(pedacos) >= 2, corpo
+    assert corpo.rindex("event: chunk") < corpo.index("event: done")
+
+    # Step 2: os pedaços juntos são a resposta salva
+    with app.app_context():
+        resposta = Message.query.filter_by(role="assistant").one()
+        assert "".join(pedacos) == resposta.content
+
+
+def test_enviar_mensagem_estados_do_turno(monkeypatch):
+    """Testa se turnos com erro ficam 'failed' e saem do histórico do Gemini"""
+    from app.models import Message
+    from app.services import chat_service
+    from app.services.gemini_service import gemini_service
+
+    app, client, conversa_id = _app_com_usuario_logado()
+    url = f"/minha-conta/conversa/{conversa_id}/enviar-mensagem"
+
+    monkeypatch.setattr(gemini_service, "send_message", _resposta_falsa("Erro 429", sucesso=False))
+    client.post(url, data={"content": "primeira"})
+
+    historicos = []
+    monkeypatch.setattr(gemini_service, "send_message", _resposta_falsa("Resposta", chamadas=historicos))
+    client.post(url, data={"content": "segunda"})
+
+    with app.app_context():
+        estados = [(m.role, m.status) for m in Message.query.order_by(Message.id)]
+        assert estados == [
+            ("user", "failed"), ("assistant", "failed"),
+            ("user", "complete"), ("assistant", "complete"),
+        ]
+        assert historicos == [[]]
+        assert len(chat_service.build_history(conversa_id)) == 2
+
+
+def test_enviar_mensagem_json_retorna_tarefa(monkeypatch):
+    """Testa se o envio via JSON responde 202 com a tarefa da fila"""
+    from app.services.gemini_service import gemini_service
+
+    app, client, conversa_id = _app_com_usuario_logado()
+    monkeypatch.setattr(gemini_service, "send_message", _resposta_falsa("Resposta"))
+
+    response = client.post(
+        f"/minha-conta/conversa/{conversa_id}/enviar-mensagem", json={"content": "oi"}
+    )
+    assert response.status_code == 202
+    dados = response.get_json()
+
+    tarefa = client.get(dados["status_url"]).get_json()
+    assert tarefa["status"] == "done"
+    assert tarefa["result"]["success"] is True
+
+
+def test_rate_limiter_compartilhado(tmp_path):
+    """Testa se dois baldes no mesmo arquivo SQLite dividem as fichas"""
+    from app.services.rate_limiter import TokenBucket, SQLBackend
+
+    url = f"sqlite:///{tmp_path / 'bucket.db'}"
+    worker_a = TokenBucket(rate=1, capacity=2, backend=SQLBackend(url))
+    worker_b = TokenBucket(rate=1, capacity=2, backend=SQLBackend(url))
+
+    assert worker_a.reserve() == 0
+    assert worker_b.reserve() == 0
+    # Explicação: o balde acabou para os dois, o próximo espera ~1s (sem dormir aqui)
+    assert 0.9 < worker_a.reserve() <= 1.0
+    assert worker_b.budget()["tokens"] < 0
+
+
+def test_rate_limiter_espera_maxima():
+    """Testa se uma espera maior que max_wait falha com o erro 429 sem reservar a ficha"""
+    import pytest
+    from app.services.rate_limiter import TokenBucket
+
+    balde = TokenBucket(rate=1, capacity=1, max_wait=0.5)
+    assert balde.acquire() == 0
+
+    # Explicação: a próxima ficha só sai em ~1s, acima do máximo de 0.5s
+    with pytest.raises(Exception, match="Erro 429"):
+        balde.acquire()
+    # Explicação: a recusa não entrou na fila (saldo não ficou negativo)
+    assert 0 <= balde.budget()["tokens"] < 0.5
+
+
+def test_taxa_do_rate_limiter_compartilhada(monkeypatch, tmp_path):
+    """Testa que a troca de taxa vale para todos os processos e que o reset volta à taxa configurada"""
+    from app.services.gemini_service import GeminiService
+    from app.services.rate_limiter import SQLBackend
+
+    url = f"sqlite:///{tmp_path / 'bucket.db'}"
+    monkeypatch.setenv("GEMINI_RATE_LIMIT_RPM", "60")
+    monkeypatch.setenv("GEMINI_RATE_LIMIT_BACKEND", url)
+    worker_a, worker_b = GeminiService(), GeminiService()
+
+    app = create_app()
+    with app.app_context():
+        # Explicação: muitos 429 no worker A deixam o worker B mais devagar também
+        worker_a._set_min_request_interval(10.0)
+        assert worker_b._rate_limiter.budget()["rate_per_second"] == 0.1
+        assert worker_b._rate_limiter.reserve() == 0
+        assert 9.9 < worker_b._rate_limiter.reserve() <= 10.0
+
+        worker_b.reset_error_counters()
+        assert worker_b._min_request_interval == 1.0
+        assert worker_a._rate_limiter.budget()["requests_per_minute"] == 60
+        assert SQLBackend(url).peek("gemini", 1.0, 1)[1] == 1.0
+
+
+def test_historico_respeita_orcamento_de_tokens():
+    """Testa se o histórico fica no orçamento mesmo com conversas longas"""
+    from app.models import Message
+    from app.services import chat_service
+    from app.services.context_window import estimate_tokens
+
+    app, client, conversa_id = _app_com_usuario_logado()
+    app.config["CONTEXT_WINDOW_TOKENS"] = 1000
+    with app.app_context():
+        for i in range(300):
+            db.session.add(Message(content=f"{i} " + "x" * 400, conversation_id=conversa_id,
+                                   role="user" if i % 2 == 0 else "assistant"))
+        db.session.commit()
+
+        historico = chat_service.build_history(conversa_id)
+        tokens = sum(estimate_tokens(h["parts"][0]) for h in historico)
+
+        assert tokens <= 1000
+        assert historico[0]["role"] == "user"
+        assert historico[-1]["parts"][0].startswith("299 ")
+
+
+def test_tokens_salvos_por_mensagem_e_conversa(monkeypatch):
+    """Testa se o uso de tokens da API fica na mensagem e soma na conversa"""
+    from app.models import Conversation, Message
+    from app.services.gemini_service import gemini_service
+
+    app, client, conversa_id = _app_com_usuario_logado()
+    uso = {"prompt_tokens": 12, "response_tokens": 30}
+    monkeypatch.setattr(gemini_service, "send_message", _resposta_falsa("Resposta", uso=uso))
+
+    url = f"/minha-conta/conversa/{conversa_id}/enviar-mensagem"
+    client.post(url, data={"content": "oi tudo bem"})
+    client.post(url, data={"content": "e agora?"})
+
+    with app.app_context():
+        resposta = Message.query.filter_by(role="assistant").first()
+        assert (resposta.prompt_tokens, resposta.response_tokens) == (12, 30)
+        assert Message.query.filter_by(role="user").first().prompt_tokens == 3
+        assert db.session.get(Conversation, conversa_id).total_tokens == 84
+
+
+def test_cache_de_respostas_repetidas(monkeypatch):
+    """Testa se prompts repetidos saem do cache sem chamar a API"""
+    from app.services.gemini_service import GeminiService
+    from app.services.llm_backends import FakeBackend
+    from app.services.rate_limiter import TokenBucket
+
+    backend = FakeBackend(latency=0, chunk_delay=0)
+    service = GeminiService(backend=backend)
+    service._rate_limiter = TokenBucket(rate=1000, capacity=10)
+
+    app = create_app()
+    with app.app_context():
+        texto, sucesso = service.send_message("O que é Python?")
+        assert sucesso and texto.startswith("Resposta simulada para: O que é Python?")
+        assert service.send_message("  o que é   python? ") == (texto, True)
+        service.send_message("O que é Python?", generation_config={"temperature": 0.9})
+
+    assert backend.calls == 2
+    assert service.get_cache_stats()["memory"]["hits"] == 1
+
+    # Step 2: o turno respondido pelo cache não soma tokens na conversa
+    from app.models import Conversation
+    from app.services import chat_service
+
+    app, client, conversa_id = _app_com_usuario_logado()
+    with app.app_context():
+        mensagem = chat_service.create_user_turn(conversa_id, "O que é Python?")
+        resposta, sucesso = chat_service.run_turn(mensagem.id, service=service)
+        assert sucesso and resposta.content == texto
+        assert resposta.prompt_tokens is None and resposta.response_tokens > 0
+        assert db.session.get(Conversation, conversa_id).total_tokens == 0
+    assert backend.calls == 2
+
+
+def test_backend_falso(monkeypatch):
+    """Testa o backend falso: streaming em pedaços, uso de tokens e retry do 429"""
+    import pytest
+    from app.services.gemini_service import GeminiService
+    from app.services.llm_backends import FakeBackend, LLMBackend
+    from app.services.rate_limiter import TokenBucket
+
+    monkeypatch.setenv("GEMINI_CACHE_ENABLED", "false")
+    monkeypatch.setattr("app.services.gemini_service.time.sleep", lambda segundos: None)
+    backend = FakeBackend(latency=0, chunk_chars=10, chunk_delay=0)
+    service = GeminiService(backend=backend)
+    service._rate_limiter = TokenBucket(rate=1000, capacity=10)
+
+    app = create_app()
+    with app.app_context():
+        pedacos, sucesso = service.send_message("Olá", stream=True)
+        pedacos = list(pedacos)
+        texto, _ = service.send_message("Olá")
+        assert sucesso and "".join(p.text for p in pedacos) == texto
+        assert all(len(p.text) <= 10 for p in pedacos)
+        assert service.get_usage(pedacos[-1])["response_tokens"] > 0
+
+        # Explicação: com seed 1 o primeiro sorteio (0.13) dá 429 e o segundo (0.85) não
+        backend.error_429_rate = 0.5
+        backend._random.seed(1)
+        texto, sucesso = service.send_message("Olá")
+        assert sucesso and backend.calls == 4
+
+    # Explicação: backend incompleto falha ao ser criado
+    class SemContagem(LLMBackend):
+        def generate(self, message, history=None, generation_config=None, safety_settings=None, stream=False):
+            return None
+
+        def generate_candidates(self, message, history=None, generation_config=None, safety_settings=None):
+            return []
+
+    with pytest.raises(TypeError, match="count_tokens"):
+        SemContagem()
+
+
+def test_cache_de_historico_incremental():
+    """Testa se o cache de histórico acompanha turnos novos e pendentes"""
+    from app.models import Message
+    from app.services import chat_service
+
+    app, client, conversa_id = _app_com_usuario_logado()
+    with app.app_context():
+        def nova(content, role, status=Message.STATUS_COMPLETE):
+            mensagem = Message(content=content, role=role, status=status, conversation_id=conversa_id)
+            db.session.add(mensagem)
+            db.session.commit()
+            return mensagem
+
+        nova("a", "user"), nova("b", "assistant")
+        assert len(chat_service.build_history(conversa_id)) == 2
+
+        pendente = nova("c", "user", Message.STATUS_PENDING)
+        nova("d", "user"), nova("e", "assistant")
+        textos = lambda: [h["parts"][0] for h in chat_service.build_history(conversa_id)]
+        assert textos() == ["a", "b", "d", "e"]
+
+        # Explicação: o turno pendente terminou depois e entra na posição certa
+        pendente.status = Message.STATUS_COMPLETE
+        db.session.commit()
+        assert textos() == ["a", "b", "c", "d", "e"]
+
+
+def test_cache_de_historico_entre_processos():
+    """Testa que o cache de outro processo percebe conversa apagada (ID reutilizado) e mensagem apagada"""
+    from app.models import Conversation, Message, User
+    from app.services import bulk_delete, chat_service
+    from app.services.history_cache import HistoryCache
+
+    app, client, _ = _app_com_usuario_logado()
+    outro_processo = HistoryCache()  # Explicação: o invalidate() do processo que apaga não chega aqui
+    with app.app_context():
+        dono = User.query.first()
+        conversa = Conversation(title="Segredo", user_id=dono.id)
+        db.session.add(conversa)
+        db.session.commit()
+        segredo_id = conversa.id
+        chat_service.complete_turn(chat_service.create_user_turn(segredo_id, "meu segredo: 1234").id, "anotado")
+        assert len(outro_processo.build(segredo_id)) == 2
+
+        # Step 1: a conversa é apagada e o SQLite dá o mesmo ID à conversa de outro usuário
+        bulk_delete.delete_conversations(dono.id, conversation_ids=[segredo_id])
+        db.session.expunge_all()  # Explicação: a próxima conversa chega em outra requisição
+        intruso = User(username="outro", email="outro@teste.com", password_hash="x")
+        db.session.add(intruso)
+        db.session.commit()
+        nova = Conversation(title="Nova", user_id=intruso.id)
+        db.session.add(nova)
+        db.session.commit()
+        assert nova.id == segredo_id
+        pergunta = chat_service.create_user_turn(nova.id, "oi")
+        assert outro_processo.build(nova.id, before_message_id=pergunta.id) == []
+
+        # Step 2: mensagem apagada em outro processo sai do histórico em cache
+        chat_service.complete_turn(pergunta.id, "olá")
+        chat_service.complete_turn(chat_service.create_user_turn(nova.id, "tudo bem?").id, "sim")
+        assert len(outro_processo.build(nova.id)) == 4
+        chat_service.delete_message(Message.query.filter_by(content="olá").one())
+        assert [h["parts"][0] for h in outro_processo.build(nova.id)] == ["oi", "tudo bem?", "sim"]
+
+
+def test_benchmark_das_rotas():
+    """Testa o benchmark das rotas em escala mínima (relatório com todas as métricas)"""
+    from benchmarks import bench_rotas
+    from app.services.history_cache import history_cache
+
+    history_cache.clear()
+    app = create_app()
+    alvos = bench_rotas.seed(app, users=1, conversations_per_user=2, messages_per_user=10)
+    resultados = bench_rotas.run(app, alvos, requests=2, concurrency=1, warmup=0)
+
+    assert set(resultados) == set(bench_rotas.ROUTES)
+    for rota, dados in resultados.items():
+        assert dados["errors"] == 0, rota
+        assert dados["requests"] == 2
+        assert dados["latency_ms"]["p99"] >= dados["latency_ms"]["p50"] > 0
+        assert dados["sql_queries"]["total"] > 0
+    assert bench_rotas.percentile([1, 2, 3, 4], 50) == 2
+
+
+def test_rotas_usam_indices_compostos():
+    """Testa (EXPLAIN QUERY PLAN) se as listas de conversas e mensagens usam os índices, sem sort"""
+    from sqlalchemy import event
+
+    app, client, conversa_id = _app_com_usuario_logado()
+    consultas = []
+    def capturar(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT") and "ORDER BY" in statement:
+            consultas.append((statement, parameters))
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", capturar)
+    try:
+        for url in ("/minha-conta/minha-conta", "/minha-conta/historico-conversas",
+                    f"/minha-conta/conversa/{conversa_id}"):
+            assert client.get(url).status_code == 200
+    finally:
+        event.remove(engine, "before_cursor_execute", capturar)
+
+    planos = {}
+    with app.app_context():
+        for statement, parameters in consultas:
+            linhas = db.session.connection().exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)
+            planos[statement] = " | ".join(linha[-1] for linha in linhas)
+
+    conversas = [p for s, p in planos.items() if "FROM conversations" in s]
+    mensagens = [p for s, p in planos.items() if "FROM messages" in s]
+    assert conversas and mensagens
+    for plano in conversas:
+        assert "ix_conversations_user_id_updated_at" in plano and "TEMP B-TREE" not in plano, plano
+    for plano in mensagens:
+        assert "ix_messages_conversation_id_timestamp_id" in plano and "TEMP B-TREE" not in plano, plano
+
+
+def test_resumo_da_conversa_e_historico_com_uma_consulta(monkeypatch):
+    """Testa a contagem/prévia salvas na conversa e o histórico renderizado com uma consulta"""
+    from sqlalchemy import event
+    from app.models import Conversation
+    from app.services.gemini_service import gemini_service
+
+    app, client, conversa_id = _app_com_usuario_logado()
+    monkeypatch.setattr(gemini_service, "send_message", _resposta_falsa("Resposta   com\nespaços " + "x" * 200))
+    client.post(f"/minha-conta/conversa/{conversa_id}/enviar-mensagem", data={"content": "oi"})
+
+    with app.app_context():
+        conversa = db.session.get(Conversation, conversa_id)
+        assert conversa.message_count == 2
+        assert conversa.last_message_at is not None
+        assert conversa.last_message_preview.startswith("Resposta com espaços x")
+        assert len(conversa.last_message_preview) == Conversation.PREVIEW_CHARS
+        for numero in range(5):
+            db.session.add(Conversation(title=f"Outra {numero}", user_id=conversa.user_id))
+        db.session.commit()
+        engine = db.engine
+
+    consultas = []
+    def capturar(conn, cursor, statement, parameters, context, executemany):
+        if "FROM users" not in statement:
+            consultas.append(statement)
+    event.listen(engine, "before_cursor_execute", capturar)
+    try:
+        resposta = client.get("/minha-conta/historico-conversas")
+    finally:
+        event.remove(engine, "before_cursor_execute", capturar)
+
+    assert resposta.status_code == 200
+    assert "2 mensagens" in resposta.get_data(as_text=True)
+    # Explicação: uma consulta para a página de conversas e um COUNT para o total, nada em messages
+    assert not [c for c in consultas if "messages" in c], consultas
+    assert len([c for c in consultas if "count(" not in c]) == 1, consultas
+    assert len(consultas) == 2, consultas
+
+
+def test_paginacao_por_cursor():
+    """Testa as páginas por cursor de conversas e mensagens (empates no timestamp, cursor inválido)"""
+    from datetime import datetime
+    from app.models import Conversation, Message
+
+    app, client, conversa_id = _app_com_usuario_logado()
+    app.config.update(CONVERSATIONS_PER_PAGE=3, MESSAGES_PER_PAGE=3)
+    mesmo_momento = datetime(2026, 1, 1, 12, 0, 0)
+    with app.app_context():
+        conversa = db.session.get(Conversation, conversa_id)
+        for numero in range(6):
+            db.session.add(Conversation(title=f"Outra {numero}", user_id=conversa.user_id,
+                                        updated_at=mesmo_momento))
+        for numero in range(7):
+            db.session.add(Message(content=f"m{numero}", role="user", conversation_id=conversa_id,
+                                   timestamp=mesmo_momento))
+        db.session.commit()
+
+    def todas_as_paginas(url, chave, parametro):
+        itens, cursor, paginas = [], None, 0
+        while True:
+            resposta = client.get(url + (f"?{parametro}={cursor}" if cursor else ""))
+            assert resposta.status_code == 200
+            dados = resposta.get_json()
+            assert len(dados[chave]) <= 3
+            itens += dados[chave]
+            paginas += 1
+            cursor = dados["next_cursor"]
+            if not cursor:
+                return itens, paginas
+
+    conversas, paginas = todas_as_paginas("/minha-conta/conversas", "conversas", "cursor")
+    assert paginas == 3 and len({c["id"] for c in conversas}) == 7
+    assert conversas[0]["id"] == conversa_id  # Explicação: a mais recente vem primeiro
+
+    mensagens, paginas = todas_as_paginas(f"/minha-conta/conversa/{conversa_id}/mensagens", "mensagens", "antes")
+    assert paginas == 3
+    # Explicação: cada página vem em ordem cronológica, e as páginas vão do fim para o começo
+    assert [m["content"] for m in mensagens] == ["m4", "m5", "m6", "m1", "m2", "m3", "m0"]
+
+    pagina = client.get(f"/minha-conta/conversa/{conversa_id}").get_data(as_text=True)
+    assert "Carregar mensagens anteriores" in pagina and "m6" in pagina and "m3" not in pagina
+    assert "Carregar mais conversas" in client.get("/minha-conta/historico-conversas").get_data(as_text=True)
+    assert client.get("/minha-conta/conversas?cursor=lixo").status_code == 400
+
+
+def test_perfil_sqlite_nas_conexoes(monkeypatch, tmp_path):
+    """Testa se as conexões SQLite recebem WAL, busy_timeout e os outros PRAGMAs do config"""
+    import pytest
+    from config import Config
+    from app.services.sqlite_profile import sqlite_profile
+
+    monkeypatch.setattr(Config, "SQLALCHEMY_DATABASE_URI", f"sqlite:///{tmp_path / 'chat.db'}")
+    monkeypatch.setattr(Config, "SQLITE_CHECKPOINT_INTERVAL", 0, raising=False)
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        conn = db.session.connection()
+        pragma = lambda nome: conn.exec_driver_sql(f"PRAGMA {nome}").scalar()
+        assert pragma("journal_mode") == "wal"
+        assert pragma("busy_timeout") == 5000
+        assert pragma("synchronous") == 1  # Explicação: 1 = NORMAL
+        assert pragma("temp_store") == 2  # Explicação: 2 = MEMORY
+        assert pragma("foreign_keys") == 1
+        db.session.rollback()
+        assert sqlite_profile.checkpoint(app, db.engine, "TRUNCATE") == (0, 0, 0)
+
+    monkeypatch.setattr(Config, "SQLITE_SYNCHRONOUS", "DEVAGAR", raising=False)
+    with pytest.raises(ValueError):
+        create_app()
+
+
+def test_replica_de_leitura(monkeypatch, tmp_path):
+    """Testa se as rotas de leitura usam a réplica e voltam ao primário logo depois de uma escrita"""
+    from config import Config
+    from app.models import Conversation
+    from app.services.database import engine_options, normalize_url, replica_engine
+
+    monkeypatch.setattr(Config, "SQLALCHEMY_DATABASE_URI", f"sqlite:///{tmp_path / 'primario.db'}")
+    monkeypatch.setattr(Config, "DATABASE_REPLICA_URL", f"sqlite:///{tmp_path / 'replica.db'}")
+    app, client, conversa_id = _app_com_usuario_logado()
+    app.config["DATABASE_REPLICA_STICKY_SECONDS"] = 0
+
+    # Explicação: a "réplica" é uma cópia com o título trocado, para saber de onde veio a leitura
+    with app.app_context():
+        db.metadatas[None].create_all(replica_engine())
+        with db.engine.connect() as primario, replica_engine().begin() as replica:
+            for tabela in ("users", "conversations"):
+                linhas = [dict(linha._mapping) for linha in primario.execute(db.metadatas[None].tables[tabela].select())]
+                replica.execute(db.metadatas[None].tables[tabela].insert(), linhas)
+            replica.execute(Conversation.__table__.update().values(title="Título da réplica"))
+
+    assert "Título da réplica" in client.get(f"/minha-conta/conversa/{conversa_id}").get_data(as_text=True)
+    assert client.get("/minha-conta/conversas").get_json()["conversas"][0]["title"] == "Título da réplica"
+
+    # Explicação: a escrita vai para o primário e, em seguida, as leituras também
+    app.config["DATABASE_REPLICA_STICKY_SECONDS"] = 60
+    client.post(f"/minha-conta/conversa/{conversa_id}/enviar-mensagem", json={"content": "oi"})
+    pagina = client.get(f"/minha-conta/conversa/{conversa_id}").get_data(as_text=True)
+    assert "Conversa de teste" in pagina and "oi" in pagina
+    with app.app_context():
+        with replica_engine().connect() as replica:
+            assert replica.exec_driver_sql("SELECT COUNT(*) FROM messages").scalar() == 0
+
+    config = {"DB_POOL_SIZE": 5, "DB_MAX_OVERFLOW": 2, "DB_POOL_TIMEOUT": 10,
+              "DB_POOL_RECYCLE": 600, "DB_POOL_PRE_PING": True}
+    assert normalize_url("postgres://u:s@host/flub") == "postgresql://u:s@host/flub"
+    assert engine_options(config, "postgresql+psycopg2://u:s@host/flub")["pool_size"] == 5
+    assert engine_options(config, "sqlite:///chat.db") == {}
+
+
+def test_exclusao_em_massa(monkeypatch):
+    """Testa o DELETE em conjunto das conversas e a limpeza da conta em lotes pela fila"""
+    import json
+    from sqlalchemy import event
+    from app.models import Conversation, Job, Message, User
+    from app.services import chat_service
+
+    app, client, conversa_id = _app_com_usuario_logado()
+    with app.app_context():
+        user_id = db.session.get(Conversation, conversa_id).user_id
+        for numero in range(3):
+            conversa = Conversation(title=f"Outra {numero}", user_id=user_id)
+            db.session.add(conversa)
+            db.session.commit()
+            for _ in range(2):
+                chat_service.complete_turn(chat_service.create_user_turn(conversa.id, "oi").id, "olá")
+        engine = db.engine
+
+    comandos = []
+    def capturar(conn, cursor, statement, parameters, context, executemany):
+        comandos.append(statement)
+    event.listen(engine, "before_cursor_execute", capturar)
+    try:
+        resposta = client.post("/minha-conta/apagar-todas-conversas", data={"confirmacao": "APAGAR_TODAS"})
+    finally:
+        event.remove(engine, "before_cursor_execute", capturar)
+
+    assert resposta.status_code == 302
+    # Explicação: nenhuma mensagem é carregada, só os DELETEs de mensagens, arquivo frio e conversas
+    assert not [c for c in comandos if c.startswith("SELECT") and "FROM messages" in c], comandos
+    assert len([c for c in comandos if c.startswith("DELETE")]) == 3, comandos
+    with app.app_context():
+        assert Conversation.query.count() == 0 and Message.query.count() == 0
+
+        conversa = Conversation(title="Nova", user_id=user_id)
+        db.session.add(conversa)
+        db.session.commit()
+        for _ in range(3):
+            chat_service.complete_turn(chat_service.create_user_turn(conversa.id, "oi").id, "olá")
+
+    # Explicação: acima do limite a conta vai para a fila (inline nos testes), em lotes de 2 linhas
+    app.config.update(BULK_DELETE_SYNC_LIMIT=1, BULK_DELETE_CHUNK_SIZE=2)
+    event.listen(engine, "before_cursor_execute", capturar)
+    comandos.clear()
+    try:
+        resposta = client.post("/minha-conta/apagar-conta", data={"confirmacao": "APAGAR_CONTA"})
+    finally:
+        event.remove(engine, "before_cursor_execute", capturar)
+
+    assert resposta.status_code == 302
+    assert len([c for c in comandos if c.startswith("DELETE FROM messages")]) == 3, comandos
+    with app.app_context():
+        assert User.query.count() == 0 and Message.query.count() == 0 and Conversation.query.count() == 0
+        tarefa = Job.query.filter_by(kind="purge_conversations").one()
+        assert tarefa.status == Job.STATUS_DONE and json.loads(tarefa.result)["conversations"] == 1
+
+    assert client.get("/minha-conta/minha-conta").status_code == 302
+
+
+def test_conta_marcada_como_apagada():
+    """Testa se a conta esperando a limpeza em segundo plano já não entra nem continua logada"""
+    from datetime import datetime
+    from app.models import User
+
+    app, client, conversa_id = _app_com_usuario_logado()
+    with app.app_context():
+        User.query.update({User.deleted_at: datetime.utcnow()})
+        db.session.commit()
+
+    assert client.get("/minha-conta/minha-conta").status_code == 302
+    resposta = client.post("/auth/login", data={"email": "teste@teste.com", "senha": "Senha@123"})
+    assert "Email ou senha incorretos" in resposta.get_data(as_text=True)
+
+
+def test_cache_do_usuario_logado():
+    """Testa se o user_loader usa o cache do processo e se editar o perfil invalida a cópia"""
+    from sqlalchemy import event
+    from app.services.user_cache import user_cache
+
+    app, client, conversa_id = _app_com_usuario_logado()
+    with app.app_context():
+        engine = db.engine
+
+    consultas = []
+    def capturar(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("SELECT") and "FROM users" in statement:
+            consultas.append(statement)
+    event.listen(engine, "before_cursor_execute", capturar)
+    try:
+        for _ in range(3):
+            assert client.get("/minha-conta/minha-conta").status_code == 200
+        assert len(consultas) == 1, consultas  # Explicação: só a primeira requisição vai ao banco
+        assert user_cache.stats()["hits"] >= 2
+
+        resposta = client.post("/minha-conta/editar-perfil", data={
+            "username": "renomeado", "email": "teste@teste.com", "senha": "Nova@1234", "confirmar_senha": "Nova@1234",
+        })
+        assert resposta.status_code == 302
+        assert "renomeado" in client.get("/minha-conta/minha-conta").get_data(as_text=True)
+    finally:
+        event.remove(engine, "before_cursor_execute", capturar)
+
+    client.get("/auth/logout")
+    client.post("/auth/login", data={"email": "teste@teste.com", "senha": "Nova@1234"})
+    assert client.get("/minha-conta/minha-conta").status_code == 200
+
+
+def test_busca_no_historico():
+    """Testa a busca FTS5: relevância, destaque escapado, paginação, escopo do usuário e sincronia"""
+    from app.models import Conversation, Message, User
+    from app.services import chat_service
+
+    app, client, conversa_id = _app_com_usuario_logado()
+    app.config["SEARCH_RESULTS_PER_PAGE"] = 2
+    with app.app_context():
+        outro = User(username="outro", email="outro@teste.com", password_hash="x")
+        db.session.add(outro)
+        db.session.commit()
+        alheia = Conversation(title="Alheia", user_id=outro.id)
+        db.session.add(alheia)
+        db.session.commit()
+
+        chat_service.create_user_turn(alheia.id, "Receita de pão de queijo")
+        mensagem = chat_service.create_user_turn(conversa_id, "Como fazer pão <b>caseiro</b>?")
+        chat_service.complete_turn(mensagem.id, "Para o pão caseiro use farinha, água e fermento. Pão pão pão.")
+        chat_service.create_user_turn(conversa_id, "Qual a melhor farinha para pão?")
+        editada = chat_service.create_user_turn(conversa_id, "texto que vai mudar")
+        editada_id = editada.id
+
+    resposta = client.get("/minha-conta/busca?q=pao")  # Explicação: sem acento também encontra
+    dados = resposta.get_json()
+    assert resposta.status_code == 200
+    assert len(dados["resultados"]) == 2 and dados["proxima_pagina"] == 2
+    assert dados["resultados"][0]["snippet"].count("<mark>") >= 3  # Explicação: a mais relevante primeiro
+    assert all(r["conversation_id"] == conversa_id for r in dados["resultados"])
+
+    segunda = client.get("/minha-conta/busca?q=pao&pagina=2").get_json()
+    assert len(segunda["resultados"]) == 1 and segunda["proxima_pagina"] is None
+    assert "&lt;b&gt;caseiro&lt;/b&gt;" in segunda["resultados"][0]["snippet"]  # Explicação: HTML do usuário escapado
+
+    # Explicação: o link abre a página da conversa que termina na mensagem encontrada
+    pagina = client.get(segunda["resultados"][0]["url"]).get_data(as_text=True)
+    assert "caseiro" in pagina and "melhor farinha" not in pagina
+
+    assert client.get('/minha-conta/busca?q="ferm* (').get_json()["resultados"]  # Explicação: sintaxe do FTS5 não quebra
+    assert "<mark>fermento</mark>" in client.get("/minha-conta/buscar?q=ferm").get_data(as_text=True)
+
+    # Explicação: os triggers mantêm o índice em dia em UPDATE e DELETE
+    with app.app_context():
+        db.session.get(Message, editada_id).content = "agora fala de bicicleta"
+        db.session.commit()
+    assert client.get("/minha-conta/busca?q=bicicleta").get_json()["resultados"]
+    assert not client.get("/minha-conta/busca?q=mudar").get_json()["resultados"]
+    client.post(f"/minha-conta/apagar-conversa/{conversa_id}")
+    assert not client.get("/minha-conta/busca?q=pao").get_json()["resultados"]
+
+
+def test_arquivo_frio_das_conversas_antigas():
+    """Testa a compressão das conversas antigas e a volta das mensagens ao abrir a conversa"""
+    from datetime import datetime, timedelta
+    from app.models import ArchiveDictionary, Conversation, ConversationArchive, Message
+    from app.services import archive, chat_service
+
+    app, client, conversa_id = _app_com_usuario_logado()
+    with app.app_context():
+        user_id = db.session.get(Conversation, conversa_id).user_id
+        recente = Conversation(title="Recente", user_id=user_id)
+        db.session.add(recente)
+        db.session.commit()
+        recente_id = recente.id
+        for numero in range(5):
+            chat_service.complete_turn(
+                chat_service.create_user_turn(conversa_id, f"Pergunta {numero} sobre bancos de dados").id,
+                f"Resposta {numero}: " + "índices e consultas em SQL " * 20,
+            )
+        chat_service.complete_turn(chat_service.create_user_turn(recente_id, "oi").id, "olá")
+        originais = [
+            (m.id, m.role, m.content, m.timestamp, m.status, m.prompt_tokens, m.response_tokens)
+            for m in Message.query.filter_by(conversation_id=conversa_id).order_by(Message.id)
+        ]
+        Conversation.query.filter_by(id=conversa_id).update(
+            {Conversation.updated_at: datetime.utcnow() - timedelta(days=120)}, synchronize_session=False
+        )
+        db.session.commit()
+
+        # Step 1: só a conversa antiga é arquivada; as mensagens saem de `messages`
+        relatorio = archive.archive_old_conversations(days=90)
+        assert relatorio["conversations"] == 1 and relatorio["messages"] == 10
+        assert relatorio["compressed_bytes"] < relatorio["raw_bytes"] / 3
+        assert relatorio["dictionary_id"] == ArchiveDictionary.query.one().id
+        assert Message.query.filter_by(conversation_id=conversa_id).count() == 0
+        assert Message.query.filter_by(conversation_id=recente_id).count() == 2
+        arquivada = db.session.get(Conversation, conversa_id)
+        assert arquivada.archived_at is not None and arquivada.message_count == 10
+        assert db.session.get(ConversationArchive, conversa_id).codec == "zlib"
+        assert archive.archive_old_conversations(days=90)["conversations"] == 0
+
+    # Step 2: abrir a conversa devolve as mensagens, com os mesmos IDs e dados
+    resposta = client.get(f"/minha-conta/conversa/{conversa_id}")
+    assert resposta.status_code == 200 and "Resposta 4" in resposta.get_data(as_text=True)
+    with app.app_context():
+        restauradas = [
+            (m.id, m.role, m.content, m.timestamp, m.status, m.prompt_tokens, m.response_tokens)
+            for m in Message.query.filter_by(conversation_id=conversa_id).order_by(Message.id)
+        ]
+        assert restauradas == originais
+        assert db.session.get(Conversation, conversa_id).archived_at is None
+        assert ConversationArchive.query.count() == 0
+
+        # Step 3: sem dicionário a conversa também volta inteira
+        Conversation.query.filter_by(id=conversa_id).update(
+            {Conversation.updated_at: datetime.utcnow() - timedelta(days=120)}, synchronize_session=False
+        )
+        db.session.commit()
+        assert archive.archive_old_conversations(days=90, use_dictionary=False)["conversations"] == 1
+        assert db.session.get(ConversationArchive, conversa_id).dictionary_id is None
+
+    resposta = client.get(f"/minha-conta/conversa/{conversa_id}/mensagens?limite=50")
+    assert len(resposta.get_json()["mensagens"]) == 10
+
+
+def test_exportacao_das_conversas():
+    """Testa a exportação em streaming (NDJSON e ZIP), incluindo conversas do arquivo frio"""
+    import io
+    import json
+    import zipfile
+    from app.models import Conversation
+    from app.services import archive, chat_service
+
+    app, client, conversa_id = _app_com_usuario_logado()
+    with app.app_context():
+        user_id = db.session.get(Conversation, conversa_id).user_id
+        antiga = Conversation(title="Antiga", user_id=user_id)
+        db.session.add(antiga)
+        db.session.commit()
+        antiga_id = antiga.id
+        for numero in range(3):
+            chat_service.complete_turn(chat_service.create_user_turn(conversa_id, f"oi {numero}").id, "olá")
+        chat_service.complete_turn(chat_service.create_user_turn(antiga_id, "pergunta antiga").id, "resposta")
+        assert archive.archive_conversation(antiga_id) is not None
+
+    # Step 1: NDJSON - a conversa seguida das suas mensagens, em ordem
+    resposta = client.get("/minha-conta/exportar?formato=ndjson")
+    assert resposta.status_code == 200 and resposta.is_streamed
+    assert resposta.mimetype == "application/x-ndjson"
+    assert "attachment" in resposta.headers["Content-Disposition"]
+    linhas = [json.loads(linha) for linha in resposta.get_data(as_text=True).splitlines()]
+    assert [linha["type"] for linha in linhas] == ["conversation"] + ["message"] * 6 + ["conversation"] + ["message"] * 2
+    assert linhas[1]["content"] == "oi 0" and linhas[1]["conversation_id"] == conversa_id
+    assert linhas[7]["title"] == "Antiga" and linhas[8]["content"] == "pergunta antiga"
+
+    # Step 2: ZIP - um JSON por conversa; a conversa arquivada continua arquivada
+    resposta = client.get("/minha-conta/exportar?formato=zip")
+    assert resposta.status_code == 200 and resposta.mimetype == "application/zip"
+    with zipfile.ZipFile(io.BytesIO(resposta.get_data())) as arquivo_zip:
+        assert sorted(arquivo_zip.namelist()) == sorted([f"conversas/{conversa_id}.json", f"conversas/{antiga_id}.json"])
+        exportada = json.loads(arquivo_zip.read(f"conversas/{antiga_id}.json"))
+    assert [m["content"] for m in exportada["messages"]] == ["pergunta antiga", "resposta"]
+    with app.app_context():
+        assert db.session.get(Conversation, antiga_id).archived_at is not None
+
+    assert client.get("/minha-conta/exportar?formato=xml").status_code == 400
+
+
+def test_html_das_mensagens_salvo_ao_gravar():
+    """Testa o HTML (Markdown limpo) gerado ao salvar, o preenchimento das antigas e o uso na conversa"""
+    from app.models import Message
+    from app.services import chat_service, rendering
+
+    # Step 1: Markdown vira HTML, código ganha destaque e HTML perigoso é removido
+    html = rendering.render_message("**negrito** <script>alert(1)</script>\n\n```python\nx = 1\n```")
+    assert "<strong>negrito</strong>" in html and 'class="codehilite"' in html
+    assert "<script" not in html
+    assert 'href="javascript' not in rendering.render_message("[x](javascript:alert(1))")
+    assert "onerror" not in rendering.render_message('<img src=x onerror="alert(1)">')
+    # Explicação: só as classes do destaque de código passam (nada de classes do Bootstrap)
+    assert rendering.render_message('<div class="position-fixed vw-100 codehilite"><span class="modal k">x</span></div>') == \
+        '<div class="codehilite"><span class="k">x</span></div>'
+
+    app, client, conversa_id = _app_com_usuario_logado()
+    with app.app_context():
+        chat_service.complete_turn(
+            chat_service.create_user_turn(conversa_id, "<img src=x onerror=alert(1)>").id, "Use `print()`"
+        )
+        salvas = Message.query.filter_by(conversation_id=conversa_id).order_by(Message.id).all()
+        assert [m.content_html for m in salvas] == ["<p></p>", "<p>Use <code>print()</code></p>"]
+
+        # Step 2: mensagens antigas (sem HTML) são preenchidas pelo backfill
+        Message.query.update({Message.content_html: None}, synchronize_session=False)
+        db.session.commit()
+        assert rendering.backfill() == 2 and rendering.backfill() == 0
+        assert db.session.get(Message, salvas[1].id).content_html == "<p>Use <code>print()</code></p>"
+
+        # Explicação: a conversa usa o HTML salvo, sem renderizar de novo
+        Message.query.filter_by(id=salvas[1].id).update({Message.content_html: "<p>HTML salvo</p>"})
+        db.session.commit()
+
+    pagina = client.get(f"/minha-conta/conversa/{conversa_id}").get_data(as_text=True)
+    assert "<p>HTML salvo</p>" in pagina
+    assert "onerror" not in pagina and "<img" not in pagina
+    mensagens = client.get(f"/minha-conta/conversa/{conversa_id}/mensagens").get_json()["mensagens"]
+    assert mensagens[-1]["html"] == "<p>HTML salvo</p>"
+
+
+def test_cache_de_trechos_renderizados(monkeypatch, tmp_path):
+    """Testa o cache do HTML das mensagens e da lista de conversas, com a chave mudando a cada escrita"""
+    from sqlalchemy import event
+    from app.services import chat_service
+    from app.services.fragment_cache import FragmentCache
+
+    # Explicação: cache com disco, para testar também a camada compartilhada entre workers
+    cache = FragmentCache(directory=str(tmp_path / "fragmentos"))
+    monkeypatch.setattr("app.routes.auth.minha_conta.fragment_cache", cache)
+    app, client, conversa_id = _app_com_usuario_logado()
+    with app.app_context():
+        chat_service.complete_turn(chat_service.create_user_turn(conversa_id, "primeira pergunta").id, "resposta 1")
+        engine = db.engine
+
+    consultas = []
+    def capturar(conn, cursor, statement, parameters, context, executemany):
+        consultas.append(statement)
+
+    def abrir(url):
+        consultas.clear()
+        event.listen(engine, "before_cursor_execute", capturar)
+        try:
+            resposta = client.get(url)
+        finally:
+            event.remove(engine, "before_cursor_execute", capturar)
+        assert resposta.status_code == 200
+        return resposta.get_data(as_text=True)
+
+    url_conversa = f"/minha-conta/conversa/{conversa_id}"
+    primeira = abrir(url_conversa)
+    assert "resposta 1" in primeira and cache.stats()["memory"]["misses"] == 1
+
+    # Step 1: sem mudança, a página das mensagens não é buscada de novo (só a última mensagem)
+    def lista(pagina):
+        return pagina[pagina.index('class="chat-messages"'):pagina.index('id="form-mensagem"')]
+    assert lista(abrir(url_conversa)) == lista(primeira)
+    assert len([c for c in consultas if "FROM messages" in c]) == 1, consultas
+    assert cache.stats()["memory"]["hits"] == 1
+
+    # Step 2: mensagem nova muda a chave, sem invalidação explícita
+    with app.app_context():
+        chat_service.complete_turn(chat_service.create_user_turn(conversa_id, "segunda pergunta").id, "resposta 2")
+    assert "resposta 2" in abrir(url_conversa)
+
+    # Step 3: a lista de conversas do Minha Conta usa max(updated_at) e o total na chave
+    assert "Conversa de teste" in abrir("/minha-conta/minha-conta")
+    assert "Conversa de teste" in abrir("/minha-conta/minha-conta")
+    assert not [c for c in consultas if "ORDER BY" in c], consultas
+    client.post("/minha-conta/nova-conversa", data={"title": "Outra conversa"})
+    assert "Outra conversa" in abrir("/minha-conta/minha-conta")
+
+    # Step 4: outro processo (memória vazia) reaproveita o trecho gravado em disco
+    cache._cache.memory.clear()
+    assert "resposta 2" in abrir(url_conversa)
+    assert cache.stats()["disk"]["hits"] >= 1
+    assert len([c for c in consultas if "FROM messages" in c]) == 1, consultas
+
+    # Step 5: templates novos (deploy) mudam a chave; o trecho antigo do disco não é usado
+    monkeypatch.setitem(app.extensions, "templates_version", "deploy-novo")
+    abrir(url_conversa)
+    assert len([c for c in consultas if "FROM messages" in c]) == 2, consultas
+
+    # Step 6: clear() apaga também o disco e muda a geração (a chave dos outros workers)
+    geracao = cache.generation()
+    cache.clear()
+    assert cache.generation() != geracao
+    assert not [nome for nome in os.listdir(tmp_path / "fragmentos") if nome.endswith(".json")]
+    abrir(url_conversa)
+    assert len([c for c in consultas if "FROM messages" in c]) == 2, consultas
+
+
+def test_api_v1_conversas_e_mensagens(monkeypatch):
+    """Testa a API JSON: conversas, mensagens, envio com tarefa, exclusão e erros em JSON"""
+    from app.services.gemini_service import gemini_service
+
+    app, client, conversa_id = _app_com_usuario_logado()
+    monkeypatch.setattr(gemini_service, "send_message", _resposta_falsa("**Resposta**"))
+
+    # Step 1: sem login a API responde 401 em JSON (sem redirect)
+    anonimo = app.test_client().get("/api/v1/conversas")
+    assert anonimo.status_code == 401 and "error" in anonimo.get_json()
+
+    # Step 2: cria e lista conversas
+    criada = client.post("/api/v1/conversas", json={"title": "Pela API"})
+    assert criada.status_code == 201 and criada.headers["Location"].endswith(f"/api/v1/conversas/{criada.get_json()['id']}")
+    nova_id = criada.get_json()["id"]
+    lista = client.get("/api/v1/conversas?limite=1").get_json()
+    assert [c["title"] for c in lista["conversas"]] == ["Pela API"] and lista["next_cursor"]
+    proxima = client.get(f"/api/v1/conversas?cursor={lista['next_cursor']}").get_json()
+    assert [c["id"] for c in proxima["conversas"]] == [conversa_id]
+
+    # Step 3: envia mensagem (202 + tarefa, executada na hora nos testes) e lê as mensagens
+    enviada = client.post(f"/api/v1/conversas/{nova_id}/mensagens", json={"content": "oi"})
+    assert enviada.status_code == 202
+    tarefa = client.get(enviada.get_json()["tarefa"]["url"]).get_json()
+    assert tarefa["status"] == "done" and tarefa["result"]["success"] is True
+    mensagens = client.get(f"/api/v1/conversas/{nova_id}/mensagens").get_json()["mensagens"]
+    assert [(m["role"], m["content"]) for m in mensagens] == [("assistant", "**Resposta**"), ("user", "oi")]
+    assert mensagens[0]["html"] == "<p><strong>Resposta</strong></p>"
+
+    # Step 4: apaga a resposta; a conversa volta a ter só a pergunta
+    resposta_id = mensagens[0]["id"]
+    assert client.get(f"/api/v1/conversas/{nova_id}").get_json()["total_tokens"] > 0
+    assert client.delete(f"/api/v1/conversas/{nova_id}/mensagens/{resposta_id}").status_code == 204
+    assert client.get(f"/api/v1/conversas/{nova_id}/mensagens/{resposta_id}").status_code == 404
+    conversa = client.get(f"/api/v1/conversas/{nova_id}").get_json()
+    assert conversa["message_count"] == 1 and conversa["last_message_preview"] == "oi"
+    assert conversa["total_tokens"] == 0  # Explicação: os tokens do turno saem com a resposta
+
+    # Step 5: escritas só com JSON; conversa de outro usuário ou apagada = 404
+    formulario = client.post(f"/api/v1/conversas/{nova_id}/mensagens", data={"content": "oi"})
+    assert formulario.status_code == 415 and formulario.get_json()["error"]
+    assert client.post("/api/v1/conversas", json={"title": ""}).status_code == 400
+    assert client.get("/api/v1/conversas?cursor=xyz").status_code == 400
+    assert client.delete(f"/api/v1/conversas/{nova_id}").status_code == 204
+    apagada = client.get(f"/api/v1/conversas/{nova_id}")
+    assert apagada.status_code == 404 and list(apagada.get_json()) == ["error"]
+
+
+def test_get_condicional_das_paginas(monkeypatch):
+    """Testa ETag/Last-Modified e o 304 sem buscar nem renderizar as mensagens"""
+    from sqlalchemy import event
+    from app.services import chat_service
+
+    app, client, conversa_id = _app_com_usuario_logado()
+    with app.app_context():
+        chat_service.complete_turn(chat_service.create_user_turn(conversa_id, "pergunta").id, "resposta 1")
+        engine = db.engine
+    url_conversa = f"/minha-conta/conversa/{conversa_id}"
+    client.get("/minha-conta/minha-conta")  # Explicação: consome o flash do login
+
+    # Step 1: a primeira visita recebe o ETag; a segunda, com If-None-Match, recebe 304 vazio
+    primeira = client.get(url_conversa)
+    etag = primeira.headers["ETag"]
+    assert primeira.status_code == 200 and primeira.last_modified is not None
+    assert primeira.headers["Cache-Control"] == "private, no-cache" and "Cookie" in primeira.headers["Vary"]
+
+    consultas = []
+    def capturar(conn, cursor, statement, parameters, context, executemany):
+        consultas.append(statement)
+    renderizados = []
+    monkeypatch.setattr("app.routes.auth.minha_conta.render_template",
+                        lambda *a, **k: renderizados.append(a) or "")
+    event.listen(engine, "before_cursor_execute", capturar)
+    try:
+        repetida = client.get(url_conversa, headers={"If-None-Match": etag})
+    finally:
+        event.remove(engine, "before_cursor_execute", capturar)
+    monkeypatch.undo()
+    assert repetida.status_code == 304 and repetida.data == b"" and repetida.headers["ETag"] == etag
+    assert not renderizados
+    assert len([c for c in consultas if "FROM messages" in c]) == 1, consultas  # Explicação: só a última mensagem
+    assert not [c for c in consultas if "FROM jobs" in c], consultas
+
+    # Step 2: If-Modified-Since sozinho não dá 304 (a data não cobre usuário, versão e página)
+    desde = client.get(url_conversa, headers={"If-Modified-Since": primeira.headers["Last-Modified"]})
+    assert desde.status_code == 200 and desde.last_modified == primeira.last_modified
+
+    # Step 3: mensagem nova muda o ETag; outra página (cursor) não reaproveita o ETag
+    with app.app_context():
+        chat_service.complete_turn(chat_service.create_user_turn(conversa_id, "outra").id, "resposta 2")
+    nova = client.get(url_conversa, headers={"If-None-Match": etag})
+    assert nova.status_code == 200 and "resposta 2" in nova.get_data(as_text=True)
+    assert nova.headers["ETag"] != etag
+    assert client.get(url_conversa + "?antes=xyz", headers={"If-None-Match": nova.headers["ETag"]}).status_code == 400
+
+    # Step 3.1: conversa arquivada responde 304 sem voltar do arquivo frio
+    from app.models import Conversation
+    from app.services import archive
+    with app.app_context():
+        assert archive.archive_conversation(conversa_id) is not None
+    arquivada = client.get(url_conversa)  # Explicação: renderizar restaura as mensagens
+    assert arquivada.status_code == 200 and "resposta 2" in arquivada.get_data(as_text=True)
+    with app.app_context():
+        assert archive.archive_conversation(conversa_id) is not None
+    assert client.get(url_conversa, headers={"If-None-Match": arquivada.headers["ETag"]}).status_code == 304
+    with app.app_context():
+        assert db.session.get(Conversation, conversa_id).archived_at is not None
+
+    # Step 4: lista de conversas e histórico mudam com uma conversa nova
+    for url in ("/minha-conta/minha-conta", "/minha-conta/historico-conversas"):
+        antes = client.get(url).headers["ETag"]
+        assert client.get(url, headers={"If-None-Match": antes}).status_code == 304
+        with app.app_context():
+            from app.models import User
+            db.session.add(Conversation(title=f"Nova {url}", user_id=User.query.first().id))
+            db.session.commit()
+        depois = client.get(url, headers={"If-None-Match": antes})
+        assert depois.status_code == 200 and f"Nova {url}" in depois.get_data(as_text=True)
+
+    # Step 5: com mensagem flash pendente a página é sempre renderizada (o flash não se perde)
+    etag_lista = client.get("/minha-conta/minha-conta").headers["ETag"]
+    with client.session_transaction() as sessao:
+        sessao["_flashes"] = [("success", "aviso pendente")]
+    com_flash = client.get("/minha-conta/minha-conta", headers={"If-None-Match": etag_lista})
+    assert com_flash.status_code == 200 and "aviso pendente" in com_flash.get_data(as_text=True)
+
+
+def test_arquivos_estaticos_com_hash(tmp_path):
+    """Testa `flask build-assets`, o asset_url() e o cache imutável com as versões comprimidas"""
+    import gzip
+    import shutil
+    from app.services import assets
+
+    app, client, _ = _app_com_usuario_logado()
+    app.static_folder = str(shutil.copytree(app.static_folder, tmp_path / "static"))
+
+    # Step 1: sem manifest os templates usam os arquivos originais
+    assert "/static/css/style.css" in client.get("/").get_data(as_text=True)
+
+    # Step 2: o build gera os nomes com hash, o .gz e o manifest
+    resultado = app.test_cli_runner().invoke(args=["build-assets"])
+    assert resultado.exit_code == 0, resultado.output
+    app.extensions["assets_manifest"] = assets.load_manifest(app)
+    css = app.extensions["assets_manifest"]["css/style.css"]
+    assert css.startswith("dist/css/style.") and (tmp_path / "static" / (css + ".gz")).exists()
+    pagina = client.get("/").get_data(as_text=True)
+    assert f"/static/{css}" in pagina and "/static/dist/js/main." in pagina
+
+    # Step 3: o navegador que aceita gzip recebe o .gz; todos com cache de um ano, immutable
+    comprimido = client.get(f"/static/{css}", headers={"Accept-Encoding": "gzip, deflate"})
+    assert comprimido.status_code == 200 and comprimido.headers["Content-Encoding"] == "gzip"
+    assert comprimido.headers["Cache-Control"] == "public, max-age=31536000, immutable"
+    assert comprimido.mimetype == "text/css" and "Accept-Encoding" in comprimido.headers["Vary"]
+    original = client.get(f"/static/{css}")
+    assert "Content-Encoding" not in original.headers and "immutable" in original.headers["Cache-Control"]
+    assert gzip.decompress(comprimido.data) == original.data
+    assert len(original.data) < (tmp_path / "static" / "css" / "style.css").stat().st_size
+
+    # Step 4: os arquivos originais continuam no handler padrão, sem cache imutável
+    assert "immutable" not in client.get("/static/js/main.js").headers.get("Cache-Control", "")
+
+    # Step 5: a minificação só tira espaço e comentário (strings, regex e quebras de linha ficam)
+    assert assets.minify_css("a :hover { color: red ; } /* x */ .b > .c { content: ' x ' }") == \
+        "a :hover{color:red;}.b>.c{content:' x '}"
+    assert assets.minify_js("// c\nconst a = 'x  y'; /* c */\nlet b = a\n  .replace(/\\/ +/g, '')\nreturn b") == \
+        "const a='x  y';let b=a\n.replace(/\\/ +/g,'')\nreturn b"
+
+
+def test_tarefa_pendente_da_propria_conversa():
+    """Testa que a conversa acompanha a tarefa do próprio turno pendente, não a de outra conversa"""
+    import json
+    from app.models import Conversation, Job
+    from app.services import chat_service
+
+    app, client, conversa_id = _app_com_usuario_logado()
+    with app.app_context():
+        outra = Conversation(title="Outra", user_id=db.session.get(Conversation, conversa_id).user_id)
+        db.session.add(outra)
+        db.session.commit()
+        tarefas = {}
+        for cid in (conversa_id, outra.id):  # Explicação: a tarefa da outra conversa é a mais nova
+            mensagem = chat_service.create_user_turn(cid, f"pergunta {cid}")
+            job = Job(kind="reply", payload=json.dumps({"message_id": mensagem.id}),
+                      user_id=outra.user_id, status=Job.STATUS_QUEUED)
+            db.session.add(job)
+            db.session.commit()
+            tarefas[cid] = job.id
+        outra_id = outra.id
+
+    client.get("/minha-conta/minha-conta")  # Explicação: consome o flash do login
+    for cid in (conversa_id, outra_id):
+        pagina = client.get(f"/minha-conta/conversa/{cid}").get_data(as_text=True)
+        assert f"/minha-conta/tarefas/{tarefas[cid]}" in pagina
+        outra_tarefa = tarefas[outra_id if cid == conversa_id else conversa_id]
+        assert f"/minha-conta/tarefas/{outra_tarefa}" not in pagina
+
+
+def test_tarefa_presa_e_turno_concluido_uma_vez():
+    """Testa o requeue atômico das tarefas presas e que um turno só é concluído por um worker"""
+    import json
+    from datetime import datetime, timedelta
+    from app.models import Conversation, Job, Message
+    from app.services import chat_service
+    from app.services.job_queue import job_queue
+
+    app, client, conversa_id = _app_com_usuario_logado()
+    with app.app_context():
+        antiga = datetime.utcnow() - timedelta(seconds=app.config["JOB_QUEUE_STALE_AFTER"] + 60)
+        tarefas = {}
+        for tentativas in (1, app.config["JOB_QUEUE_MAX_ATTEMPTS"]):
+            mensagem = chat_service.create_user_turn(conversa_id, f"pergunta {tentativas}")
+            job = Job(kind="reply", payload=json.dumps({"message_id": mensagem.id}), status=Job.STATUS_RUNNING,
+                      started_at=antiga, attempts=tentativas)
+            db.session.add(job)
+            db.session.commit()
+            tarefas[tentativas] = (job.id, mensagem.id)
+
+        # Step 1: a tarefa com tentativas sobrando volta para a fila; a outra falha uma vez só
+        job_queue.requeue_stale()
+        job_queue.requeue_stale()
+
+        (devolvida, pendente), (abandonada, falha) = tarefas.values()
+        assert db.session.get(Job, devolvida).status == Job.STATUS_QUEUED
+        assert db.session.get(Job, abandonada).status == Job.STATUS_FAILED
+        assert db.session.get(Message, falha).status == Message.STATUS_FAILED
+        assert Message.query.filter_by(role="assistant").count() == 1
+
+        # Step 2: dois workers terminam o mesmo turno, só o primeiro grava
+        assert chat_service.complete_turn(pendente, "resposta", usage={"prompt_tokens": 3, "response_tokens": 4})
+        assert chat_service.complete_turn(pendente, "resposta", usage={"prompt_tokens": 3, "response_tokens": 4}) is None
+        assert chat_service.fail_turn(pendente, "erro") is None
+        conversa = db.session.get(Conversation, conversa_id)
+        assert conversa.total_tokens == 7
+        assert conversa.message_count == Message.query.filter_by(conversation_id=conversa_id).count() == 4
+
+
+def test_fila_retoma_tarefas_na_primeira_requisicao(monkeypatch, tmp_path):
+    """Testa que tarefas que ficaram na fila andam sem esperar um enqueue novo"""
+    import time
+    from config import Config
+    from app.models import Job
+    from app.services.job_queue import job_queue
+
+    monkeypatch.setattr(Config, "SQLALCHEMY_DATABASE_URI", f"sqlite:///{tmp_path / 'fila.db'}")
+    monkeypatch.setattr(Config, "JOB_QUEUE_WORKERS", 1)
+    app, client, _ = _app_com_usuario_logado()
+    with app.app_context():
+        # Explicação: tarefa deixada por um processo anterior (a mensagem não existe mais)
+        job = Job(kind="reply", payload='{"message_id": 999}', status=Job.STATUS_QUEUED)
+        db.session.add(job)
+        db.session.commit()
+        job_id = job.id
+
+    try:
+        client.get("/")
+        limite = time.monotonic() + 5
+        while time.monotonic() < limite:
+            with app.app_context():
+                if db.session.get(Job, job_id).status == Job.STATUS_DONE:
+                    break
+            time.sleep(0.05)
+    finally:
+        job_queue.stop()
+
+    with app.app_context():
+        assert db.session.get(Job, job_id).status == Job.STATUS_DONE
+
+
+def test_cache_em_camadas_validade_e_limpeza_do_disco(tmp_path):
+    """Testa que o valor vindo do disco mantém a validade de lá e que a pasta só é listada acima do limite"""
+    import time
+    from app.services.cache import DiskCache, LRUCache, TieredCache
+
+    # Step 1: a entrada do disco expira em 5s, a memória não dá de novo o TTL cheio (100s)
+    disco = DiskCache(str(tmp_path / "validade"), ttl=100)
+    disco.set("chave", "valor", ttl=5)
+    cache = TieredCache(LRUCache(ttl=100), disco)
+    assert cache.get("chave") == "valor"
+    expira_em, _ = cache.memory._items["chave"]
+    assert expira_em <= time.time() + 5
+
+    # Step 2: listagens da pasta só na primeira contagem e quando passa do limite
+    disco = DiskCache(str(tmp_path / "limite"), max_entries=10, low_water=0.5)
+    listagens = []
+    listar = disco._list
+    disco._list = lambda: listagens.append(1) or listar()
+    for numero in range(11):
+        disco.set(f"k{numero}", numero)
+    assert len(listagens) == 2
+    assert len(listar()) == 5 and disco.stats.evictions == 6
+    assert disco.get("k10") == 10
+
+    for numero in range(11, 16):
+        disco.set(f"k{numero}", numero)
+    disco.set("k15", "de novo")  # Explicação: sobrescrever não conta arquivo novo
+    assert len(listagens) == 2 and len(listar()) == 10
+
+
 if __name__ == '__main__':
     print(" Iniciando testes da aplicação...")
     print("=" * 50)
@@ -76,4 +1350,4 @@ if __name__ == '__main__':
     if passed == len(tests):
         print(" Todos os testes passaram! Aplicação pronta.")
     else:
-        print(" Alguns testes falharam. Verifique os erros acima.")
\ No newline at end of file
+        print(" Alguns testes falharam. Verifique os erros acima.")